@@ -0,0 +1,27 @@
+"""Shared fixtures for the benchmarks."""
+
+import pytest
+
+from tests import vaultgen
+
+
+@pytest.fixture(scope="session")
+def make_vault():
+    """Return a function generating a vault of a given size as bwm keeps it
+    in memory: (items, folders, collections, orgs). Vaults are generated once
+    per session.
+
+    """
+    vaults = {}
+
+    def make(items):
+        if items not in vaults:
+            vaults[items] = vaultgen.loaded(
+                vaultgen.generate(items=items, folders=max(items // 50, 1))
+            )
+        return vaults[items]
+
+    return make
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,22 @@
+"""Benchmarks for loading items."""
+
+import json
+
+from bwm.bwcli import Item
+from tests import vaultgen
+
+NUM_ITEMS = 10000
+
+
+def test_item(benchmark):
+    """Wrap the parsed `bw list items` output in Items"""
+    data = json.dumps(vaultgen.generate(items=NUM_ITEMS)["items"])
+    items = benchmark.pedantic(
+        lambda raw: [Item(i) for i in raw],
+        setup=lambda: ((json.loads(data),), {}),
+        rounds=20,
+    )
+    assert len(items) == NUM_ITEMS
+
+
+# vim: set et ts=4 sw=4 :
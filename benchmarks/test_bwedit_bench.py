@@ -0,0 +1,25 @@
+"""Benchmarks for password generation."""
+
+import string
+
+import pytest
+
+from bwm.bwedit import gen_passwd
+
+CHARS = {
+    "Letters+Digits+Punctuation": {
+        "upper": string.ascii_uppercase,
+        "lower": string.ascii_lowercase,
+        "digits": string.digits,
+        "punctuation": string.punctuation,
+    }
+}
+
+
+@pytest.mark.parametrize("length", [20, 128])
+def test_gen_passwd(benchmark, length):
+    """Generate a password from all character sets"""
+    assert len(benchmark(gen_passwd, CHARS, length)) == length
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,33 @@
+"""Benchmarks for loading the vault from bw serve (the tests/fakebw.py
+stand-in)."""
+
+import json
+
+import pytest
+
+from bwm.bwserve import BWCLIServer
+from bwm.bwserve_async import BWServePool
+from tests import fakebw, vaultgen
+
+
+@pytest.fixture(scope="module", params=[1000, 10000])
+def vault_file(request, tmp_path_factory):
+    """Generated vault saved for the stand-in"""
+    path = tmp_path_factory.mktemp("fakebw") / "vault.json"
+    path.write_text(json.dumps(vaultgen.generate(items=request.param)))
+    return path
+
+
+@pytest.mark.parametrize("server_class", [BWCLIServer, BWServePool])
+def test_get_entries(benchmark, vault_file, server_class):
+    """List items, folders, collections and organizations"""
+    server = server_class(env=fakebw.environ(vault_file))
+    try:
+        assert server.start(session=fakebw.SESSION)
+        items, _, _, _ = benchmark(server.get_entries)
+    finally:
+        server.stop()
+    assert items
+
+
+# vim: set et ts=4 sw=4 :
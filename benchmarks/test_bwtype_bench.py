@@ -0,0 +1,45 @@
+"""Benchmarks for parsing and dispatching autotype sequences."""
+
+from unittest.mock import patch
+
+import pytest
+
+from bwm.bwtype import tokenize_autotype, type_entry_xdotool
+
+SEQUENCE = (
+    "{USERNAME}{TAB}{PASSWORD}{TAB}{TOTP}{ENTER}{DELAY 0}"
+    "literal text{+}{%}{^}{~}{(}{)}{[}{]}{{}{}}{URL}{TAB}{TITLE}{ENTER}"
+)
+
+
+@pytest.fixture
+def entry(make_vault):
+    """Login entry with a TOTP and URIs"""
+    return next(
+        i
+        for i in make_vault(100)[0]
+        if i["type"] == 1 and i["login"]["totp"] and i["login"]["uris"]
+    )
+
+
+def test_tokenize(benchmark):
+    """Split a long sequence into tokens"""
+    tokens = benchmark(lambda: list(tokenize_autotype(SEQUENCE * 10)))
+    assert len(tokens) == 10 * len(list(tokenize_autotype(SEQUENCE)))
+
+
+def test_tokenize_dispatch(benchmark, entry):
+    """Tokenize a sequence and map each token to its xdotool command (the
+    commands aren't run)
+
+    """
+
+    def run():
+        type_entry_xdotool(entry, tokenize_autotype(SEQUENCE))
+
+    with patch("bwm.bwtype.call") as mock_call:
+        benchmark(run)
+    assert mock_call.call_count
+
+
+# vim: set et ts=4 sw=4 :
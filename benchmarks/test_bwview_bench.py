@@ -0,0 +1,36 @@
+"""Benchmarks for rendering the main menu."""
+
+from unittest.mock import patch
+
+import pytest
+
+from bwm.bwview import encode_rows, view_all_entries
+
+OPTIONS = ["View/Type Individual entries", "Edit entries", "Add entry"]
+
+
+@pytest.mark.parametrize("size", [100, 1000, 10000, 50000])
+def test_view_all_entries(benchmark, make_vault, size):
+    """Build the launcher input of every entry (the launcher isn't run)"""
+    items, folders, _, _ = make_vault(size)
+    with patch("bwm.bwview.dmenu_select") as mock_select:
+        benchmark(view_all_entries, OPTIONS, items, folders)
+    assert (
+        b"".join(mock_select.call_args.kwargs["inp"]).count(b"\n") == size + 2
+    )
+
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_menu_pipeline(benchmark, make_vault, cached):
+    """Write the main menu of 20000 entries to a launcher process (tail) and
+    read the selection, with and without the encoded rows cached
+
+    """
+    items, folders, _, _ = make_vault(20000)
+    rows = encode_rows(items, folders) if cached else None
+    with patch("bwm.menu.dmenu_cmd", return_value=["tail", "-n", "1"]):
+        sel = benchmark(view_all_entries, OPTIONS, items, folders, rows)
+    assert sel.startswith("19999(")
+
+
+# vim: set et ts=4 sw=4 :
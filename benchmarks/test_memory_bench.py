@@ -0,0 +1,48 @@
+"""Memory used by loading and showing a vault.
+
+Peak traced memory of parsing the bw output of a generated vault into Items
+and rendering the main menu must stay under a budget per 1000 items. The
+measured values are saved with the benchmark results (extra_info).
+
+"""
+
+import json
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+from bwm.bwcli import Item
+from bwm.bwview import view_all_entries
+from tests import vaultgen
+
+# Peak bytes per 1000 items (about 5 MB measured with the generated vaults,
+# whose long notes make the bw output about 1.4 MB per 1000 items)
+BUDGET = 8 * 1024 * 1024
+
+
+@pytest.mark.parametrize("size", [1000, 10000])
+def test_load_peak(benchmark, size):
+    """Parse the bw output and render the menu under tracemalloc"""
+    vault = vaultgen.generate(items=size, folders=max(size // 50, 1))
+    output = json.dumps(vault["items"]).encode()
+    folders = {i["id"]: i for i in vault["folders"]}
+
+    def load():
+        tracemalloc.start()
+        try:
+            items = [Item(i) for i in json.loads(output)]
+            with patch("bwm.bwview.dmenu_select"):
+                view_all_entries([], items, folders)
+            retained, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return retained, peak
+
+    retained, peak = benchmark.pedantic(load, rounds=3)
+    benchmark.extra_info["retained_bytes_per_1k"] = retained * 1000 // size
+    benchmark.extra_info["peak_bytes_per_1k"] = peak * 1000 // size
+    assert peak * 1000 / size < BUDGET
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,49 @@
+"""Benchmarks for TOTP generation."""
+
+import base64
+import random
+
+import pytest
+
+from bwm import totp
+
+NUM_SECRETS = 10000
+
+
+@pytest.fixture(scope="module")
+def otp_entries():
+    """Login entries with a mix of TOTP settings"""
+    rnd = random.Random(0)
+    settings = [
+        "period=30&digits=6",
+        "period=30&digits=8&algorithm=SHA256",
+        "period=60&digits=6&algorithm=SHA512",
+        "period=30&digits=5&encoder=steam",
+    ]
+    return [
+        {
+            "id": f"item-{i}",
+            "login": {
+                "totp": "otpauth://totp/Bench:user?secret="
+                + base64.b32encode(rnd.randbytes(20)).decode().rstrip("=")
+                + "&"
+                + settings[i % len(settings)]
+            },
+        }
+        for i in range(NUM_SECRETS)
+    ]
+
+
+def test_gen_otp_per_call(benchmark, otp_entries):
+    """Parse the otpauth URL and decode the secret for every code"""
+    urls = [i["login"]["totp"] for i in otp_entries]
+    codes = benchmark(lambda: [totp.gen_otp(i) for i in urls])
+    assert len(codes) == NUM_SECRETS
+
+
+def test_gen_otps_precomputed(benchmark, otp_entries):
+    """Generate every code in one batch from the cached OTPKeys"""
+    totp.OTP_CACHE.clear()
+    totp.gen_otps(otp_entries)
+    codes = benchmark(totp.gen_otps, otp_entries)
+    assert len(codes) == NUM_SECRETS
@@ -0,0 +1,61 @@
+"""Benchmarks for URL to entry matching."""
+
+import random
+
+import pytest
+
+from bwm.urimatch import REGEX, UriMatcher, uri_matches
+
+NUM_ITEMS = 10000
+URIS_PER_ITEM = 5
+URL = "https://login.site-4242.example.com/account/settings?tab=1"
+
+
+@pytest.fixture(scope="module")
+def uri_entries():
+    """Login entries with several URIs of every match type"""
+    rnd = random.Random(0)
+    entries = []
+    for num in range(NUM_ITEMS):
+        uris = []
+        for _ in range(URIS_PER_ITEM):
+            host = f"{rnd.choice(['', 'www.', 'login.'])}site-{rnd.randrange(5000)}"
+            uri = f"https://{host}.example.com/{rnd.choice(['', 'account'])}"
+            match = rnd.choice([None, 0, 1, 2, 3, 5])
+            if rnd.random() < 0.01:
+                uri, match = rf"site-{rnd.randrange(5000)}\.example\.com", REGEX
+            uris.append({"uri": uri, "match": match})
+        entries.append({"id": f"item-{num}", "login": {"uris": uris}})
+    return entries
+
+
+def test_match_scan(benchmark, uri_entries):
+    """Check every URI of every entry"""
+
+    def scan():
+        return [
+            i["id"]
+            for i in uri_entries
+            if any(
+                uri_matches(URL, j["uri"], j["match"])
+                for j in i["login"]["uris"]
+            )
+        ]
+
+    assert benchmark(scan)
+
+
+def test_match_trie(benchmark, uri_entries):
+    """Look up the URL in the prebuilt host trie"""
+    matcher = UriMatcher()
+    matcher.rebuild(uri_entries)
+    assert benchmark(matcher.match, URL)
+
+
+def test_build_trie(benchmark, uri_entries):
+    """Build the matcher for the whole vault"""
+    matcher = UriMatcher()
+    benchmark(matcher.rebuild, uri_entries)
+    assert len(matcher) == sum(
+        any(j["match"] != 5 for j in i["login"]["uris"]) for i in uri_entries
+    )
@@ -109,6 +109,23 @@ if CONF.has_option("vault", "session_timeout_min"):
     SESSION_TIMEOUT_MIN = int(CONF.get("vault", "session_timeout_min"))
 else:
     SESSION_TIMEOUT_MIN = SESSION_TIMEOUT_DEFAULT_MIN
+# Seconds allowed for each kind of bw CLI command or bw serve request. 0 means
+# no limit. 'watchdog' limits one hotkey activation of the daemon.
+TIMEOUTS = {
+    "default": 30.0,
+    "status": 15.0,
+    "login": 120.0,
+    "unlock": 60.0,
+    "sync": 120.0,
+    "list": 60.0,
+    "edit": 60.0,
+    "serve": 30.0,
+    "watchdog": 600.0,
+}
+for key in TIMEOUTS:
+    if CONF.has_option("timeouts", key):
+        TIMEOUTS[key] = CONF.getfloat("timeouts", key)
+
 if CONF.has_option("vault", "autotype_default"):
     SEQUENCE = CONF.get("vault", "autotype_default")
 if CONF.has_option("vault", "type_library"):
@@ -3,7 +3,13 @@
 import argparse
 from contextlib import closing
 import multiprocessing
-from multiprocessing.managers import BaseManager
+from multiprocessing.connection import (
+    Connection,
+    answer_challenge,
+    deliver_challenge,
+)
+from multiprocessing import managers
+from multiprocessing.managers import BaseManager, dispatch
 import os
 from os.path import exists, expanduser
 import random
@@ -11,11 +17,21 @@ import socket
 import string
 from subprocess import call
 import sys
+import threading
+import time
 
 import bwm
+from bwm import trace
 from bwm.bwm import DmenuRunner
+from bwm.bwscript import format_reply
 from bwm.menu import dmenu_err
 
+# Seconds a scripting request (bwm get/totp/list) waits for the daemon, which
+# answers after any menu that is open is closed
+REPLY_TIMEOUT = 30
+# Replies kept for clients that stopped waiting
+MAX_REPLIES = 32
+
 # Python 3.14 default is 'forkserver'. Set to 'fork' for backwards compatibility
 multiprocessing.set_start_method("fork")
 
@@ -81,15 +97,84 @@ def get_auth():
     return int(port), authkey
 
 
+def nodelay_client(address, authkey=None):
+    """Connect to the manager server like multiprocessing.connection.Client,
+    with Nagle's algorithm off.
+
+    The authentication ends with two small writes from the client (the
+    welcome and the first request), so with Nagle's algorithm the request
+    waits for the delayed ACK (about 40ms) on every connection.
+
+    Returns: Connection
+
+    """
+    with socket.socket(socket.AF_INET) as sock:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.connect(address)
+        conn = Connection(sock.detach())
+    if authkey is not None:
+        answer_challenge(conn, authkey)
+        deliver_challenge(conn, authkey)
+    return conn
+
+
+class NoDelayServer(managers.Server):
+    """Manager server with TCP_NODELAY on the listener (inherited by the
+    accepted connections)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # pylint: disable=protected-access
+        self.listener._listener._socket.setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+        )
+
+
+class Manager(BaseManager):
+    """BaseManager with TCP_NODELAY on both ends of its connections"""
+
+    _Server = NoDelayServer
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._Client = nodelay_client
+
+    def connect(self):
+        """Connect to the server process (BaseManager.connect uses the
+        default Client)"""
+        conn = self._Client(self._address, authkey=self._authkey)
+        with closing(conn):
+            dispatch(conn, None, "dummy")
+        self._state.value = managers.State.STARTED
+
+
+def value_proxy(token, _serializer, manager=None, authkey=None, exposed=None):
+    """Proxy type returning a copy of the result of a manager callable
+    instead of a proxy, so a call costs one connection to create the result
+    and one to copy it (and no proxy reference counting)
+
+    Returns: the result of the callable
+
+    """
+    # pylint: disable=unused-argument
+    conn = nodelay_client(token.address, authkey=authkey)
+    try:
+        dispatch(conn, None, "accept_connection", ("bwm",))
+        return dispatch(conn, token.id, "#GETVALUE")
+    finally:
+        conn.close()
+
+
 def client(port, auth):
     """Define client connection to server BaseManager
 
-    Returns: BaseManager object
+    Returns: Manager object
     """
-    mgr = BaseManager(address=("", port), authkey=auth)
+    mgr = Manager(address=("", port), authkey=auth)
     mgr.register("set_event")
     mgr.register("get_pipe")
     mgr.register("read_args_from_pipe")
+    mgr.register("request", proxytype=value_proxy)
     mgr.connect()
     return mgr
 
@@ -107,6 +192,11 @@ class Server(multiprocessing.Process):  # pylint: disable=too-many-instance-attr
         self.start_flag.set()
         self.args = None
         self._parent_conn, self._child_conn = multiprocessing.Pipe(duplex=False)
+        # Replies to scripting requests, from DmenuRunner to the client
+        self._reply_recv, self._reply_send = multiprocessing.Pipe(duplex=False)
+        self._replies = {}
+        self._reply_lock = threading.Lock()
+        self._request_lock = threading.Lock()
 
     def run(self):
         _ = self.server()
@@ -122,14 +212,52 @@ class Server(multiprocessing.Process):  # pylint: disable=too-many-instance-attr
         """Reads arguments sent by the client to the server"""
         return self._parent_conn.recv()
 
+    def send_reply(self, request_id, reply):
+        """Send the reply to a scripting request (called by DmenuRunner)"""
+        self._reply_send.send((request_id, reply))
+
+    def request(self, args):
+        """Pass a scripting request to DmenuRunner and wait for its reply
+        (called by the client)
+
+        Args: args - dict with the command and its request_id
+        Returns: reply dict {'ok': bool, 'result' or 'error'}
+
+        """
+        with self._request_lock:
+            self._child_conn.send(args)
+            self.args_flag.set()
+            self.start_flag.set()
+        return self.get_reply(args["request_id"])
+
+    def get_reply(self, request_id, timeout=REPLY_TIMEOUT):
+        """Wait for the reply to a scripting request (called by the client)
+
+        Args: request_id - string sent with the request
+              timeout - seconds
+        Returns: reply dict {'ok': bool, 'result' or 'error'}
+
+        """
+        deadline = time.monotonic() + timeout
+        with self._reply_lock:
+            while request_id not in self._replies:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._reply_recv.poll(remaining):
+                    return {"ok": False, "error": "No reply from bwm"}
+                key, reply = self._reply_recv.recv()
+                self._replies[key] = reply
+                while len(self._replies) > MAX_REPLIES:
+                    # Replies for clients that timed out
+                    del self._replies[next(iter(self._replies))]
+            return self._replies.pop(request_id)
+
     def server(self):
         """Set up BaseManager server"""
-        mgr = BaseManager(
-            address=("127.0.0.1", self.port), authkey=self.authkey
-        )
+        mgr = Manager(address=("127.0.0.1", self.port), authkey=self.authkey)
         mgr.register("set_event", callable=self.start_flag.set)
         mgr.register("get_pipe", callable=self._get_pipe)
         mgr.register("read_args_from_pipe", callable=self.args_flag.set)
+        mgr.register("request", callable=self.request, proxytype=value_proxy)
         mgr.start()  # pylint: disable=consider-using-with
         return mgr
 
@@ -150,6 +278,31 @@ def run(**kwargs):
             os.remove(expanduser(bwm.AUTH_FILE))
 
 
+def script_request(port, auth, args):
+    """Send a scripting request (bwm get/totp/list/--stats/--diagnostics) to
+    the running daemon and print the reply
+
+    Returns: exit status
+
+    """
+    try:
+        manager = client(port, auth)
+    except ConnectionRefusedError:
+        print("bwm is not running", file=sys.stderr)
+        return 1
+    args["request_id"] = random_str()
+    trace_id = trace.new_trace()
+    if trace_id:
+        args["trace_id"] = trace_id
+    with trace.span("ipc", command=args["command"]):
+        reply = manager.request(args)  # pylint: disable=no-member
+    if not reply["ok"]:
+        print(reply["error"], file=sys.stderr)
+        return 1
+    print(format_reply(args["command"], reply["result"], args.get("json")))
+    return 0
+
+
 def main():
     """Main script entrypoint"""
     parser = argparse.ArgumentParser(
@@ -173,6 +326,26 @@ def main():
         help="Copy values to clipboard instead of typing.",
     )
 
+    parser.add_argument(
+        "--export",
+        type=str,
+        required=False,
+        dest="export_file",
+        metavar="FILE",
+        help="Export the vault to FILE (.json or .csv). Contains unencrypted "
+        "secrets!",
+    )
+
+    parser.add_argument(
+        "--import",
+        type=str,
+        required=False,
+        dest="import_file",
+        metavar="FILE",
+        help="Import a Bitwarden .json or .csv export. Resumes an interrupted "
+        "import of the same file.",
+    )
+
     parser.add_argument(
         "-k",
         "--lock",
@@ -189,6 +362,38 @@ def main():
         help="Login email address",
     )
 
+    parser.add_argument(
+        "-q",
+        "--query",
+        type=str,
+        required=False,
+        help="Type the entry matching a search query, e.g. 'github user:me'",
+    )
+
+    parser.add_argument(
+        "--diagnostics",
+        required=False,
+        action="store_true",
+        help="Print memory use by module and counts of resident copies of "
+        "secrets of the running bwm as JSON",
+    )
+
+    parser.add_argument(
+        "--stats",
+        required=False,
+        action="store_true",
+        help="Print counters, latencies and memory use of the running bwm as "
+        "JSON",
+    )
+
+    parser.add_argument(
+        "-u",
+        "--url",
+        type=str,
+        required=False,
+        help="Type the entry with a URI matching this URL",
+    )
+
     parser.add_argument(
         "-v",
         "--vault",
@@ -197,20 +402,62 @@ def main():
         help="Vault URL to open, skipping the database selection menu",
     )
 
+    commands = parser.add_subparsers(
+        dest="command",
+        metavar="{get,totp,list}",
+        help="Print from the unlocked vault of the running bwm without a "
+        "launcher",
+    )
+    cmd = commands.add_parser("get", help="Print a field of an entry")
+    cmd.add_argument("target", help="Entry id, name, folder/name or query")
+    cmd.add_argument(
+        "-f",
+        "--field",
+        default="password",
+        help="password (default), username, totp, notes, uri, name, id, "
+        "folder, card/identity field or custom field name",
+    )
+    cmd = commands.add_parser("totp", help="Print the current TOTP code")
+    cmd.add_argument("target", help="Entry id, name, folder/name or query")
+    cmd = commands.add_parser("list", help="List entries (no secrets)")
+    cmd.add_argument("search", nargs="?", help="Search query")
+    for cmd in commands.choices.values():
+        cmd.add_argument(
+            "--json", action="store_true", help="Output JSON (with metadata)"
+        )
+
     args = vars(parser.parse_args())
 
     args = args if any(args.values()) else {}
-
+    for key in ("export_file", "import_file"):
+        if args.get(key):
+            # The daemon may run in another directory
+            args[key] = os.path.abspath(expanduser(args[key]))
+
+    if args.get("stats"):
+        args = {"command": "stats"}
+    elif args.get("diagnostics"):
+        args = {"command": "diagnostics"}
     port, auth = get_auth()
+    if args.get("command"):
+        if port_in_use(port) is False:
+            print("bwm is not running", file=sys.stderr)
+            sys.exit(1)
+        sys.exit(script_request(port, auth, args))
     if port_in_use(port) is False:
         run(**args)
+    trace_id = trace.new_trace()
+    if trace_id:
+        # The daemon records its spans under the same trace id
+        args["trace_id"] = trace_id
     try:
-        manager = client(port, auth)
-        conn = manager.get_pipe()  # pylint: disable=no-member
-        if args:
-            conn.send(args)
-            manager.read_args_from_pipe()  # pylint: disable=no-member
-        manager.set_event()  # pylint: disable=no-member
+        with trace.span("ipc"):
+            manager = client(port, auth)
+            conn = manager.get_pipe()  # pylint: disable=no-member
+            if args:
+                conn.send(args)
+                manager.read_args_from_pipe()  # pylint: disable=no-member
+            manager.set_event()  # pylint: disable=no-member
     except ConnectionRefusedError:
         # Don't print the ConnectionRefusedError if any other exceptions are raised.
         pass
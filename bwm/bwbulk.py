@@ -0,0 +1,310 @@
+"""Bulk operations: move, re-folder, change collections of or delete many
+entries in one pass.
+
+Entries are multi-selected in the launcher (Ctrl+Enter in dmenu, or rofi with
+`-multi-select` in `dmenu_command`). The changes are then sent concurrently
+over a bw serve connection pool ([vault] serve_connections above 1), or queued
+over the single bw serve connection, and the in-memory vault is updated once
+all requests finish. Progress is shown as desktop notifications.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from copy import deepcopy
+from dataclasses import dataclass, field
+import logging
+from threading import Lock
+
+from bwm import bwcli
+from bwm import totp
+from bwm.bwedit import (
+    _delete_entry_backend,
+    _edit_entry_backend,
+    collection_update,
+    select_collection,
+    select_folder,
+    serve_ready,
+)
+from bwm.bwview import entry_rows
+from bwm.menu import dmenu_err, dmenu_select, notify
+import bwm
+
+# Requests in flight at once when bw serve doesn't use a connection pool. The
+# single connection serves one request at a time, so the changes are queued.
+BULK_WORKERS = 1
+# Report progress every N completed changes
+PROGRESS_STEP = 25
+
+
+@dataclass
+class Change:
+    """One planned change to a vault entry
+
+    entry - current entry (Item)
+    item - changed copy of entry, or None to delete the entry
+    update_coll - collection handling passed to the edit backend (NO, YES,
+                  MOVE, REMOVE)
+
+    """
+
+    entry: dict
+    item: dict = None
+    update_coll: str = "NO"
+
+
+@dataclass
+class BulkResult:
+    """Outcome of a bulk operation
+
+    done - list of (Change, result). result is the saved entry or, for
+           deletes, the deleted entry
+    failed - list of (Change, error message)
+
+    """
+
+    done: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+
+
+def plan_folder(entries, folder):
+    """Plan moving entries to a folder
+
+    Args: entries - list of Items
+          folder - folder dict
+    Returns: list of Change. Entries already in the folder are skipped.
+
+    """
+    changes = []
+    for entry in entries:
+        if entry["folderId"] == folder["id"]:
+            continue
+        item = deepcopy(entry)
+        item["folderId"] = folder["id"]
+        changes.append(Change(entry, item))
+    return changes
+
+
+def plan_collections(entries, collections):
+    """Plan setting the collections of entries. An empty collections dict
+    moves the entries back to the personal vault.
+
+    Args: entries - list of Items
+          collections - dict {id: collection dict} (one organization)
+    Returns: list of Change. Unchanged entries are skipped.
+
+    """
+    changes = []
+    for entry in entries:
+        item = deepcopy(entry)
+        item["collectionIds"] = [*collections]
+        if collections:
+            item["organizationId"] = next(iter(collections.values()))[
+                "organizationId"
+            ]
+        update_coll = collection_update(
+            entry["collectionIds"], item["collectionIds"]
+        )
+        if update_coll is None:
+            continue
+        changes.append(Change(entry, item, update_coll))
+    return changes
+
+
+def plan_delete(entries):
+    """Plan deleting entries
+
+    Args: entries - list of Items
+    Returns: list of Change
+
+    """
+    return [Change(entry) for entry in entries]
+
+
+def _send_change(change, vault):
+    """Send one change to bw serve or the CLI
+
+    Returns: result of the backend call (False on error)
+
+    """
+    if change.item is None:
+        return _delete_entry_backend(change.entry, vault)
+    return _edit_entry_backend(change.item, vault, change.update_coll)
+
+
+def _apply_change(change, vault, cli_lock):
+    """Send one change, one at a time if bw serve isn't ready"""
+    if serve_ready(vault):
+        return _send_change(change, vault)
+    # bw CLI processes must not write the vault data file concurrently
+    with cli_lock:
+        return _send_change(change, vault)
+
+
+def run_bulk(changes, vault, progress=None):
+    """Apply changes and collect per-entry failures
+
+    Requests run concurrently up to the size of the bw serve connection pool
+    (see [vault] serve_connections) and are otherwise queued one at a time. A
+    failed change doesn't stop the others.
+
+    Args: changes - list of Change
+          vault - Vault object
+          progress - optional function(completed, total, failed) called
+                     after each change
+    Returns: BulkResult
+
+    """
+    result = BulkResult()
+    if not changes:
+        return result
+    workers = getattr(vault.bwcliserver, "size", BULK_WORKERS)
+    cli_lock = Lock()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {
+            pool.submit(_apply_change, i, vault, cli_lock): i for i in changes
+        }
+        for num, future in enumerate(as_completed(futures), 1):
+            change = futures[future]
+            try:
+                res = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                logging.error(f"Bulk change of {change.entry['name']}: {err}")
+                res, error = False, str(err)
+            else:
+                error = "Check logs"
+            if res is False or res is None:
+                result.failed.append((change, error))
+            else:
+                result.done.append((change, res))
+            if progress is not None:
+                progress(num, len(changes), len(result.failed))
+    return result
+
+
+def notify_progress(completed, total, failed):
+    """Show the progress of a bulk edit every PROGRESS_STEP changes (a
+    run_bulk progress function)"""
+    if completed % PROGRESS_STEP == 0 and completed < total:
+        notify(
+            f"Bulk edit: {completed}/{total} done, {failed} failed",
+            tag="bwm-bulk",
+        )
+
+
+def update_vault(vault, result):
+    """Update the in-memory entries and search index with the completed
+    changes in one pass over the entries.
+
+    Args: vault - Vault object
+          result - BulkResult
+    Returns: number of entries changed
+
+    """
+    saved = {}
+    for change, res in result.done:
+        saved[change.entry["id"]] = (
+            None if change.item is None else bwcli.Item(res)
+        )
+        totp.invalidate(change.entry["id"])
+    if not saved:
+        return 0
+    entries = []
+    for entry in vault.entries:
+        if entry["id"] not in saved:
+            entries.append(entry)
+        elif saved[entry["id"]] is None:
+            vault.index.remove(entry)
+        else:
+            entries.append(saved[entry["id"]])
+            vault.index.update(entry, entries[-1])
+    # In place, as menus may hold a reference to the entries list
+    vault.entries[:] = entries
+    return len(saved)
+
+
+def select_entries(entries, folders):
+    """Multi-select entries in the launcher
+
+    Args: entries - list of Items
+          folders - dict of folder dicts
+    Returns: list of Items (empty if none selected)
+
+    """
+    num_align = len(str(len(entries)))
+    rows = entry_rows(enumerate(entries), folders, num_align)
+    sel = dmenu_select(
+        min(bwm.MAX_LEN, len(rows)),
+        "Select entries (Ctrl+Enter to select several)",
+        inp="\n".join(rows),
+    )
+    selected = {}
+    for line in (sel or "").split("\n"):
+        try:
+            idx = int(line.split("(", 1)[0])
+        except ValueError:
+            continue
+        if 0 <= idx < len(entries):
+            selected[idx] = entries[idx]
+    return list(selected.values())
+
+
+def bulk_edit(entries, folders, collections, vault):
+    """Select several entries, then move them to a folder, change their
+    collections or delete them
+
+    Args: entries - list of Items
+          folders - dict of folder dicts
+          collections - dict of collection dicts
+          vault - Vault object
+    Returns: BulkResult or None if cancelled
+
+    """
+    selected = select_entries(entries, folders)
+    if not selected:
+        return None
+    options = ["Move to folder", "Set collections", "Delete entries"]
+    sel = dmenu_select(
+        len(options), f"{len(selected)} entries", inp="\n".join(options)
+    )
+    if sel == "Move to folder":
+        folder = select_folder(folders)
+        if folder is False:
+            return None
+        changes = plan_folder(selected, folder)
+    elif sel == "Set collections":
+        colls = select_collection(collections, vault, coll_list=[])
+        if colls is False:
+            return None
+        changes = plan_collections(selected, colls)
+    elif sel == "Delete entries":
+        inp = "NO\nYes - confirm delete\n"
+        confirm = dmenu_select(
+            2, f"Confirm delete of {len(selected)} entries", inp=inp
+        )
+        if confirm != "Yes - confirm delete":
+            return None
+        changes = plan_delete(selected)
+    else:
+        return None
+    if not changes:
+        notify("Bulk edit: nothing to change", tag="bwm-bulk")
+        return BulkResult()
+    notify(f"Bulk edit: changing {len(changes)} entries", tag="bwm-bulk")
+    result = run_bulk(changes, vault, notify_progress)
+    update_vault(vault, result)
+    summary = (
+        f"Bulk edit: {len(result.done)} of {len(changes)} entries changed, "
+        f"{len(result.failed)} failed"
+    )
+    if result.failed:
+        names = "\n".join(
+            f"{change.entry['name']}: {error}"
+            for change, error in result.failed
+        )
+        dmenu_err(f"{summary}:\n{names}")
+    else:
+        notify(summary, tag="bwm-bulk")
+    return result
+
+
+# vim: set et ts=4 sw=4 :
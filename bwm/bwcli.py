@@ -1,14 +1,103 @@
-"""Provide methods to manipulate Bitwarden vault using the Bitwarden CLI"""
+"""Provide methods to manipulate Bitwarden vault using the Bitwarden CLI
+
+Every function takes an optional 'env' for the bw process so each vault can
+use its own BITWARDENCLI_APPDATA_DIR without changing os.environ.
+
+"""
 
 from copy import deepcopy
 import json
 import logging
-from subprocess import run
+from subprocess import CompletedProcess, TimeoutExpired, run
+
+from bwm import metrics, trace
+import bwm
+
+# bw commands whose object type is recorded in trace spans
+OBJECT_COMMANDS = ("list", "get", "create", "edit", "delete", "move", "config")
+
+
+class BWTimeoutError(TimeoutError):
+    """A bw command or bw serve request took longer than its budget"""
+
+    def __init__(self, operation, seconds):
+        """Create the error
+
+        Args: operation - name of the timeout budget ([timeouts] key)
+              seconds - the budget
+
+        """
+        super().__init__(f"bw {operation} timed out after {seconds}s")
+        self.operation = operation
+        self.seconds = seconds
+
+
+def timeout(operation):
+    """Return the time budget for an operation
 
+    Args: operation - key in [timeouts] of config.ini (see bwm.TIMEOUTS)
+    Returns: seconds (float) or None for no limit
 
-def status(session=b""):
+    """
+    seconds = bwm.TIMEOUTS.get(operation, bwm.TIMEOUTS["default"])
+    return seconds or None
+
+
+def subcommand(cmd):
+    """Return the bw subcommand of a command line (e.g. 'list items'),
+    leaving out arguments that may hold secrets
+
+    Args: cmd - list
+    Returns: string
+
+    """
+    words = []
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg == "--session":
+            next(args, None)
+        elif isinstance(arg, str) and not arg.startswith("-"):
+            words.append(arg)
+            if words[0] not in OBJECT_COMMANDS or len(words) == 2:
+                break
+    return " ".join(words)
+
+
+def _run(cmd, operation="default", **kwargs):
+    """Run a bw command, killing it if it takes longer than the time budget
+    for the operation
+
+    Args: cmd - list
+          operation - timeout budget (see timeout())
+          **kwargs - passed to subprocess.run (env, input)
+    Returns: CompletedProcess. After a timeout stdout is empty and stderr is
+             the BWTimeoutError message.
+
+    """
+    seconds = timeout(operation)
+    command = subcommand(cmd)
+    try:
+        with trace.span("bw", command=command), metrics.timed(f"bw {command}"):
+            return run(
+                cmd,
+                capture_output=True,
+                check=False,
+                timeout=seconds,
+                **kwargs,
+            )
+    except TimeoutExpired:
+        err = BWTimeoutError(operation, seconds)
+        logging.error(err)
+        metrics.incr("bw timeouts")
+        return CompletedProcess(cmd, -1, stdout=b"", stderr=str(err).encode())
+
+
+def status(session=b"", env=None):
     """Check status of vault
 
+    Args: session - bytes
+          env - environment for the bw process (default: os.environ)
+
     Returns: Dict -
              {serverUrl: <url>,
              lastSync: date/time,
@@ -18,8 +107,10 @@ def status(session=b""):
         Empty dict {} on error
 
     """
-    res = run(
-        ["bw", "--session", session, "status"], capture_output=True, check=False
+    res = _run(
+        ["bw", "--session", session, "status"],
+        operation="status",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -27,20 +118,23 @@ def status(session=b""):
     return dict(json.loads(res.stdout.split(b"\n")[-1]))
 
 
-def set_server(url="https://vault.bitwarden.com"):
+def set_server(url="https://vault.bitwarden.com", env=None):
     """Set vault URL
 
     Returns: True if successful or False on error
 
     """
-    res = run(["bw", "config", "server", url], capture_output=True, check=False)
+    res = _run(
+        ["bw", "config", "server", url],
+        env=env,
+    )
     if not res.stdout:
         logging.error(res)
         return False
     return True
 
 
-def login(email, password, method=None, code=""):
+def login(email, password, method=None, code="", env=None):
     """Initial login to Bitwarden Vault. May require BW_CLIENTSECRET to be set.
 
     Args: email - string
@@ -64,24 +158,29 @@ def login(email, password, method=None, code=""):
             "--code",
             code,
         ]
-    res = run(cmd, capture_output=True, check=False)
+    res = _run(cmd, operation="login", env=env)
     if not res.stdout or res.stderr:
         logging.error(res)
         return (False, res.stderr)
     return res.stdout, None
 
 
-def unlock(password):
+def unlock(password, env=None):
     """Unlock vault
 
+    Args: password - string
+          env - environment for the bw process (default: os.environ)
+
     Returns: session (bytes) or False on error, Error message
 
     """
     if not password:
         logging.error("No password provided")
         return (False, "No password provided")
-    res = run(
-        ["bw", "unlock", "--raw", password], capture_output=True, check=False
+    res = _run(
+        ["bw", "unlock", "--raw", password],
+        operation="unlock",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -89,43 +188,43 @@ def unlock(password):
     return res.stdout, None
 
 
-def lock():
+def lock(env=None):
     """Lock vault
 
     Return: True on success, False with any errors
 
     """
-    res = run(["bw", "lock"], capture_output=True, check=False)
+    res = _run(["bw", "lock"], env=env)
     if not res.stdout:
         logging.error(res)
         return False
     return True
 
 
-def logout():
+def logout(env=None):
     """Logout of vault
 
     Return: True on success, False with any errors
 
     """
-    res = run(["bw", "logout"], capture_output=True, check=False)
+    res = _run(["bw", "logout"], env=env)
     if not res.stderr:
         logging.error(res)
         return False
     return True
 
 
-def get_orgs(session):
+def get_orgs(session, env=None):
     """Return all organizations for the logged in user
 
     Return: Dict of org dicts {id: dict('object':'organization','id':id,'name':<name>...)}
             False on error
 
     """
-    res = run(
+    res = _run(
         ["bw", "--session", session, "list", "organizations"],
-        capture_output=True,
-        check=False,
+        operation="list",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -143,11 +242,12 @@ class Item(dict):
             self["fields"].append({"name": "autotype", "value": "", "type": 0})
 
 
-def get_entries(session, org_name=""):
+def get_entries(session, org_name="", env=None):
     """Get all entries, folders, collections and orgs from vault
 
     Args: session: bytes
           org_name: name of organization. If given, only return items for that org
+          env: environment for the bw processes (default: os.environ)
     1. the URL is buried in:
         'login'->'uris'->[{match: xxx, uri: http...}, {match2: xxx, uri2: httpxxx}]
     2. Also adjust 'path' to be just the dirname, not including the 'name'
@@ -161,10 +261,10 @@ def get_entries(session, org_name=""):
         f"get_entries: session type={type(session)}, value (first 20 chars)={str(session)[:20]}"
     )
 
-    res = run(
+    res = _run(
         ["bw", "--session", session, "list", "items"],
-        capture_output=True,
-        check=False,
+        operation="list",
+        env=env,
     )
 
     logging.debug(f"get_entries: returncode={res.returncode}")
@@ -186,20 +286,22 @@ def get_entries(session, org_name=""):
         return False
 
     items = [Item(i) for i in json.loads(res.stdout)]
-    folders = get_folders(session)
-    collections = get_collections(session, org_name)
-    orgs = get_orgs(session)
+    folders = get_folders(session, env)
+    collections = get_collections(session, org_name, env)
+    orgs = get_orgs(session, env)
     return items, folders, collections, orgs
 
 
-def sync(session):
+def sync(session, env=None):
     """Sync web vault changes to local vault
 
     Return: True on success, False with any errors
 
     """
-    res = run(
-        ["bw", "--session", session, "sync"], capture_output=True, check=False
+    res = _run(
+        ["bw", "--session", session, "sync"],
+        operation="sync",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -207,17 +309,17 @@ def sync(session):
     return True
 
 
-def get_folders(session):
+def get_folders(session, env=None):
     """Return all folder names.
 
     Return: Dict of folder dicts {id: dict('object':folder,'id':id,'name':<name>)}
             False on error
 
     """
-    res = run(
+    res = _run(
         ["bw", "--session", session, "list", "folders"],
-        capture_output=True,
-        check=False,
+        operation="list",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -225,11 +327,12 @@ def get_folders(session):
     return {i["id"]: i for i in json.loads(res.stdout)}
 
 
-def get_collections(session, org_id=""):
+def get_collections(session, org_id="", env=None):
     """Return all collection names for user.
 
     Args: session - session id bytes
           org_id - organization id string.
+          env - environment for the bw process (default: os.environ)
 
     Return: Dict of collection dicts {id:
         dict('object':collection,'id':id,'organizationId:<org
@@ -239,14 +342,14 @@ def get_collections(session, org_id=""):
     cmd = ["bw", "--session", session, "list", "collections"]
     if org_id:
         cmd.extend(["--organizationid", org_id])
-    res = run(cmd, capture_output=True, check=False)
+    res = _run(cmd, operation="list", env=env)
     if not res.stdout:
         logging.error(res)
         return False
     return {i["id"]: i for i in json.loads(res.stdout)}
 
 
-def add_entry(entry, session):
+def add_entry(entry, session, env=None):
     """Add new entry to vault
 
     Args: entry - dict with at least these fields
@@ -267,19 +370,18 @@ def add_entry(entry, session):
         "identity":null}'
 
     """
-    enc = run(
+    enc = _run(
         ["bw", "encode"],
         input=json.dumps(entry).encode(),
-        capture_output=True,
-        check=False,
+        env=env,
     )
     if not enc.stdout:
         logging.error(enc)
         return False
-    res = run(
+    res = _run(
         ["bw", "create", "--session", session, "item", enc.stdout],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -287,7 +389,7 @@ def add_entry(entry, session):
     return json.loads(res.stdout)
 
 
-def edit_entry(entry, session, update_coll="NO"):
+def edit_entry(entry, session, update_coll="NO", env=None):
     # pylint: disable=too-many-return-statements
     """Modify existing vault entry
 
@@ -304,50 +406,49 @@ def edit_entry(entry, session, update_coll="NO"):
     item = deepcopy(entry)
     if update_coll == "YES":
         # bw edit item-collections is unreliable, use delete+add instead
-        res = delete_entry(entry, session)
+        res = delete_entry(entry, session, env)
         if res is False:
             return False
         item["id"] = None
         # organizationId and collectionIds are already set on item
-        res = add_entry(item, session)
+        res = add_entry(item, session, env)
         if res is False:
             return False
         return res
     elif update_coll == "MOVE":
         # bw move command is unreliable, use delete+add instead
-        res = delete_entry(entry, session)
+        res = delete_entry(entry, session, env)
         if res is False:
             return False
         item["id"] = None
         # organizationId and collectionIds are already set on item
-        res = add_entry(item, session)
+        res = add_entry(item, session, env)
         if res is False:
             return False
         return res
     elif update_coll == "REMOVE":
-        res = delete_entry(entry, session)
+        res = delete_entry(entry, session, env)
         if res is False:
             return False
         item["id"] = None
         item["collectionIds"] = []
         item["organizationId"] = None
-        res = add_entry(item, session)
+        res = add_entry(item, session, env)
         if res is False:
             return False
         return res
-    enc = run(
+    enc = _run(
         ["bw", "encode"],
         input=json.dumps(item).encode(),
-        capture_output=True,
-        check=False,
+        env=env,
     )
     if not enc.stdout:
         logging.error(enc)
         return False
-    res = run(
+    res = _run(
         ["bw", "edit", "--session", session, "item", item["id"], enc.stdout],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -355,17 +456,17 @@ def edit_entry(entry, session, update_coll="NO"):
     return json.loads(res.stdout)
 
 
-def delete_entry(entry, session):
+def delete_entry(entry, session, env=None):
     """Delete existing vault entry
 
     Args: entry - entry dict object
     Returns: entry object (dict) on success, False on failure
 
     """
-    res = run(
+    res = _run(
         ["bw", "delete", "--session", session, "item", entry["id"]],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if res.returncode != 0:
         logging.error(res)
@@ -373,7 +474,7 @@ def delete_entry(entry, session):
     return entry
 
 
-def add_folder(folder, session):
+def add_folder(folder, session, env=None):
     """Add folder
 
     Args: folder - string (name of folder)
@@ -383,19 +484,18 @@ def add_folder(folder, session):
 
     """
     folder = {"name": folder}
-    enc = run(
+    enc = _run(
         ["bw", "encode"],
         input=json.dumps(folder).encode(),
-        capture_output=True,
-        check=False,
+        env=env,
     )
     if not enc.stdout:
         logging.error(enc)
         return False
-    res = run(
+    res = _run(
         ["bw", "create", "--session", session, "folder", enc.stdout],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -403,7 +503,7 @@ def add_folder(folder, session):
     return json.loads(res.stdout)
 
 
-def delete_folder(folder, session):
+def delete_folder(folder, session, env=None):
     """Delete folder
 
     Args: folder - folder object (dict)
@@ -412,10 +512,10 @@ def delete_folder(folder, session):
 
 
     """
-    res = run(
+    res = _run(
         ["bw", "delete", "--session", session, "folder", folder["id"]],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if res.returncode != 0:
         logging.error(res)
@@ -423,7 +523,7 @@ def delete_folder(folder, session):
     return folder
 
 
-def move_folder(folder, newpath, session):
+def move_folder(folder, newpath, session, env=None):
     """Move or rename folder
 
     Args: folder - folder dict object
@@ -434,19 +534,18 @@ def move_folder(folder, newpath, session):
     """
     fold = deepcopy(folder)
     fold["name"] = newpath
-    enc = run(
+    enc = _run(
         ["bw", "encode"],
         input=json.dumps(fold).encode(),
-        capture_output=True,
-        check=False,
+        env=env,
     )
     if not enc.stdout:
         logging.error(enc)
         return False
-    res = run(
+    res = _run(
         ["bw", "edit", "--session", session, "folder", fold["id"], enc.stdout],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -454,7 +553,7 @@ def move_folder(folder, newpath, session):
     return json.loads(res.stdout)
 
 
-def add_collection(collection, org_id, session):
+def add_collection(collection, org_id, session, env=None):
     """Add collection
 
     Args: collection - string
@@ -465,16 +564,15 @@ def add_collection(collection, org_id, session):
 
     """
     collection = {"name": collection, "organizationId": org_id}
-    enc = run(
+    enc = _run(
         ["bw", "encode"],
         input=json.dumps(collection).encode(),
-        capture_output=True,
-        check=False,
+        env=env,
     )
     if not enc.stdout:
         logging.error(enc)
         return False
-    res = run(
+    res = _run(
         [
             "bw",
             "create",
@@ -485,8 +583,8 @@ def add_collection(collection, org_id, session):
             "org-collection".encode(),
             enc.stdout,
         ],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
@@ -494,7 +592,7 @@ def add_collection(collection, org_id, session):
     return json.loads(res.stdout)
 
 
-def delete_collection(collection, session):
+def delete_collection(collection, session, env=None):
     """Delete collection
 
     Args: collection - collection object (dict)
@@ -502,7 +600,7 @@ def delete_collection(collection, session):
     Returns: collection object (dict) on success, False on failure
 
     """
-    res = run(
+    res = _run(
         [
             "bw",
             "delete",
@@ -513,8 +611,8 @@ def delete_collection(collection, session):
             "org-collection",
             collection["id"],
         ],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if res.returncode != 0:
         logging.error(res)
@@ -522,7 +620,7 @@ def delete_collection(collection, session):
     return collection
 
 
-def move_collection(collection, newpath, session):
+def move_collection(collection, newpath, session, env=None):
     """Move or rename collection
 
     Args: collection - collection object (dict)
@@ -533,16 +631,15 @@ def move_collection(collection, newpath, session):
     """
     coll = deepcopy(collection)
     coll["name"] = newpath
-    enc = run(
+    enc = _run(
         ["bw", "encode"],
         input=json.dumps(coll).encode(),
-        capture_output=True,
-        check=False,
+        env=env,
     )
     if not enc.stdout:
         logging.error(enc)
         return False
-    res = run(
+    res = _run(
         [
             "bw",
             "edit",
@@ -554,8 +651,8 @@ def move_collection(collection, newpath, session):
             coll["id"],
             enc.stdout,
         ],
-        capture_output=True,
-        check=False,
+        operation="edit",
+        env=env,
     )
     if not res.stdout:
         logging.error(res)
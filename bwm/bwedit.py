@@ -1,6 +1,7 @@
 """Editing functions for bitwarden-menu"""
 
 from copy import deepcopy
+import logging
 import os
 from os.path import basename, dirname, join
 import random
@@ -14,21 +15,56 @@ from urllib import parse
 from bwm import bwcli
 from bwm.bwtype import autotype_index, autotype_seq, type_text
 from bwm.menu import dmenu_select, dmenu_err
+from bwm import metrics, totp
 from bwm.totp import gen_otp
 import bwm
 
 
+def serve_ready(vault):
+    """True if the vault's bw serve can take requests. The CLI is used while
+    bw serve isn't started or is being restarted after a crash or timeout
+    (counted as a CLI fallback).
+
+    """
+    if vault.bwcliserver is None:
+        return False
+    if vault.bwcliserver.is_ready():
+        return True
+    metrics.incr("cli fallbacks")
+    return False
+
+
+def read_backend(vault, serve_call, cli_call):
+    """Run an idempotent operation (reads, sync, lock) with bw serve, falling
+    back to the CLI if bw serve isn't ready or stops responding during the
+    request. Writes are not retried this way as they may already have been
+    applied.
+
+    Args: vault - Vault object
+          serve_call - function(server) using bw serve
+          cli_call - function() using the CLI
+    Returns: result of serve_call or cli_call
+
+    """
+    if serve_ready(vault):
+        res = serve_call(vault.bwcliserver)
+        if serve_ready(vault):
+            return res
+        logging.warning("bw serve not responding, retrying with the CLI")
+    return cli_call()
+
+
 # Wrapper functions to route operations to bw serve or CLI
 def _add_entry_backend(entry, vault):
     """Add entry using server or CLI"""
-    if vault.bwcliserver:
+    if serve_ready(vault):
         return vault.bwcliserver.add_entry(entry)
-    return bwcli.add_entry(entry, vault.session)
+    return bwcli.add_entry(entry, vault.session, env=vault.env)
 
 
 def _edit_entry_backend(entry, vault, update_coll="NO"):
     """Edit entry using server or CLI with collection handling"""
-    if vault.bwcliserver:
+    if serve_ready(vault):
         # Handle special collection update cases
         if update_coll == "MOVE":
             # Move to organization, then edit to apply other changes (e.g. folder)
@@ -61,14 +97,14 @@ def _edit_entry_backend(entry, vault, update_coll="NO"):
         else:
             # Normal edit
             return vault.bwcliserver.edit_entry(entry)
-    return bwcli.edit_entry(entry, vault.session, update_coll)
+    return bwcli.edit_entry(entry, vault.session, update_coll, env=vault.env)
 
 
 def _delete_entry_backend(entry, vault):
     """Delete entry using server or CLI"""
     import logging
 
-    if vault.bwcliserver:
+    if serve_ready(vault):
         logging.debug(
             f"_delete_entry_backend: Using bw serve for item {entry.get('id', 'unknown')}"
         )
@@ -76,56 +112,60 @@ def _delete_entry_backend(entry, vault):
     logging.debug(
         f"_delete_entry_backend: Using CLI for item {entry.get('id', 'unknown')}"
     )
-    return bwcli.delete_entry(entry, vault.session)
+    return bwcli.delete_entry(entry, vault.session, env=vault.env)
 
 
 def _add_folder_backend(name, vault):
     """Add folder using server or CLI"""
-    if vault.bwcliserver:
+    if serve_ready(vault):
         return vault.bwcliserver.add_folder(name)
-    return bwcli.add_folder(name, vault.session)
+    return bwcli.add_folder(name, vault.session, env=vault.env)
 
 
 def _delete_folder_backend(folder, vault):
     """Delete folder using server or CLI"""
-    if vault.bwcliserver:
+    if serve_ready(vault):
         return vault.bwcliserver.delete_folder(folder)
-    return bwcli.delete_folder(folder, vault.session)
+    return bwcli.delete_folder(folder, vault.session, env=vault.env)
 
 
 def _move_folder_backend(folder, newpath, vault):
     """Move/rename folder using server or CLI"""
-    if vault.bwcliserver:
+    if serve_ready(vault):
         return vault.bwcliserver.move_folder(folder, newpath)
-    return bwcli.move_folder(folder, newpath, vault.session)
+    return bwcli.move_folder(folder, newpath, vault.session, env=vault.env)
 
 
 def _add_collection_backend(name, org_id, vault):
     """Add collection using server or CLI"""
-    if vault.bwcliserver:
+    if serve_ready(vault):
         return vault.bwcliserver.add_collection(name, org_id)
-    return bwcli.add_collection(name, org_id, vault.session)
+    return bwcli.add_collection(name, org_id, vault.session, env=vault.env)
 
 
 def _delete_collection_backend(collection, vault):
     """Delete collection using server or CLI"""
-    if vault.bwcliserver:
+    if serve_ready(vault):
         return vault.bwcliserver.delete_collection(collection)
-    return bwcli.delete_collection(collection, vault.session)
+    return bwcli.delete_collection(collection, vault.session, env=vault.env)
 
 
 def _move_collection_backend(collection, newpath, vault):
     """Move/rename collection using server or CLI"""
-    if vault.bwcliserver:
+    if serve_ready(vault):
         return vault.bwcliserver.move_collection(collection, newpath)
-    return bwcli.move_collection(collection, newpath, vault.session)
+    return bwcli.move_collection(
+        collection, newpath, vault.session, env=vault.env
+    )
 
 
 def _get_orgs_backend(vault):
     """Get organizations using server or CLI"""
-    if vault.bwcliserver:
-        return vault.bwcliserver.get_orgs()
-    return bwcli.get_orgs(vault.session)
+    return read_backend(
+        vault,
+        lambda server: server.get_orgs(),
+        lambda: bwcli.get_orgs(vault.session, env=vault.env),
+    )
 
 
 def obj_name(obj, oid):
@@ -140,6 +180,24 @@ def obj_name(obj, oid):
     return "Unassigned"
 
 
+def collection_update(orig, new):
+    """Return how the edit backend has to apply a change of collections
+
+    Args: orig - list of the entry's current collection ids
+          new - list of the new collection ids
+    Returns: "YES" (change collections), "MOVE" (to an organization),
+             "REMOVE" (back to the personal vault) or None if unchanged
+
+    """
+    if new and new != orig and orig:
+        return "YES"
+    if new != orig and not orig:
+        return "MOVE"
+    if not new and orig:
+        return "REMOVE"
+    return None
+
+
 def edit_entry(entry, entries, folders, collections, vault):
     # pylint: disable=too-many-branches,too-many-statements,too-many-locals
     """Edit an entry.
@@ -201,12 +259,16 @@ def edit_entry(entry, entries, folders, collections, vault):
                     dmenu_err("Entry not added. Check logs.")
                     return None
                 entries.append(bwcli.Item(res))
+                vault.index.add(entries[-1])
             else:
                 res = _edit_entry_backend(item, vault, update_colls)
                 if res is False:
                     dmenu_err("Error saving entry. Changes not saved.")
                     continue
-                entries[entries.index(entry)] = bwcli.Item(res)
+                totp.invalidate(entry["id"])
+                idx = entries.index(entry)
+                entries[idx] = bwcli.Item(res)
+                vault.index.update(entry, entries[idx])
             return bwcli.Item(res)
         if field == "Folder":
             folder = select_folder(folders)
@@ -230,12 +292,9 @@ def edit_entry(entry, entries, folders, collections, vault):
                 item["organizationId"] = next(iter(collection.values()))[
                     "organizationId"
                 ]
-            if item["collectionIds"] and item["collectionIds"] != orig and orig:
-                update_colls = "YES"
-            elif item["collectionIds"] != orig and not orig:
-                update_colls = "MOVE"
-            elif not item["collectionIds"] and orig:
-                update_colls = "REMOVE"
+            update_colls = (
+                collection_update(orig, item["collectionIds"]) or update_colls
+            )
             continue
         if field == "Notes":
             item["notes"] = edit_notes(item["notes"])
@@ -404,6 +463,8 @@ def delete_entry(entry, entries, vault):
     if res is False:
         dmenu_err("Item not deleted. Check logs.")
         return
+    totp.invalidate(entry["id"])
+    vault.index.remove(entry)
     del entries[entries.index(res)]
 
 
@@ -499,13 +560,13 @@ def edit_totp(entry):  # pylint: disable=too-many-statements,too-many-branches
         otp_choice = "Enter secret key"
 
     if otp_choice == "Type TOTP":
-        type_text(gen_otp(otp_url))
+        type_text(gen_otp(otp_url, entry.get("id")))
     elif otp_choice == "Enter secret key":
         inputs = []
         if otp_url:
             parsed_otp_url = parse.urlparse(otp_url)
             query_string = parse.parse_qs(parsed_otp_url.query)
-            inputs = [query_string["secret"][0]]
+            inputs = query_string.get("secret", [otp_url.rsplit("/", 1)[-1]])
         secret_key = dmenu_select(1, "Secret Key?", inp="\n".join(inputs))
 
         if secret_key is None:
@@ -525,7 +586,7 @@ def edit_totp(entry):  # pylint: disable=too-many-statements,too-many-branches
         inputs = [
             "Defaut RFC 6238 token settings",
             "Steam token settings",
-            "Use cusom settings",
+            "Use custom settings",
         ]
 
         otp_settings_choice = dmenu_select(
@@ -556,21 +617,27 @@ def edit_totp(entry):  # pylint: disable=too-many-statements,too-many-branches
                 time_step_choice = int(time_step_choice)
             except ValueError:
                 time_step_choice = 30
+            if time_step_choice <= 0:
+                time_step_choice = 30
 
             code_size_choice = dmenu_select(1, "Code Size", inp="6\n")
             if not code_size_choice:
                 return False
             try:
-                code_size_choice = int(time_step_choice)
+                code_size_choice = int(code_size_choice)
             except ValueError:
                 code_size_choice = 6
+            if not totp.MIN_DIGITS <= code_size_choice <= totp.MAX_DIGITS:
+                code_size_choice = 6
+        else:
+            return False
 
         otp_url = (
             f"otpauth://totp/Main:none?secret={secret_key}&period={time_step_choice}"
             f"&digits={code_size_choice}&issuer=Main"
         )
         if algorithm_choice != "sha1":
-            otp_url += "&algorithm=" + algorithm_choice
+            otp_url += "&algorithm=" + algorithm_choice.upper()
         if otp_settings_choice == "Steam token settings":
             otp_url += "&encoder=steam"
         entry["login"]["totp"] = otp_url
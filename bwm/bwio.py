@@ -0,0 +1,479 @@
+"""Streaming import and export of vault items (bwm --import / --export)
+
+Exports are written item by item from the loaded vault. Imports are read
+item by item, so a large export file is never held in memory, and items are
+created concurrently with a bounded number of requests in flight.
+
+Imports record their progress in a checkpoint file. Running the same import
+again skips the items that were already created.
+
+Formats (chosen by file extension):
+    .json - Bitwarden unencrypted JSON export ({"folders": [], "items": []})
+    .csv - Bitwarden CSV export (logins and secure notes only)
+
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import csv
+from dataclasses import dataclass, field
+from hashlib import sha1
+import json
+import logging
+import os
+from os.path import abspath, join, splitext
+from threading import Lock
+
+from bwm.bwedit import _add_entry_backend, _add_folder_backend, serve_ready
+import bwm
+
+# Requests in flight at once when bw serve doesn't use a connection pool
+IMPORT_WORKERS = 1
+# Items read ahead of the requests in flight, per worker
+READ_AHEAD = 2
+# Save the import checkpoint every N created items
+CHECKPOINT_EVERY = 100
+# Bytes read from the import file at a time
+READ_CHUNK = 65536
+
+CSV_FIELDS = (
+    "folder",
+    "favorite",
+    "type",
+    "name",
+    "notes",
+    "fields",
+    "reprompt",
+    "login_uri",
+    "login_username",
+    "login_password",
+    "login_totp",
+)
+CSV_TYPES = {1: "login", 2: "note"}
+# Item keys not sent when creating an item
+READ_ONLY = (
+    "id",
+    "object",
+    "revisionDate",
+    "creationDate",
+    "deletedDate",
+    "passwordHistory",
+)
+
+
+@dataclass
+class IOResult:
+    """Outcome of an import or export
+
+    done - number of items written or created
+    skipped - number of items skipped (already imported or not supported by
+              the format)
+    failed - list of (item number, item name) that could not be imported
+
+    """
+
+    done: int = 0
+    skipped: int = 0
+    failed: list = field(default_factory=list)
+
+
+def file_format(path):
+    """Return 'csv' or 'json' based on the file extension"""
+    return "csv" if splitext(path)[1].lower() == ".csv" else "json"
+
+
+def _open_private(path):
+    """Open a file for writing that only the user can read"""
+    fdr = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    return open(fdr, "w", encoding=bwm.ENC, newline="")
+
+
+def export_item(entry):
+    """Return a copy of an entry without the empty autotype field bwm adds to
+    every item"""
+    item = dict(entry)
+    item["fields"] = [
+        i
+        for i in entry.get("fields") or []
+        if i.get("name") != "autotype" or i.get("value")
+    ]
+    return item
+
+
+def csv_row(entry, folders):
+    """Convert a login or secure note to a Bitwarden CSV row
+
+    Args: entry - Item
+          folders - dict of folder dicts
+    Returns: dict or None if the item type isn't supported by CSV
+
+    """
+    if entry["type"] not in CSV_TYPES:
+        return None
+    login = entry.get("login") or {}
+    folder = folders.get(entry.get("folderId"), {}).get("name", "")
+    return {
+        "folder": "" if folder == "No Folder" else folder,
+        "favorite": 1 if entry.get("favorite") else "",
+        "type": CSV_TYPES[entry["type"]],
+        "name": entry.get("name") or "",
+        "notes": entry.get("notes") or "",
+        "fields": "\n".join(
+            f"{i['name']}: {i['value'] or ''}"
+            for i in export_item(entry)["fields"]
+        ),
+        "reprompt": entry.get("reprompt") or 0,
+        "login_uri": ",".join(
+            i["uri"] for i in login.get("uris") or [] if i.get("uri")
+        ),
+        "login_username": login.get("username") or "",
+        "login_password": login.get("password") or "",
+        "login_totp": login.get("totp") or "",
+    }
+
+
+def export_items(entries, folders, path):
+    """Write entries to an export file, one item at a time. The file is
+    created readable by the user only, as it holds unencrypted secrets.
+
+    Args: entries - iterable of Items
+          folders - dict of folder dicts
+          path - output file (.csv or .json)
+    Returns: IOResult
+
+    """
+    result = IOResult()
+    tmp = f"{path}.part"
+    with _open_private(tmp) as out:
+        if file_format(path) == "csv":
+            writer = csv.DictWriter(out, CSV_FIELDS)
+            writer.writeheader()
+            for entry in entries:
+                row = csv_row(entry, folders)
+                if row is None:
+                    result.skipped += 1
+                    continue
+                writer.writerow(row)
+                result.done += 1
+        else:
+            out.write('{"encrypted": false, "folders": [')
+            out.write(
+                ", ".join(
+                    json.dumps({"id": i["id"], "name": i["name"]})
+                    for i in folders.values()
+                    if i["id"] is not None
+                )
+            )
+            out.write('], "items": [')
+            for entry in entries:
+                out.write(",\n" if result.done else "\n")
+                out.write(json.dumps(export_item(entry)))
+                result.done += 1
+            out.write("\n]}\n")
+    os.replace(tmp, path)
+    return result
+
+
+class _JSONStream:
+    """Read JSON values from a file object a chunk at a time"""
+
+    def __init__(self, fileobj, chunk=READ_CHUNK):
+        self.fileobj = fileobj
+        self.chunk = chunk
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read(self):
+        """Read the next chunk, dropping what was already parsed"""
+        data = self.fileobj.read(self.chunk)
+        self.eof = not data
+        self.buf = self.buf[self.pos :] + data
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        """Return the next non whitespace character ('' at end of file)"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._read():
+                return self.buf[self.pos : self.pos + 1]
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected {chars!r} at {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Parse the next JSON value"""
+        self.peek()
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # A number or literal may continue in the next chunk
+            if end < len(self.buf) or self.eof:
+                self.pos = end
+                return val
+            self._read()
+
+
+def iter_json(fileobj, chunk=READ_CHUNK):
+    """Parse a Bitwarden JSON export one array element at a time
+
+    Args: fileobj - text file object
+          chunk - characters read at a time
+    Returns: generator of (key, value). Each element of a top level array is
+             returned as a separate (key, element).
+
+    """
+    stream = _JSONStream(fileobj, chunk)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        if stream.peek() == "[":
+            stream.expect("[")
+            if stream.peek() != "]":
+                while True:
+                    yield key, stream.value()
+                    if stream.expect(",]") == "]":
+                        break
+            else:
+                stream.expect("]")
+        else:
+            yield key, stream.value()
+        if stream.expect(",}") == "}":
+            return
+
+
+def csv_item(row):
+    """Convert a Bitwarden CSV row to an item
+
+    Returns: tuple (folder name, item dict)
+
+    """
+    item = {
+        "organizationId": None,
+        "folderId": None,
+        "type": 2 if row.get("type") == "note" else 1,
+        "name": row.get("name") or "",
+        "notes": row.get("notes") or None,
+        "favorite": row.get("favorite") in ("1", "true", "True"),
+        "reprompt": int(row.get("reprompt") or 0),
+        "fields": [],
+        "login": None,
+        "secureNote": None,
+        "card": None,
+        "identity": None,
+    }
+    for line in (row.get("fields") or "").splitlines():
+        name, _, value = line.partition(": ")
+        item["fields"].append({"name": name, "value": value, "type": 0})
+    if item["type"] == 1:
+        item["login"] = {
+            "uris": [
+                {"uri": i.strip(), "match": None}
+                for i in (row.get("login_uri") or "").split(",")
+                if i.strip()
+            ],
+            "username": row.get("login_username") or None,
+            "password": row.get("login_password") or None,
+            "totp": row.get("login_totp") or None,
+        }
+    else:
+        item["secureNote"] = {"type": 0}
+    return row.get("folder") or "", item
+
+
+def read_items(fileobj, fmt):
+    """Read the items of an export file one at a time
+
+    Args: fileobj - text file object
+          fmt - 'csv' or 'json'
+    Returns: generator of (folder name, item dict). Raises ValueError for
+             encrypted or malformed exports.
+
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(fileobj):
+            yield csv_item(row)
+        return
+    folders = {}
+    for key, value in iter_json(fileobj):
+        if key == "encrypted" and value:
+            raise ValueError("Encrypted exports can't be imported")
+        if key == "folders":
+            folders[value["id"]] = value["name"]
+        elif key == "items":
+            yield folders.get(value.get("folderId"), ""), value
+
+
+class Checkpoint:
+    """Numbers of the items of an import file that were already created
+
+    Saved in DATA_HOME, keyed by vault and file, and only reused while the
+    file is unchanged.
+
+    """
+
+    def __init__(self, vault, path):
+        stat = os.stat(path)
+        key = f"{vault.url}\0{vault.email}\0{abspath(path)}"
+        self.path = join(
+            bwm.DATA_HOME,
+            f"import-{sha1(key.encode()).hexdigest()[:16]}.json",
+        )
+        self.source = [abspath(path), stat.st_size, stat.st_mtime]
+        # Items before 'done' and those in 'extra' are already created
+        self.done = 0
+        self.extra = set()
+        self._unsaved = 0
+        try:
+            with open(self.path, encoding=bwm.ENC) as fin:
+                data = json.load(fin)
+        except (OSError, ValueError):
+            return
+        if data.get("source") != self.source:
+            logging.warning(f"{path} changed since the last import, restarting")
+            return
+        self.done = data["done"]
+        self.extra = set(data["extra"])
+
+    def __contains__(self, num):
+        return num < self.done or num in self.extra
+
+    def mark(self, num):
+        """Record item number num as created"""
+        self.extra.add(num)
+        while self.done in self.extra:
+            self.extra.remove(self.done)
+            self.done += 1
+        self._unsaved += 1
+        if self._unsaved >= CHECKPOINT_EVERY:
+            self.save()
+
+    def save(self):
+        """Write the checkpoint"""
+        self._unsaved = 0
+        data = {
+            "source": self.source,
+            "done": self.done,
+            "extra": sorted(self.extra),
+        }
+        tmp = f"{self.path}.part"
+        with _open_private(tmp) as out:
+            json.dump(data, out)
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        """Remove the checkpoint once the import is complete"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _create(item, vault, cli_lock):
+    """Create one item, one at a time if bw serve isn't ready"""
+    if serve_ready(vault):
+        return _add_entry_backend(item, vault)
+    # bw CLI processes must not write the vault data file concurrently
+    with cli_lock:
+        return _add_entry_backend(item, vault)
+
+
+def _folder_id(name, vault, folder_ids):
+    """Return the id of a folder by name, creating it if needed
+
+    Args: name - folder path
+          vault - Vault object
+          folder_ids - dict {name: id} of known folders (updated)
+    Returns: folder id or None (no folder, or the folder couldn't be created)
+
+    """
+    if not name or name == "No Folder":
+        return None
+    if name not in folder_ids:
+        folder = _add_folder_backend(name, vault)
+        if folder is False:
+            logging.error(f"Import: folder {name} not created")
+            folder_ids[name] = None
+        else:
+            vault.folders[folder["id"]] = folder
+            vault.folders_rev += 1
+            folder_ids[name] = folder["id"]
+    return folder_ids[name]
+
+
+def import_items(vault, path, progress=None):
+    """Create the items of an export file in the vault
+
+    Items are created in the personal vault (organizations and collections
+    aren't imported). Folders are matched by name and created as needed.
+
+    Args: vault - Vault object
+          path - export file (.csv or .json)
+          progress - optional function(result) called after each item
+    Returns: IOResult
+
+    """
+    result = IOResult()
+    checkpoint = Checkpoint(vault, path)
+    folder_ids = {i["name"]: i["id"] for i in vault.folders.values()}
+    workers = max(1, getattr(vault.bwcliserver, "size", IMPORT_WORKERS))
+    cli_lock = Lock()
+    pending = {}
+
+    def collect(futures):
+        for future in futures:
+            num, name = pending.pop(future)
+            try:
+                res = future.result()
+            except Exception as err:  # pylint: disable=broad-except
+                logging.error(f"Import of {name}: {err}")
+                res = False
+            if res is False:
+                result.failed.append((num, name))
+            else:
+                checkpoint.mark(num)
+                result.done += 1
+            if progress is not None:
+                progress(result)
+
+    with open(path, encoding=bwm.ENC, newline="") as fin, ThreadPoolExecutor(
+        max_workers=workers
+    ) as pool:
+        try:
+            for num, (folder, item) in enumerate(
+                read_items(fin, file_format(path))
+            ):
+                if num in checkpoint:
+                    result.skipped += 1
+                    continue
+                item = {k: v for k, v in item.items() if k not in READ_ONLY}
+                item.update(organizationId=None, collectionIds=[])
+                item["folderId"] = _folder_id(folder, vault, folder_ids)
+                if len(pending) >= workers * READ_AHEAD:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = pool.submit(_create, item, vault, cli_lock)
+                pending[future] = (num, item.get("name"))
+        finally:
+            collect(list(pending))
+            checkpoint.save()
+    if not result.failed:
+        checkpoint.remove()
+    return result
+
+
+# vim: set et ts=4 sw=4 :
@@ -1,5 +1,7 @@
 """Bitwarden-menu main module"""
 
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import csv
 from dataclasses import dataclass, field
 from enum import Enum, auto
 from functools import partial
@@ -8,17 +10,43 @@ import multiprocessing
 from os import environ, makedirs
 from os.path import join
 import shlex
+import signal
 import sys
 import subprocess
 from threading import Timer
+import time
 from urllib.parse import urlsplit
 
 from bwm import bwcli
-from bwm.bwedit import add_entry, edit_entry, manage_collections, manage_folders
+from bwm.bwbulk import bulk_edit
+from bwm.bwio import export_items, import_items
+from bwm.bwscript import handle_request
+from bwm.bwsearch import VaultIndex
+from bwm.bwedit import (
+    add_entry,
+    edit_entry,
+    manage_collections,
+    manage_folders,
+    read_backend,
+)
 from bwm.bwtype import type_text, type_entry
-from bwm.bwview import view_all_entries, view_entry
+from bwm.bwview import (
+    encode_rows,
+    entry_rows,
+    stream_rows,
+    view_all_entries,
+    view_entry,
+    view_folder,
+    view_merged_entries,
+    view_totp_codes,
+)
 from bwm.menu import dmenu_select, dmenu_err
 from bwm.bwserve import BWCLIServer
+from bwm.bwserve_async import BWServePool
+from bwm.foldertree import Node
+from bwm.frecency import Frecency
+from bwm import diagnostics, metrics, trace
+from bwm.watchdog import Watchdog, kill_stuck
 import bwm
 
 
@@ -49,6 +77,11 @@ def get_passphrase(secret="Password"):
     return password
 
 
+# Seconds before retrying a bw serve that failed to start (doubles each time)
+SERVE_RETRY_MIN = 30
+SERVE_RETRY_MAX = 600
+
+
 @dataclass
 class Vault:  # pylint: disable=too-many-instance-attributes
     """Definition for a Vault object"""
@@ -61,11 +94,43 @@ class Vault:  # pylint: disable=too-many-instance-attributes
     session: bytes = field(default_factory=bytes)
     bwcliserver: BWCLIServer | None = field(default=None)
     use_serve: bool = field(default=True)  # Try to use bw serve by default
+    # Failed bw serve starts and when to try again (time.monotonic())
+    serve_failures: int = field(default=0, repr=False)
+    serve_retry: float = field(default=0.0, repr=False)
     prev_entry: list[bwcli.Item] = field(default=None)
     entries: list[bwcli.Item] = field(default_factory=bwcli.Item)
     folders: dict[dict] = field(default_factory=dict)
     collections: dict[dict] = field(default_factory=dict)
     orgs: dict[dict] = field(default_factory=dict)
+    # Incremented when folders or collections are loaded, added, renamed,
+    # moved or deleted so caches derived from their names can be kept
+    folders_rev: int = field(default=0, repr=False)
+    index: VaultIndex = field(default_factory=VaultIndex)
+    # Environment for bw commands, with the vault's own BITWARDENCLI_APPDATA_DIR
+    env: dict = field(default=None, repr=False)
+    # Background load started by preload_vaults(wait=False)
+    loading: Future | None = field(default=None, repr=False)
+    # Cached merged view listing: (cache key, rows)
+    listing: tuple = field(default=None, repr=False)
+    # Cached encoded main menu rows: (cache key, bytes)
+    rows: tuple = field(default=None, repr=False)
+    # Hidden folder and collection ids: (cache key, folder ids, collection
+    # ids) and the entries left in the main menu: (cache key, entries)
+    hidden: tuple = field(default=None, repr=False)
+    shown: tuple = field(default=None, repr=False)
+    # How often and how recently entries were typed
+    frecency: Frecency = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.frecency is None:
+            self.frecency = Frecency(self.url, self.email)
+        if self.env is None:
+            self.env = {
+                **environ,
+                "BITWARDENCLI_APPDATA_DIR": join(
+                    bwm.DATA_HOME, urlsplit(self.url).netloc
+                ),
+            }
 
 
 def get_vault(vaults=None, **kwargs):
@@ -140,7 +205,7 @@ def get_vault(vaults=None, **kwargs):
 
 
 def set_vault(vaults):
-    """Setup ENV variable and vault info.
+    """Unlock (or log in to) the active vault and start bw serve for it.
 
     Args: vaults - list of Vault objects (1st one is currently active)
     Returns: vaults - list of Vault objects (with session added for active vault)
@@ -152,13 +217,19 @@ def set_vault(vaults):
         return passw or None
 
     vault = vaults[0]
-    vault_dir = join(bwm.DATA_HOME, urlsplit(vault.url).netloc)
-    makedirs(vault_dir, exist_ok=True)
-    environ["BITWARDENCLI_APPDATA_DIR"] = vault_dir
+    if vault.loading is not None:
+        # Let a background preload finish rather than racing it
+        vault.loading.exception()
+    makedirs(vault.env["BITWARDENCLI_APPDATA_DIR"], exist_ok=True)
+    if vault.session and vault.folders:
+        # Already unlocked and loaded (e.g. by preload_vaults). Retries bw
+        # serve if it failed to start earlier.
+        start_serve(vault)
+        return vaults
 
     # Get status first to determine vault state
     # NOTE: Don't start bw serve yet - it requires vault to be authenticated
-    status = bwcli.status()
+    status = bwcli.status(env=vault.env)
     logging.debug(
         f"set_vault: Initial status check - {status.get('status') if status else 'error'}"
     )
@@ -169,7 +240,7 @@ def set_vault(vaults):
     elif status["status"] == "unauthenticated":
         if status["serverUrl"] is None:
             # Set server URL using CLI (bw serve not available when unauthenticated)
-            success = bwcli.set_server(vault.url)
+            success = bwcli.set_server(vault.url, env=vault.env)
             if success is False:
                 if len(vaults) > 1:
                     vaults.insert(-1, vaults.pop(-1))
@@ -178,93 +249,49 @@ def set_vault(vaults):
 
         vault.passw = vault.passw or password()
         code = get_passphrase("2FA Code") if vault.twofactor else ""
-        environ["BW_CLIENTSECRET"] = get_passphrase(
-            "client_secret (if required)"
-        )
+        # BW_CLIENTSECRET is only passed to the login process
+        login_env = dict(vault.env)
+        secret = get_passphrase("client_secret (if required)")
+        if secret:
+            login_env["BW_CLIENTSECRET"] = secret
 
         # Step 1: Login via CLI to get session token
         logging.debug("set_vault: Logging in via CLI")
         vault.session, err = bwcli.login(
-            vault.email, vault.passw, vault.twofactor, code
+            vault.email,
+            vault.passw,
+            vault.twofactor,
+            code,
+            env=login_env,
         )
         logging.debug(
             f"set_vault: CLI login result - session={vault.session is not False}, err={err}"
         )
 
-        del environ["BW_CLIENTSECRET"]
-
         # Sync and start bw serve with session token
         if vault.session is not False:
             logging.debug("set_vault: Syncing vault after login")
-            if not bwcli.sync(vault.session):
+            if not bwcli.sync(vault.session, env=vault.env):
                 logging.warning("set_vault: Vault sync via CLI failed")
 
             # Step 2: Start bw serve with --session from login
-            if vault.use_serve and vault.bwcliserver is None:
-                logging.debug(
-                    "set_vault: Starting bw serve with session from login"
-                )
-                vault.bwcliserver = BWCLIServer()
-                if not vault.bwcliserver.start(session=vault.session):
-                    logging.info(
-                        "bw serve failed to start, falling back to CLI"
-                    )
-                    vault.bwcliserver.stop()
-                    vault.bwcliserver = None
-                    vault.use_serve = False
-                else:
-                    # Step 3: Call unlock API endpoint on bw serve
-                    logging.debug("set_vault: Calling unlock API on bw serve")
-                    unlock_session, unlock_err = vault.bwcliserver.unlock(
-                        vault.passw
-                    )
-                    if unlock_session is False:
-                        logging.warning(
-                            f"bw serve unlock API failed: {unlock_err}, but continuing with CLI session"
-                        )
-                    else:
-                        logging.debug(
-                            "set_vault: bw serve unlock API successful"
-                        )
+            # Step 3: Call unlock API endpoint on bw serve
+            start_serve(vault)
 
     elif status["status"] == "locked":
         vault.passw = vault.passw or password()
 
         # Step 1: Unlock via CLI to get session token
         logging.debug("set_vault: Unlocking via CLI")
-        vault.session, err = bwcli.unlock(vault.passw)
+        vault.session, err = bwcli.unlock(vault.passw, env=vault.env)
         logging.debug(
             f"set_vault: CLI unlock result - session={vault.session is not False}, err={err}"
         )
 
         # Step 2: Start bw serve with --session from unlock
         # Step 3: Call /unlock API endpoint to unlock the vault in bw serve
-        if (
-            vault.session is not False
-            and vault.use_serve
-            and vault.bwcliserver is None
-        ):
-            logging.debug(
-                "set_vault: Starting bw serve with session from unlock"
-            )
-            vault.bwcliserver = BWCLIServer()
-            if not vault.bwcliserver.start(session=vault.session):
-                logging.info("bw serve failed to start, falling back to CLI")
-                vault.bwcliserver.stop()
-                vault.bwcliserver = None
-                vault.use_serve = False
-            else:
-                # Step 3: Call unlock API endpoint on bw serve
-                logging.debug("set_vault: Calling unlock API on bw serve")
-                unlock_session, unlock_err = vault.bwcliserver.unlock(
-                    vault.passw
-                )
-                if unlock_session is False:
-                    logging.warning(
-                        f"bw serve unlock API failed: {unlock_err}, but continuing with CLI session"
-                    )
-                else:
-                    logging.debug("set_vault: bw serve unlock API successful")
+        if vault.session is not False:
+            start_serve(vault)
 
     elif status["status"] == "unlocked":
         # Vault is already unlocked via CLI, get the session token
@@ -272,16 +299,7 @@ def set_vault(vaults):
         logging.debug("set_vault: Vault already unlocked via CLI")
 
         # Start bw serve with the existing session token
-        if vault.session and vault.use_serve and vault.bwcliserver is None:
-            logging.debug("set_vault: Starting bw serve with existing session")
-            vault.bwcliserver = BWCLIServer()
-            if not vault.bwcliserver.start(session=vault.session):
-                logging.info("bw serve failed to start, falling back to CLI")
-                vault.bwcliserver.stop()
-                vault.bwcliserver = None
-                vault.use_serve = False
-            else:
-                logging.debug("set_vault: bw serve started successfully")
+        start_serve(vault)
 
     if vault.session is False:
         vault.passw = ""
@@ -294,6 +312,156 @@ def set_vault(vaults):
     return vaults
 
 
+def start_serve(vault):
+    """Start bw serve for an unlocked vault and unlock it there if the vault
+    password is known.
+
+    If bw serve fails to start the CLI is used instead and the start is
+    retried with backoff on later calls (SERVE_RETRY_MIN doubling up to
+    SERVE_RETRY_MAX seconds) rather than giving up on bw serve for the rest of
+    the session. Once running, BWCLIServer restarts bw serve if it crashes.
+
+    Args: vault - Vault object
+    Returns: True if bw serve is running, False if the CLI is used
+
+    """
+    if vault.bwcliserver is not None:
+        return True
+    if (
+        not vault.use_serve
+        or not vault.session
+        or time.monotonic() < vault.serve_retry
+    ):
+        return False
+    logging.debug(f"start_serve: Starting bw serve for {vault.url}")
+    size = bwm.CONF.getint("vault", "serve_connections", fallback=1)
+    if size > 1:
+        server = BWServePool(env=vault.env, size=size)
+    else:
+        server = BWCLIServer(env=vault.env)
+    if not server.start(session=vault.session):
+        server.stop()
+        vault.serve_failures += 1
+        delay = min(
+            SERVE_RETRY_MIN * 2 ** (vault.serve_failures - 1), SERVE_RETRY_MAX
+        )
+        vault.serve_retry = time.monotonic() + delay
+        logging.info(
+            f"bw serve failed to start, falling back to CLI. Retrying in {delay}s"
+        )
+        return False
+    vault.serve_failures = 0
+    vault.bwcliserver = server
+    if vault.passw:
+        unlock_session, unlock_err = server.unlock(vault.passw)
+        if unlock_session is False:
+            logging.warning(
+                f"bw serve unlock API failed: {unlock_err}, but continuing with CLI session"
+            )
+    return True
+
+
+def load_entries(vault):
+    """Get all entries, folders, collections and orgs using server or CLI and
+    rebuild the search index.
+
+    Args: vault - Vault object
+    Returns: True on success, False on error (vault contents unchanged)
+
+    """
+    res = read_backend(
+        vault,
+        lambda server: server.get_entries(),
+        lambda: bwcli.get_entries(vault.session, env=vault.env),
+    )
+    if res is False or any(i is False for i in res):
+        metrics.incr("reload errors")
+        return False
+    vault.entries, vault.folders, vault.collections, vault.orgs = res
+    vault.folders_rev += 1
+    vault.index.rebuild(vault.entries, vault.folders)
+    metrics.incr("reloads")
+    return True
+
+
+def _preload_vault(vault, status):
+    """Unlock a vault, start bw serve and load its entries (run in a worker
+    thread by preload_vaults)
+
+    Args: vault - Vault object
+          status - bwcli.status() dict
+    Returns: True on success, False on error
+
+    """
+    if not vault.session:
+        if status.get("status") == "unlocked":
+            vault.session = status.get("session", b"")
+        elif status.get("status") == "locked" and vault.passw:
+            vault.session, err = bwcli.unlock(vault.passw, env=vault.env)
+            if vault.session is False:
+                logging.warning(f"preload: unlock {vault.url} failed: {err}")
+                vault.session, vault.passw = b"", ""
+                return False
+        else:
+            return False
+    start_serve(vault)
+    return load_entries(vault)
+
+
+def preload_vaults(vaults, wait=True):
+    """Unlock and load all vaults concurrently so switching vaults is instant.
+    Enabled with 'preload_vaults = True' in config.ini.
+
+    Each vault uses its own BITWARDENCLI_APPDATA_DIR and bw serve process.
+    Passwords for locked vaults are asked for in turn before unlocking starts.
+    Vaults that are not logged in yet are skipped and logged in when first
+    selected.
+
+    Args: vaults - list of Vault objects. Already loaded vaults are skipped.
+          wait - if False, return once loading has started. Each vault's
+                 'loading' future is set to the result of its load.
+    Returns: list of Vault objects that were loaded (empty if wait is False)
+
+    """
+    pending = [i for i in vaults if not i.folders and i.loading is None]
+    if not pending:
+        return []
+    for vault in pending:
+        makedirs(vault.env["BITWARDENCLI_APPDATA_DIR"], exist_ok=True)
+    pool = ThreadPoolExecutor(max_workers=len(pending))
+    statuses = list(
+        pool.map(
+            lambda v: (
+                {"status": "unlocked"} if v.session else bwcli.status(env=v.env)
+            ),
+            pending,
+        )
+    )
+    for vault, status in zip(pending, statuses):
+        if status.get("status") == "locked" and not vault.passw:
+            vault.passw = get_passphrase(f"Password for {vault.url}")
+        vault.loading = pool.submit(_preload_vault, vault, status)
+        vault.loading.add_done_callback(
+            partial(_preload_done, f"{vault.url} ({vault.email})")
+        )
+    pool.shutdown(wait=wait)
+    if not wait:
+        return []
+    return [
+        i
+        for i in pending
+        if i.loading.exception() is None and i.loading.result()
+    ]
+
+
+def _preload_done(name, future):
+    """Log vaults that couldn't be preloaded"""
+    if future.exception() is not None:
+        logging.error(f"preload: {name} not loaded: {future.exception()!r}")
+    elif not future.result():
+        logging.warning(f"preload: {name} not loaded")
+
+
 def get_initial_vault(url=None, email=None):
     """Ask for initial server URL and email if not entered in config file or
     passed on the CLI.
@@ -360,6 +528,157 @@ def dmenu_view(entries, folders):
     return entry
 
 
+def browse_level(vault, node):
+    """Return the subfolders and entries of a folder level that aren't hidden
+    from the main menu (see hidden_ids)
+
+    Subfolders whose folders are all hidden are left out and the counts of
+    the others only include entries that are shown.
+
+    Args: vault - Vault object
+          node - foldertree.Node
+    Returns: (list of (Node, entry count), list of entries)
+
+    """
+    tree = vault.index.tree
+    hidden = hidden_ids(vault)
+    if not any(hidden):
+        return [(i, i.count) for i in node.subfolders()], tree.entries(node)
+    subfolders = []
+    for child in node.subfolders():
+        nodes = list(child.walk())
+        fids = [j for i in nodes for j in i.folders]
+        if fids and all(i in hidden[0] for i in fids):
+            continue
+        count = sum(
+            not is_hidden(j, hidden) for i in nodes for j in tree.entries(i)
+        )
+        subfolders.append((child, count))
+    entries = [i for i in tree.entries(node) if not is_hidden(i, hidden)]
+    return subfolders, entries
+
+
+def dmenu_browse(vault):
+    """Browse the vault one folder at a time and type the selected entry
+    (called from dmenu_run). Hidden folders and collections are left out.
+
+    Args: vault - Vault object
+    Returns: None or entry (Item)
+
+    """
+    node = vault.index.tree.root()
+    while True:
+        subfolders, entries = browse_level(vault, node)
+        sel = view_folder(node, entries, vault.folders, subfolders)
+        if sel is None:
+            return None
+        if not isinstance(sel, Node):
+            break
+        node = sel
+    type_entry(sel, vault.autotype)
+    vault.frecency.visit(sel["id"])
+    return sel
+
+
+def dmenu_totp(entries, folders):
+    """View current TOTP codes and type the selected one (called from
+    dmenu_run)
+
+    Args: entries (list of dicts)
+          folders (dict of dicts)
+
+    """
+    text = view_totp_codes(entries, folders)
+    if text:
+        type_text(text)
+
+
+def dmenu_search(vault, query="", url=""):
+    """Type the entry matching a search query and/or URL (called from
+    DmenuRunner for --query and --url)
+
+    A launcher is only shown if more than one entry matches.
+
+    Args: vault - Vault object
+          query - search string (see VaultIndex.find)
+          url - URL to match against entry URIs
+    Returns: None or entry (Item)
+
+    """
+    if url:
+        matches = vault.index.find_url(url)
+        if query:
+            found = {i["id"] for i in vault.index.find(query)}
+            matches = [i for i in matches if i["id"] in found]
+    else:
+        matches = vault.index.find(query)
+    if not matches:
+        dmenu_err(f"No entries found for: {query or url}")
+        return None
+    if len(matches) == 1:
+        entry = matches[0]
+    else:
+        sel = view_all_entries([], matches, vault.folders)
+        try:
+            entry = matches[int(sel.split("(", 1)[0])]
+        except (ValueError, TypeError):
+            return None
+    type_entry(entry, vault.autotype)
+    vault.frecency.visit(entry["id"])
+    return entry
+
+
+def dmenu_export(vault, path):
+    """Write the vault entries to an export file (called from DmenuRunner for
+    --export)
+
+    Args: vault - Vault object
+          path - output file (.json or .csv)
+
+    """
+    try:
+        res = export_items(vault.entries, vault.folders, path)
+    except OSError as err:
+        logging.error(f"Export to {path} failed: {err}")
+        dmenu_err(f"Export failed: {err}")
+        return
+    msg = f"Exported {res.done} entries to {path}"
+    if res.skipped:
+        msg += f"\n{res.skipped} cards and identities skipped (not in CSV)"
+    dmenu_select(len(msg.splitlines()), "Export", inp=msg)
+
+
+def dmenu_import(vault, path, progress=None):
+    """Create the entries of an export file in the vault and reload it
+    (called from DmenuRunner for --import)
+
+    Args: vault - Vault object
+          path - export file (.json or .csv)
+          progress - optional function(IOResult) called after each item
+
+    """
+    try:
+        res = import_items(vault, path, progress)
+    except (OSError, ValueError, csv.Error) as err:
+        logging.error(f"Import of {path} failed: {err}")
+        dmenu_err(f"Import failed: {err}")
+        return
+    if res.done and not load_entries(vault):
+        dmenu_err("Error loading entries. See logs.")
+    msg = f"Imported {res.done} entries from {path}"
+    if res.skipped:
+        msg += f"\n{res.skipped} entries skipped (imported before)"
+    if res.failed:
+        msg += (
+            f"\n{len(res.failed)} entries failed, run the import again "
+            "to retry them:\n"
+        )
+        msg += "\n".join(f"{i}: {j}" for i, j in res.failed)
+        dmenu_err(msg)
+        return
+    dmenu_select(len(msg.splitlines()), "Import", inp=msg)
+
+
 def dmenu_view_previous_entry(entry, folders):
     """View previous entry
 
@@ -391,6 +710,21 @@ def dmenu_edit(entries, folders, collections, vault):
     return edit_entry(entry, entries, folders, collections, vault)
 
 
+def dmenu_bulk(entries, folders, collections, vault):
+    """Move, change collections of or delete several entries (called from
+    dmenu_run)
+
+    Args: entries (list of dicts)
+          folders (dict of dict objects)
+          collections (dict of dict objects)
+          vault (Vault object)
+    Returns: Run.CONTINUE
+
+    """
+    bulk_edit(entries, folders, collections, vault)
+    return Run.CONTINUE
+
+
 def dmenu_add(entries, folders, collections, vault):
     """Call add item option (called from dmenu_run)
 
@@ -413,6 +747,7 @@ def dmenu_folders(folders, vault):
 
     """
     manage_folders(folders, vault)
+    vault.folders_rev += 1
     return Run.CONTINUE
 
 
@@ -425,6 +760,7 @@ def dmenu_collections(collections, vault):
 
     """
     manage_collections(collections, vault)
+    vault.folders_rev += 1
     return Run.CONTINUE
 
 
@@ -434,10 +770,11 @@ def dmenu_sync(vault):
     Args: vault - Vault object
 
     """
-    if vault.bwcliserver:
-        res = vault.bwcliserver.sync()
-    else:
-        res = bwcli.sync(vault.session)
+    res = read_backend(
+        vault,
+        lambda server: server.sync(),
+        lambda: bwcli.sync(vault.session, env=vault.env),
+    )
 
     if res is False:
         dmenu_err("Sync error. Check logs.")
@@ -449,10 +786,11 @@ def lock_vault(vault):
     Args: vault - Vault object
     Returns: True on success, False on error
     """
-    if vault.bwcliserver:
-        return vault.bwcliserver.lock()
-    else:
-        return bwcli.lock()
+    return read_backend(
+        vault,
+        lambda server: server.lock(),
+        lambda: bwcli.lock(env=vault.env),
+    )
 
 
 def dmenu_clipboard():
@@ -461,6 +799,224 @@ def dmenu_clipboard():
     return Run.CONTINUE
 
 
+def vault_tags(vaults):
+    """Return a short, unique tag for each vault for the merged view: the
+    server host, or login@host when several logins use the same server.
+
+    Args: vaults - list of Vault objects
+    Returns: list of strings
+
+    """
+    hosts = [urlsplit(i.url).netloc or i.url for i in vaults]
+    return [
+        f"{i.email}@{j}" if hosts.count(j) > 1 else j
+        for i, j in zip(vaults, hosts)
+    ]
+
+
+def hidden_ids(vault):
+    """Return the ids of the folders and collections hidden from the main menu
+    ('hide_folders' and 'hide_collections' in config.ini).
+
+    A hidden folder hides its subfolders too ('Archive' hides
+    'Archive/2020'). Resolved once and cached until the configured names
+    change or the folders or collections do (vault.folders_rev).
+
+    Args: vault - Vault object
+    Returns: (frozenset of folder ids, frozenset of collection ids)
+
+    """
+    key = (
+        vault.folders_rev,
+        bwm.CONF.get("vault", "hide_folders", fallback=""),
+        bwm.CONF.get("vault", "hide_collections", fallback=""),
+    )
+    if vault.hidden is None or vault.hidden[0] != key:
+        hide_folders, hide_collections = (
+            [i.strip() for i in opt.split("\n") if i.strip()] for opt in key[1:]
+        )
+        folders = frozenset(
+            k
+            for k, v in vault.folders.items()
+            if any(
+                v["name"] == i or v["name"].startswith(f"{i}/")
+                for i in hide_folders
+            )
+        )
+        collections = frozenset(
+            k
+            for k, v in vault.collections.items()
+            if v["name"] in hide_collections
+        )
+        vault.hidden = (key, folders, collections)
+    return vault.hidden[1:]
+
+
+def is_hidden(entry, hidden):
+    """Return True if an entry is in a hidden folder or collection
+
+    Args: entry - Item
+          hidden - (folder ids, collection ids) from hidden_ids
+    Returns: bool
+
+    """
+    folders, collections = hidden
+    return entry.get("folderId") in folders or not collections.isdisjoint(
+        entry.get("collectionIds") or ()
+    )
+
+
+def shown_entries(vault):
+    """Return the entries of a vault that aren't hidden from the main menu.
+
+    Filtered once and cached until the entries or hidden ids change.
+
+    Args: vault - Vault object
+    Returns: list of entries (vault.entries if nothing is hidden)
+
+    """
+    hidden = hidden_ids(vault)
+    if not any(hidden):
+        return vault.entries
+    key = (vault.index.version, len(vault.entries), hidden)
+    if vault.shown is None or vault.shown[0] != key:
+        vault.shown = (
+            key,
+            [i for i in vault.entries if not is_hidden(i, hidden)],
+        )
+    return vault.shown[1]
+
+
+def vault_listing(vault, tag):
+    """Return the merged view rows of a loaded vault, tagged with the vault.
+
+    Rows are numbered by position in vault.entries and cached until the
+    entries, folder names or hidden folders change.
+
+    Args: vault - Vault object
+          tag - string
+    Returns: string (newline separated rows)
+
+    """
+    hidden = hidden_ids(vault)
+    key = (
+        tag,
+        vault.index.version,
+        vault.folders_rev,
+        hidden,
+    )
+    cached = vault.listing is not None and vault.listing[0] == key
+    metrics.cache("listing", cached)
+    if not cached:
+        num_align = len(str(len(vault.entries)))
+        rows = entry_rows(
+            (
+                (j, i)
+                for j, i in enumerate(vault.entries)
+                if not is_hidden(i, hidden)
+            ),
+            vault.folders,
+            num_align,
+        )
+        vault.listing = (key, "\n".join(f"[{tag}] {i}" for i in rows))
+    return vault.listing[1]
+
+
+def menu_rows(vault, entries):
+    """Return the encoded main menu rows of a vault.
+
+    Cached until the entries, folder names or hidden folders change, so large
+    vaults aren't formatted and encoded again on each hotkey press.
+
+    Args: vault - Vault object
+          entries - entries shown (shown_entries)
+    Returns: bytes
+
+    """
+    key = _rows_key(vault, entries)
+    cached = vault.rows is not None and vault.rows[0] == key
+    metrics.cache("rows", cached)
+    if not cached:
+        vault.rows = (key, encode_rows(entries, vault.folders))
+    return vault.rows[1]
+
+
+def _rows_key(vault, entries):
+    """Cache key of the main menu rows of a vault"""
+    return (
+        vault.index.version,
+        len(entries),
+        vault.folders_rev,
+        hidden_ids(vault),
+    )
+
+
+def stream_menu_rows(vault, entries):
+    """Generate the main menu rows of a vault chunk by chunk, the most used
+    entries ([dmenu] stream_first) first.
+
+    The cached rows (see menu_rows) are used if current. Otherwise they are
+    formatted chunk by chunk and cached once all are generated.
+
+    Args: vault - Vault object
+          entries - entries shown (shown_entries)
+    Returns: generator of lists of buffers (see bwview.stream_rows)
+
+    """
+    key = _rows_key(vault, entries)
+    ids = vault.frecency.top(
+        bwm.CONF.getint("dmenu", "stream_first", fallback=20)
+    )
+    wanted = set(ids)
+    pos = {i["id"]: j for j, i in enumerate(entries) if i.get("id") in wanted}
+    first = [pos[i] for i in ids if i in pos]
+    cached = vault.rows is not None and vault.rows[0] == key
+    metrics.cache("rows", cached)
+    parts = None if cached else []
+    yield from stream_rows(
+        entries, vault.folders, first, vault.rows[1] if cached else None, parts
+    )
+    if parts is not None:
+        vault.rows = (key, b"\n".join(parts))
+
+
+def merged_listings(vaults, tags):
+    """Generate the merged view rows of each vault.
+
+    Loaded vaults are listed first. Vaults still being loaded by
+    preload_vaults are listed as their load completes.
+
+    Args: vaults - list of Vault objects
+          tags - list of vault tags (see vault_tags)
+    Returns: generator of strings
+
+    """
+    cold = {}
+    for vault, tag in zip(vaults, tags):
+        if vault.loading is not None and not vault.loading.done():
+            cold[vault.loading] = (vault, tag)
+        elif vault.folders:
+            yield vault_listing(vault, tag)
+    for future in as_completed(cold):
+        vault, tag = cold[future]
+        if future.exception() is None and vault.folders:
+            yield vault_listing(vault, tag)
+
+
+def merged_selection(sel, vaults, tags):
+    """Return the vault and entry for a merged view selection
+
+    Args: sel - string '[tag] num(type) - ...'
+          vaults - list of Vault objects
+          tags - list of vault tags
+    Returns: (Vault, entry). Raises ValueError/IndexError on bad selection
+
+    """
+    tag, _, row = sel[1:].partition("] ")
+    vault = vaults[tags.index(tag)]
+    return vault, vault.entries[int(row.split("(", 1)[0])]
+
+
 class Run(Enum):
     """Enum for dmenu_run return values"""
 
@@ -471,36 +1027,34 @@ class Run(Enum):
     SWITCH = auto()
 
 
-def dmenu_run(vault):
+def dmenu_run(vault, vaults=None):
     """Run dmenu with the given vault object
 
-    If 'hide_folders' is defined in config.ini, hide those from main and
-    view/type all views.
+    If 'hide_folders' or 'hide_collections' is defined in config.ini, hide
+    those from main, view/type all and TOTP views.
+
+    If 'merged_view' is set in config.ini, the main menu lists the entries of
+    all loaded vaults (see vaults) tagged with their vault.
 
     Returns: Run Enum (LOCK, CONTINUE, RELOAD, STOP or SWITCH)
 
     """
-    if bwm.CONF.has_option("vault", "hide_folders"):
-        hid_fold = bwm.CONF.get("vault", "hide_folders").split("\n")
-        # Validate ignored folder names in config.ini
-        hid_fold = [
-            i
-            for i in hid_fold
-            if i in [j["name"] for j in vault.folders.values()]
-        ]
-        entries_hid = [i for i in vault.entries if i["folder"] not in hid_fold]
-    else:
-        entries_hid = vault.entries
+    entries_hid = shown_entries(vault)
     options = {
         "View/Type Individual entries": partial(
             dmenu_view, entries_hid, vault.folders
         ),
+        "Browse folders": partial(dmenu_browse, vault),
         "View previous entry": partial(
             dmenu_view_previous_entry, vault.prev_entry, vault.folders
         ),
+        "TOTP codes": partial(dmenu_totp, entries_hid, vault.folders),
         "Edit entries": partial(
             dmenu_edit, vault.entries, vault.folders, vault.collections, vault
         ),
+        "Bulk edit entries": partial(
+            dmenu_bulk, vault.entries, vault.folders, vault.collections, vault
+        ),
         "Add entry": partial(
             dmenu_add, vault.entries, vault.folders, vault.collections, vault
         ),
@@ -515,7 +1069,30 @@ def dmenu_run(vault):
         else "Clipboard/[Type]": dmenu_clipboard,
         "Lock vault": partial(lock_vault, vault),
     }
-    sel = view_all_entries(options, entries_hid, vault.folders)
+    merged = (
+        vaults is not None
+        and len(vaults) > 1
+        and bwm.CONF.getboolean("vault", "merged_view", fallback=False)
+    )
+    if merged:
+        tags = vault_tags(vaults)
+        num_lines = len(options) + sum(len(i.entries) for i in vaults)
+        if any(i.loading is not None and not i.loading.done() for i in vaults):
+            num_lines = bwm.MAX_LEN
+        sel = view_merged_entries(
+            options, merged_listings(vaults, tags), num_lines
+        )
+    elif bwm.CONF.getboolean("dmenu", "stream", fallback=False):
+        sel = view_all_entries(
+            options,
+            entries_hid,
+            vault.folders,
+            stream_menu_rows(vault, entries_hid),
+        )
+    else:
+        sel = view_all_entries(
+            options, entries_hid, vault.folders, menu_rows(vault, entries_hid)
+        )
     if not sel:
         return Run.STOP
     if sel == "Lock vault":  # Kill bwm daemon
@@ -529,10 +1106,15 @@ def dmenu_run(vault):
     if sel not in options:
         # Autotype selected entry
         try:
-            entry = vault.entries[int(sel.split("(", 1)[0])]
-        except (ValueError, TypeError):
+            if merged:
+                typed_vault, entry = merged_selection(sel, vaults, tags)
+            else:
+                typed_vault = vault
+                entry = entries_hid[int(sel.split("(", 1)[0])]
+        except (ValueError, TypeError, IndexError):
             return Run.STOP
         type_entry(entry, vault.autotype)
+        typed_vault.frecency.visit(entry["id"])
         return Run.STOP
     return options[sel]()
 
@@ -548,39 +1130,34 @@ class DmenuRunner(multiprocessing.Process):
     def __init__(self, server, **kwargs):
         multiprocessing.Process.__init__(self)
         self.server = server
+        self.kwargs = kwargs
+        self.vaults = []
+        self.vault = None
+        self.watchdog = None
+        self._activation = None
         bwm.CLIPBOARD = kwargs.get("clipboard")
-        self.vaults = get_vault(**kwargs)
+
+    def _open_vaults(self):
+        """Unlock and load the vaults.
+
+        Runs in the daemon process (not __init__, which runs before the fork)
+        so bw serve, its supervisor thread and background loads belong to the
+        process that uses them.
+
+        """
+        self.vaults = get_vault(**self.kwargs)
         if self.vaults is None:
             self.server.kill_flag.set()
             sys.exit()
         self.vault = self.vaults[0]
 
-        # Get entries using server or CLI
-        if self.vault.bwcliserver:
-            (
-                self.vault.entries,
-                self.vault.folders,
-                self.vault.collections,
-                self.vault.orgs,
-            ) = self.vault.bwcliserver.get_entries()
-        else:
-            (
-                self.vault.entries,
-                self.vault.folders,
-                self.vault.collections,
-                self.vault.orgs,
-            ) = bwcli.get_entries(self.vault.session)
-
-        if not all(
-            i
-            for i in (
-                self.vault.entries,
-                self.vault.folders,
-                self.vault.collections,
-                self.vault.orgs,
-            )
-            if i is False
-        ):
+        if bwm.CONF.getboolean("vault", "preload_vaults", fallback=False):
+            if bwm.CONF.getboolean("vault", "merged_view", fallback=False):
+                # Other vaults are added to the merged view as they load
+                preload_vaults(self.vaults[1:], wait=False)
+            else:
+                preload_vaults(self.vaults)
+        if not self.vault.folders and not load_entries(self.vault):
             dmenu_err("Error loading vault entries.")
             self.server.kill_flag.set()
             sys.exit(1)
@@ -592,100 +1169,147 @@ class DmenuRunner(multiprocessing.Process):
         self.cache_timer.daemon = True
         self.cache_timer.start()
 
+    def _unstick(self, _name):
+        """Watchdog callback: kill the launcher or bw CLI process the daemon
+        is stuck on"""
+        launcher = shlex.split(
+            bwm.CONF.get("dmenu", "dmenu_command", fallback="dmenu")
+        )[0]
+        keep = {
+            i.bwcliserver.process.pid
+            for i in self.vaults
+            if i.bwcliserver is not None and i.bwcliserver.process is not None
+        }
+        kill_stuck(launcher, keep)
+
+    def _close_vaults(self):
+        """Stop bw serve for all vaults"""
+        for vault in self.vaults or []:
+            if vault.bwcliserver is not None:
+                vault.bwcliserver.stop()
+                vault.bwcliserver = None
+
     def run(self):
+        # Exit through the finally clause when the parent process terminates
+        # the daemon
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        try:
+            diagnostics.start()
+            self._open_vaults()
+            self.watchdog = Watchdog(bwm.TIMEOUTS["watchdog"], self._unstick)
+            self._listen()
+        finally:
+            if self.watchdog is not None:
+                self.watchdog.stop()
+            self._close_vaults()
+
+    def _begin_activation(self, dargs):
+        """Start the trace span of one hotkey press or scripting request
+
+        Args: dargs - arguments sent by the client (with its trace_id)
+
+        """
+        trace.new_trace(dargs.get("trace_id"))
+        self._activation = trace.span(
+            "hotkey", command=dargs.get("command") or "menu"
+        )
+        self._activation.__enter__()
+
+    def _end_activation(self):
+        """Record the span of the finished hotkey press"""
+        if self._activation is not None:
+            self._activation.__exit__(None, None, None)
+            self._activation = None
+
+    def _listen(self):
+        """Run bwm each time the hotkey is pressed until the daemon is
+        stopped"""
         at_saved = ""
+        # The first activation is the one that started the daemon (e.g.
+        # --query or --export). The vault and login were used to open it.
+        pending = {
+            k: v
+            for k, v in self.kwargs.items()
+            if v and k not in ("vault", "login")
+        }
         while True:
+            self.watchdog.end()
+            self._end_activation()
             self.server.start_flag.wait()
             if self.server.kill_flag.is_set():
                 break
+            self.watchdog.begin("hotkey")
+            dargs, pending = pending, {}
+            if self.server.args_flag.is_set():
+                dargs = self.server.get_args()
+                self.server.args_flag.clear()
+            self._begin_activation(dargs)
+            if dargs.get("command"):
+                # Scripting requests don't extend the session timeout
+                metrics.incr(f"{dargs['command']} requests")
+                if dargs["command"] == "stats":
+                    reply = {"ok": True, "result": metrics.stats(self.vaults)}
+                elif dargs["command"] == "diagnostics":
+                    reply = {
+                        "ok": True,
+                        "result": diagnostics.report(self.vaults),
+                    }
+                else:
+                    reply = handle_request(self.vault, dargs)
+                self.server.send_reply(dargs["request_id"], reply)
+                if self.server.cache_time_expired.is_set():
+                    self.server.kill_flag.set()
+                    break
+                self._clear_start()
+                continue
+            metrics.incr("hotkey presses")
             try:
                 self.cache_timer.cancel()
             except AttributeError:
                 pass
             self._set_timer()
-            dargs = {}
-            if self.server.args_flag.is_set():
-                dargs = self.server.get_args()
-                self.server.args_flag.clear()
             bwm.CLIPBOARD = dargs.get("clipboard") or bwm.CLIPBOARD
             self.vault.autotype = dargs.get("autotype", "") or bwm.SEQUENCE
             if dargs.get("vault", ""):
                 res = Run.SWITCH
                 at_saved = self.vault.autotype
             elif dargs.get("lock", False):
-                bwcli.lock()
+                bwcli.lock(env=self.vault.env)
                 res = Run.LOCK
+            elif dargs.get("export_file"):
+                res = dmenu_export(self.vault, dargs["export_file"])
+            elif dargs.get("import_file"):
+                # Long imports are fine as long as items keep being created
+                res = dmenu_import(
+                    self.vault,
+                    dargs["import_file"],
+                    lambda _: self.watchdog.begin("import"),
+                )
+            elif dargs.get("query") or dargs.get("url"):
+                res = dmenu_search(
+                    self.vault, dargs.get("query", ""), dargs.get("url", "")
+                )
             else:
                 self.vault.autotype = (
                     at_saved if at_saved else self.vault.autotype
                 )
                 at_saved = ""
-                res = dmenu_run(self.vault)
+                res = dmenu_run(self.vault, self.vaults)
             if res == Run.LOCK:
                 try:
                     self.server.kill_flag.set()
                 except (EOFError, IOError):
                     return
             if res == Run.RELOAD:
-                # Reload entries using server or CLI
-                if self.vault.bwcliserver:
-                    (
-                        self.vault.entries,
-                        self.vault.folders,
-                        self.vault.collections,
-                        self.vault.orgs,
-                    ) = self.vault.bwcliserver.get_entries()
-                else:
-                    (
-                        self.vault.entries,
-                        self.vault.folders,
-                        self.vault.collections,
-                        self.vault.orgs,
-                    ) = bwcli.get_entries(self.vault.session)
-
-                if not all(
-                    i
-                    for i in (
-                        self.vault.entries,
-                        self.vault.folders,
-                        self.vault.collections,
-                        self.vault.orgs,
-                    )
-                    if i is False
-                ):
+                if not load_entries(self.vault):
                     dmenu_err("Error loading entries. See logs.")
                 continue
             if res == Run.SWITCH:
                 self.vaults = get_vault(self.vaults, **dargs)
                 self.vault = self.vaults[0]
-                if not self.vault.folders:
-                    # Check if folders exist because there will always be the
-                    # root folder if entries have been previously retrieved
-                    if self.vault.bwcliserver:
-                        (
-                            self.vault.entries,
-                            self.vault.folders,
-                            self.vault.collections,
-                            self.vault.orgs,
-                        ) = self.vault.bwcliserver.get_entries()
-                    else:
-                        (
-                            self.vault.entries,
-                            self.vault.folders,
-                            self.vault.collections,
-                            self.vault.orgs,
-                        ) = bwcli.get_entries(self.vault.session)
-
-                if not all(
-                    i
-                    for i in (
-                        self.vault.entries,
-                        self.vault.folders,
-                        self.vault.collections,
-                        self.vault.orgs,
-                    )
-                    if i is False
-                ):
+                # Check if folders exist because there will always be the
+                # root folder if entries have been previously retrieved
+                if not self.vault.folders and not load_entries(self.vault):
                     dmenu_err("Error loading entries. See logs.")
                 continue
             if res == Run.CONTINUE:
@@ -696,6 +1320,12 @@ class DmenuRunner(multiprocessing.Process):
                 self.server.kill_flag.set()
             if self.server.kill_flag.is_set():
                 break
+            self._clear_start()
+
+    def _clear_start(self):
+        """Wait for the next hotkey press or request, unless a scripting
+        request arrived while a menu or request was being handled"""
+        if not self.server.args_flag.is_set():
             self.server.start_flag.clear()
 
     def cache_time(self):
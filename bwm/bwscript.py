@@ -0,0 +1,183 @@
+"""Non-interactive requests answered by the daemon from the loaded vault
+(bwm get, bwm totp, bwm list)
+
+Requests arrive on the same authenticated pipe as the other command line
+arguments and the reply is sent back to the waiting client, so scripts get
+a password or TOTP code without starting the bw CLI.
+
+"""
+
+import json
+from os.path import join
+
+from bwm.totp import get_otp_key, otp_now, time_remaining
+import bwm
+
+COMMANDS = ("get", "totp", "list")
+TYPES = {1: "login", 2: "note", 3: "card", 4: "identity"}
+
+
+def folder_name(entry, folders):
+    """Return the folder path of an entry ('' for no folder)"""
+    folder = folders.get(entry.get("folderId"), {}).get("name", "")
+    return "" if folder == "No Folder" else folder
+
+
+def entry_path(entry, folders):
+    """Return folder/name of an entry ('name' for entries without a folder)"""
+    return join(folder_name(entry, folders), entry["name"])
+
+
+def find_entry(vault, target):
+    """Find one entry by id, name, folder/name or search query (in that
+    order; names are case insensitive)
+
+    Args: vault - Vault object
+          target - string
+    Returns: tuple (entry or None, error message)
+
+    """
+    for entry in vault.entries:
+        if entry["id"] == target:
+            return entry, ""
+    name = target.lower()
+    for key in (
+        lambda i: (i["name"] or "").lower(),
+        lambda i: entry_path(i, vault.folders).lower(),
+    ):
+        matches = [i for i in vault.entries if key(i) == name]
+        if len(matches) == 1:
+            return matches[0], ""
+        if matches:
+            return None, f"{len(matches)} entries named {target}, use the id"
+    matches = vault.index.find(target)
+    if len(matches) == 1:
+        return matches[0], ""
+    if matches:
+        return None, f"{len(matches)} entries match {target}"
+    return None, f"No entry found for {target}"
+
+
+def totp_code(entry):
+    """Return (code, seconds remaining) or None if the entry has no TOTP"""
+    otp_url = (entry.get("login") or {}).get("totp")
+    key = get_otp_key(otp_url, entry["id"]) if otp_url else None
+    if key is None:
+        return None
+    return otp_now(key), time_remaining(key)
+
+
+def entry_field(entry, field, folders):
+    """Return one field of an entry
+
+    Args: entry - Item
+          field - password, username, totp, notes, uri, name, id, folder, a
+                  card or identity field label (e.g. 'Number') or the name of
+                  a custom field
+          folders - dict of folder dicts
+    Returns: string or None if the entry doesn't have the field
+
+    """
+    login = entry.get("login") or {}
+    uris = [i["uri"] for i in login.get("uris") or [] if i.get("uri")]
+    values = {
+        "password": login.get("password"),
+        "username": login.get("username"),
+        "notes": entry.get("notes"),
+        "uri": uris[0] if uris else None,
+        "name": entry.get("name"),
+        "id": entry.get("id"),
+        "folder": folder_name(entry, folders),
+    }
+    if field.lower() in values:
+        return values[field.lower()]
+    if field.lower() == "totp":
+        code = totp_code(entry)
+        return code[0] if code else None
+    if entry.get("card") and field in bwm.CARD:
+        return entry["card"].get(bwm.CARD[field])
+    if entry.get("identity") and field in bwm.IDENTITY:
+        return entry["identity"].get(bwm.IDENTITY[field])
+    for fld in entry.get("fields") or []:
+        if fld.get("name") == field:
+            return fld.get("value")
+    return None
+
+
+def list_row(entry, folders):
+    """Return the non secret attributes of an entry for 'bwm list'"""
+    login = entry.get("login") or {}
+    return {
+        "id": entry["id"],
+        "name": entry["name"],
+        "path": entry_path(entry, folders),
+        "type": TYPES.get(entry["type"], str(entry["type"])),
+        "username": login.get("username"),
+        "uris": [i["uri"] for i in login.get("uris") or [] if i.get("uri")],
+    }
+
+
+def handle_request(vault, args):
+    """Answer one scripting request
+
+    Args: vault - Vault object
+          args - dict of command line arguments: command (get, totp or list),
+                 target, field, search
+    Returns: dict {'ok': bool, 'result': value or 'error': message}
+
+    """
+    command = args.get("command")
+    if vault is None or not vault.folders:
+        return {"ok": False, "error": "Vault is not loaded"}
+    if command == "list":
+        entries = (
+            vault.index.find(args["search"])
+            if args.get("search")
+            else vault.entries
+        )
+        return {
+            "ok": True,
+            "result": [list_row(i, vault.folders) for i in entries],
+        }
+    if command not in COMMANDS:
+        return {"ok": False, "error": f"Unknown command {command}"}
+    entry, error = find_entry(vault, args.get("target") or "")
+    if entry is None:
+        return {"ok": False, "error": error}
+    if command == "totp":
+        code = totp_code(entry)
+        if code is None:
+            return {"ok": False, "error": f"{entry['name']} has no TOTP"}
+        return {"ok": True, "result": {"code": code[0], "remaining": code[1]}}
+    field = args.get("field") or "password"
+    value = entry_field(entry, field, vault.folders)
+    if value is None:
+        return {"ok": False, "error": f"{entry['name']} has no {field}"}
+    return {
+        "ok": True,
+        "result": {"id": entry["id"], "field": field, "value": value},
+    }
+
+
+def format_reply(command, result, as_json=False):
+    """Format a successful reply for stdout
+
+    Args: command - get, totp, list, stats or diagnostics
+          result - 'result' of the reply
+          as_json - output JSON instead of plain text (always for stats and
+                    diagnostics)
+    Returns: string
+
+    """
+    if as_json or command in ("stats", "diagnostics"):
+        return json.dumps(result, indent=2)
+    if command == "list":
+        return "\n".join(
+            f"{i['id']}\t{i['path']}\t{i['username'] or ''}" for i in result
+        )
+    if command == "totp":
+        return result["code"]
+    return result["value"]
+
+
+# vim: set et ts=4 sw=4 :
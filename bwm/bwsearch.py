@@ -0,0 +1,223 @@
+"""In-memory search index over vault entries"""
+
+from bisect import bisect_left
+import re
+
+from bwm.foldertree import FolderTree
+from bwm.urimatch import UriMatcher, registrable_domain, uri_host
+
+FIELDS = ("name", "folder", "username", "host", "domain", "field")
+# Query prefixes accepted in addition to FIELDS
+ALIASES = {"user": "username", "url": "host", "uri": "host"}
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def entry_terms(entry):
+    """Generate (field, term) pairs to index for an entry
+
+    Args: entry - Item
+    Returns: generator of (field, term)
+
+    """
+    name = (entry.get("name") or "").lower()
+    if name:
+        yield "name", name
+        for word in _WORD_RE.findall(name):
+            yield "name", word
+    yield "folder", entry.get("folderId")
+    login = entry.get("login") or {}
+    if login.get("username"):
+        yield "username", login["username"].lower()
+    for uri in login.get("uris") or []:
+        host = uri_host(uri.get("uri"))
+        if host:
+            yield "host", host
+            yield "domain", registrable_domain(host)
+    for fld in entry.get("fields") or []:
+        # Only plain text fields, never hidden (type 1) values
+        if fld.get("type") == 0 and fld.get("value"):
+            if fld.get("name") == "autotype":
+                continue
+            yield "field", fld["value"].lower()
+
+
+class VaultIndex:
+    """Inverted index of vault entries by name, folder, username, URI host,
+    registrable domain and custom text fields.
+
+    Updated incrementally with add/remove/update as entries change and
+    rebuilt when the vault is reloaded, together with the URI matcher (uris)
+    and the folder tree (tree).
+
+    """
+
+    def __init__(self):
+        # Incremented on every change so callers can cache derived data
+        self.version = 0
+        self._reset()
+
+    def _reset(self):
+        # pylint: disable=attribute-defined-outside-init
+        self.version += 1
+        self.folders = {}
+        self._items = {}
+        self._order = {}
+        self._seq = 0
+        self._terms = {}
+        self._postings = {i: {} for i in FIELDS}
+        self._sorted = {}
+        self.uris = UriMatcher()
+        self.tree = FolderTree(self.folders)
+
+    def __len__(self):
+        return len(self._items)
+
+    def rebuild(self, entries, folders):
+        """Index all entries from scratch
+
+        Args: entries - list of Items
+              folders - folders dict. Kept by reference so renamed folders are
+                        found without reindexing.
+
+        """
+        self._reset()
+        self.folders = folders if folders else {}
+        self.tree.folders = self.folders
+        for entry in entries or []:
+            self.add(entry)
+
+    def add(self, entry):
+        """Add an entry to the index"""
+        if entry.get("id") is None:
+            return
+        if entry["id"] in self._items:
+            self.remove(self._items[entry["id"]])
+        self._items[entry["id"]] = entry
+        self._order[entry["id"]] = self._seq
+        self._seq += 1
+        self.version += 1
+        terms = set(entry_terms(entry))
+        self._terms[entry["id"]] = terms
+        for fld, term in terms:
+            postings = self._postings[fld]
+            if term not in postings:
+                postings[term] = set()
+                self._sorted.pop(fld, None)
+            postings[term].add(entry["id"])
+        self.uris.add(entry)
+        self.tree.add(entry)
+
+    def remove(self, entry):
+        """Remove an entry from the index"""
+        item_id = entry.get("id")
+        if item_id not in self._items:
+            return
+        for fld, term in self._terms.pop(item_id):
+            postings = self._postings[fld]
+            postings[term].discard(item_id)
+            if not postings[term]:
+                del postings[term]
+                self._sorted.pop(fld, None)
+        del self._items[item_id]
+        del self._order[item_id]
+        self.version += 1
+        self.uris.remove(entry)
+        self.tree.remove(entry)
+
+    def update(self, old, new):
+        """Replace an edited entry. The id may change (e.g. collection moves)
+        so the old entry is removed first.
+
+        """
+        seq = self._order.get(old.get("id"))
+        self.remove(old)
+        self.add(new)
+        if seq is not None and new.get("id") in self._order:
+            self._order[new["id"]] = seq
+
+    def _prefix(self, fld, prefix):
+        """Return ids for all terms of a field starting with prefix"""
+        keys = self._sorted.get(fld)
+        if keys is None:
+            keys = self._sorted[fld] = sorted(
+                i for i in self._postings[fld] if i is not None
+            )
+        ids = set()
+        for key in keys[bisect_left(keys, prefix) :]:
+            if not key.startswith(prefix):
+                break
+            ids |= self._postings[fld][key]
+        return ids
+
+    def _lookup(self, fld, value):
+        """Return ids matching one query term"""
+        if fld == "folder":
+            value = value.strip("/")
+            fids = [
+                i
+                for i, j in self.folders.items()
+                if j["name"].lower() == value
+                or j["name"].lower().startswith(f"{value}/")
+                or (j["name"] == "No Folder" and value == "")
+            ]
+            ids = set()
+            for fid in fids:
+                ids |= self._postings["folder"].get(fid, set())
+            return ids
+        if fld == "host":
+            value = uri_host(value) or value
+            return set(self._postings["host"].get(value, set()))
+        if fld == "domain":
+            value = registrable_domain(uri_host(value) or value)
+            return set(self._postings["domain"].get(value, set()))
+        return self._prefix(fld, value)
+
+    def _sorted_items(self, ids):
+        return [
+            self._items[i] for i in sorted(ids, key=self._order.__getitem__)
+        ]
+
+    def find(self, query):
+        """Find entries matching all terms of a query
+
+        Terms are separated by whitespace. 'field:value' restricts a term to
+        one of name, folder, username (user), host (url), domain or field.
+        Bare terms match the start of words in the entry name. Values are case
+        insensitive.
+
+        Args: query - string
+        Returns: list of Items in vault order
+
+        """
+        ids = None
+        for term in query.lower().split():
+            fld, sep, value = term.partition(":")
+            fld = ALIASES.get(fld, fld)
+            if not sep or fld not in FIELDS:
+                fld, value = "name", term
+            found = self._lookup(fld, value)
+            ids = found if ids is None else ids & found
+            if not ids:
+                return []
+        return self._sorted_items(ids or set())
+
+    def find_url(self, url):
+        """Find entries with a URI matching a URL, honoring the URI match type
+        of each login URI (see bwm.urimatch)
+
+        More specific matches (exact, starts with, regex, host) are listed
+        before entries that only share the registrable domain.
+
+        Args: url - string
+        Returns: list of Items
+
+        """
+        found = self.uris.match(url)
+        return [
+            self._items[i]
+            for i in sorted(found, key=lambda i: (found[i], self._order[i]))
+        ]
+
+
+# vim: set et ts=4 sw=4 :
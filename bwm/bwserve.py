@@ -3,14 +3,139 @@ Provide methods to manipulate Bitwarden vault using the Bitwarden CLI,
 primarily via the `serve` command
 """
 
-from http.client import HTTPConnection
+from collections import deque
+from http.client import HTTPConnection, HTTPException
 import json
 import logging
+import re
 from subprocess import Popen, PIPE
 import socket
+from threading import Event, RLock, Thread
 import time
 from urllib.parse import urlencode
-from bwm.bwcli import Item
+from bwm import bwcli
+from bwm.bwcli import BWTimeoutError, Item
+from bwm import metrics, trace
+
+# Requests that are safe to send again after bw serve is restarted. Other
+# POSTs (e.g. creating an item) may have been applied before the crash. A
+# DELETE that was applied would fail with 'Not found' when sent again, so
+# deletes aren't replayed either.
+IDEMPOTENT_METHODS = ("GET", "PUT")
+IDEMPOTENT_POSTS = ("/sync", "/lock", "/unlock")
+# Seconds between attempts to restart a crashed bw serve
+RESTART_BACKOFF = (0.5, 1, 2, 5, 10, 30)
+# A process that ran this long before exiting resets the backoff
+RESTART_STABLE = 60
+# Seconds a request waits for bw serve to be restarted
+RESTART_WAIT = 10
+# Timeout budgets ([timeouts] in config.ini) of bw serve endpoints. Others use
+# 'serve'.
+OPERATIONS = (("/sync", "sync"), ("/unlock", "unlock"), ("/list/", "list"))
+# Lines of bw serve stdout/stderr kept for diagnostics
+PIPE_LOG_LINES = 200
+# Longest line read from bw serve at once (bytes)
+PIPE_LOG_CHUNK = 65536
+# Object ids in request URLs, replaced in trace spans so requests group by
+# endpoint
+_ID_RE = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+)
+
+
+class PipeLog:
+    """Continuously drain a pipe of the bw serve process so it can never fill
+    the pipe buffer and block bw serve. The last lines are kept in a ring
+    buffer along with counters for diagnostics.
+
+    """
+
+    def __init__(self, pipe, name, maxlen=PIPE_LOG_LINES):
+        """Start draining the pipe in a daemon thread
+
+        Args: pipe - binary file object (Popen.stdout or Popen.stderr)
+              name - 'stdout' or 'stderr'
+              maxlen - number of lines to keep
+
+        """
+        self.name = name
+        self.lines = deque(maxlen=maxlen)
+        self.line_count = 0
+        self.byte_count = 0
+        self._thread = Thread(
+            target=self._drain,
+            args=(pipe,),
+            name=f"bw-serve-{name}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _drain(self, pipe):
+        """Read the pipe until bw serve closes it"""
+        try:
+            for line in iter(lambda: pipe.readline(PIPE_LOG_CHUNK), b""):
+                self.line_count += 1
+                self.byte_count += len(line)
+                text = line.decode("utf-8", "replace").rstrip()
+                self.lines.append(text)
+                if self.name == "stderr":
+                    logging.debug(f"bw serve stderr: {text}")
+        except (OSError, ValueError) as e:
+            logging.debug(f"bw serve {self.name} closed: {e}")
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    def tail(self, num=5, timeout=1):
+        """Return the last lines, waiting up to timeout seconds for the pipe
+        to be drained if the process has exited
+
+        Returns: string (lines separated by ' | ')
+        """
+        self._thread.join(timeout)
+        return " | ".join(list(self.lines)[-num:])
+
+    def stats(self):
+        """Return the counters for diagnostics
+
+        Returns: dict - {lines: int, bytes: int, dropped: lines no longer
+                 kept, alive: bool}
+        """
+        return {
+            "lines": self.line_count,
+            "bytes": self.byte_count,
+            "dropped": max(0, self.line_count - len(self.lines)),
+            "alive": self._thread.is_alive(),
+        }
+
+
+def endpoint(url):
+    """Return a request URL with object ids replaced by '{id}'"""
+    return _ID_RE.sub("{id}", url.split("?", 1)[0])
+
+
+def parse_response(response_body):
+    """Parse a bw serve API response body
+
+    Args: response_body - string
+    Returns: tuple (success: bool, data: dict or error message)
+    """
+    logging.debug(f"Response body (first 200 chars): {response_body[:200]}")
+
+    if not response_body:
+        return False, "Empty response from server"
+
+    try:
+        json_response = json.loads(response_body)
+    except json.JSONDecodeError as e:
+        logging.error(f"Failed to parse JSON response: {e}")
+        return False, f"Invalid JSON response: {response_body[:100]}"
+
+    if json_response.get("success", False):
+        return True, json_response.get("data", {})
+    return False, json_response.get("message", "Unknown error")
 
 
 class BWHTTPConnection(HTTPConnection):
@@ -29,14 +154,34 @@ class BWHTTPConnection(HTTPConnection):
 class BWCLIServer:
     """Interface to bw serve using Unix socket pair for fast API access"""
 
-    def __init__(self):
+    def __init__(self, env=None):
+        """Args: env - environment for the bw serve process (default:
+        os.environ). Sets BITWARDENCLI_APPDATA_DIR per vault.
+
+        """
+        self.env = env
         self.client_sock = None
         self.process = None
         self.session = None
+        self.restarts = 0
+        self.timeouts = 0
         self._initialized = False
+        # Session bw serve was started with, reused for restarts
+        self._serve_session = None
+        # Serializes requests on the socket and restarts
+        self._lock = RLock()
+        # Set while bw serve is running and accepting requests
+        self._ready = Event()
+        # Set by stop() to end the supervisor of the current process
+        self._stopping = Event()
+        self._started_at = 0.0
+        # Drained stdout/stderr of the current process
+        self._stdout = None
+        self._stderr = None
 
     def start(self, session=None):
-        """Start the bw serve process with socket communication
+        """Start the bw serve process with socket communication and a
+        supervisor thread that restarts it if it exits
 
         Args: session - session token (string or bytes) from CLI login/unlock
                        Required for bw serve to work
@@ -51,15 +196,31 @@ class BWCLIServer:
             )
             return False
 
+        with self._lock:
+            if not self._spawn(session):
+                return False
+            self._serve_session = session
+            self._stopping = Event()
+            self._ready.set()
+        Thread(
+            target=self._supervise,
+            args=(self._stopping,),
+            name="bw-serve-supervisor",
+            daemon=True,
+        ).start()
+        return True
+
+    def _spawn(self, session):
+        """Start a bw serve process and wait until it accepts requests
+
+        Args: session - session token (string or bytes)
+        Returns: True on success, False on error
+        """
         logging.debug(
             "BWCLIServer.start: Starting bw serve process with session"
         )
         try:
-            # Create socket pair for communication
-            self.client_sock, server_sock = socket.socketpair()
-            logging.debug(
-                f"BWCLIServer.start: Created socket pair, server_fd={server_sock.fileno()}"
-            )
+            server_sock, hostname = self._listen()
 
             # Convert session to string if needed
             session_str = (
@@ -76,15 +237,18 @@ class BWCLIServer:
                     "--session",
                     session_str,
                     "--hostname",
-                    f"fd+connected://{server_sock.fileno()}",
+                    hostname,
                 ],
                 pass_fds=(server_sock.fileno(),),
                 stdout=PIPE,
                 stderr=PIPE,
+                env=self.env,
             )
             logging.debug(
                 f"BWCLIServer.start: Started bw serve process with --session, pid={self.process.pid}"
             )
+            self._stdout = PipeLog(self.process.stdout, "stdout")
+            self._stderr = PipeLog(self.process.stderr, "stderr")
 
             # Close server socket in parent process
             server_sock.close()
@@ -107,16 +271,8 @@ class BWCLIServer:
                 # Check if process is still alive
                 if self.process.poll() is not None:
                     # Process died - capture stderr for debugging
-                    stderr_output = (
-                        self.process.stderr.read().decode("utf-8")
-                        if self.process.stderr
-                        else "No stderr"
-                    )
-                    stdout_output = (
-                        self.process.stdout.read().decode("utf-8")
-                        if self.process.stdout
-                        else "No stdout"
-                    )
+                    stderr_output = self._stderr.tail() or "No stderr"
+                    stdout_output = self._stdout.tail() or "No stdout"
                     logging.error("bw serve process died during initialization")
                     logging.error(f"bw serve stderr: {stderr_output}")
                     logging.error(f"bw serve stdout: {stdout_output}")
@@ -124,16 +280,14 @@ class BWCLIServer:
 
                 # Try a simple request to see if it's ready
                 try:
-                    conn = BWHTTPConnection(self.client_sock)
-                    conn.request("GET", "/status")
-                    response = conn.getresponse()
-                    response.read()  # Consume the response
+                    self._ping()
 
                     # If we got here without exception, it's ready
                     logging.debug(
                         f"BWCLIServer.start: bw serve ready after {wait_time}s"
                     )
                     self._initialized = True
+                    self._started_at = time.monotonic()
                     return True
                 except (
                     ConnectionResetError,
@@ -159,8 +313,110 @@ class BWCLIServer:
             logging.error(f"Failed to start bw serve: {e}")
             return False
 
-    def stop(self):
-        """Stop the bw serve process and clean up resources"""
+    def _listen(self):
+        """Create the socket bw serve accepts requests on
+
+        Returns: tuple (socket passed to bw serve, --hostname argument)
+        """
+        # Create socket pair for communication
+        self.client_sock, server_sock = socket.socketpair()
+        logging.debug(
+            f"BWCLIServer.start: Created socket pair, server_fd={server_sock.fileno()}"
+        )
+        return server_sock, f"fd+connected://{server_sock.fileno()}"
+
+    def _ping(self):
+        """Send a status request, raising ConnectionError if bw serve is not
+        accepting requests yet"""
+        self.client_sock.settimeout(bwcli.timeout("status"))
+        conn = BWHTTPConnection(self.client_sock)
+        conn.request("GET", "/status")
+        response = conn.getresponse()
+        response.read()  # Consume the response
+
+    def _supervise(self, stopping):
+        """Restart bw serve with the same session whenever it exits, with
+        backoff between failed attempts. Runs in a daemon thread until stop()
+        is called.
+
+        Args: stopping - Event set by stop()
+        """
+        attempt = 0
+        while not stopping.is_set():
+            process = self.process
+            if process is not None:
+                process.wait()
+            if stopping.is_set():
+                return
+            with self._lock:
+                if process is self.process and self._initialized:
+                    self._initialized = False
+                    self._ready.clear()
+                    stderr = self._stderr.tail() if self._stderr else ""
+                    logging.error(
+                        f"bw serve exited with code {process.returncode}, "
+                        f"restarting: {stderr}"
+                    )
+                    if time.monotonic() - self._started_at > RESTART_STABLE:
+                        attempt = 0
+            delay = RESTART_BACKOFF[min(attempt, len(RESTART_BACKOFF) - 1)]
+            if stopping.wait(delay):
+                return
+            with self._lock:
+                if stopping.is_set():
+                    return
+                self._close()
+                if self._spawn(self._serve_session):
+                    self.restarts += 1
+                    metrics.incr("serve restarts")
+                    self._ready.set()
+                    logging.info(f"bw serve restarted (pid={self.process.pid})")
+                else:
+                    self._close()
+                    attempt += 1
+                    logging.warning(
+                        f"bw serve restart failed, retrying in "
+                        f"{RESTART_BACKOFF[min(attempt, len(RESTART_BACKOFF) - 1)]}s"
+                    )
+
+    def diagnostics(self):
+        """Return the state of bw serve for troubleshooting
+
+        Returns: dict - {pid: int or None, running: bool, ready: bool,
+                 restarts: int, timeouts: int, stdout: PipeLog.stats(), stderr:
+                 PipeLog.stats(), stderr_tail: last stderr lines}
+        """
+        process = self.process
+        return {
+            "pid": process.pid if process else None,
+            "running": process is not None and process.poll() is None,
+            "ready": self._ready.is_set(),
+            "restarts": self.restarts,
+            "timeouts": self.timeouts,
+            "stdout": self._stdout.stats() if self._stdout else {},
+            "stderr": self._stderr.stats() if self._stderr else {},
+            "stderr_tail": (
+                self._stderr.tail(timeout=0) if self._stderr else ""
+            ),
+        }
+
+    def _crashed(self, process):
+        """Kill a bw serve process that stopped answering so the supervisor
+        restarts it
+
+        Args: process - the Popen object the failed request was sent to
+        """
+        with self._lock:
+            if process is not self.process or not self._ready.is_set():
+                return
+            self._ready.clear()
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def _close(self):
+        """Stop the bw serve process and close the socket"""
         if self.process:
             try:
                 self.process.terminate()
@@ -178,9 +434,16 @@ class BWCLIServer:
                 self.client_sock.close()
             except Exception:
                 pass
-
         self._initialized = False
+
+    def stop(self):
+        """Stop the bw serve process, its supervisor and clean up resources"""
+        self._stopping.set()
+        with self._lock:
+            self._ready.clear()
+            self._close()
         self.session = None
+        self._serve_session = None
 
     def __del__(self):
         """Cleanup when object is destroyed"""
@@ -682,73 +945,109 @@ class BWCLIServer:
 
         return data
 
-    def request(self, method: str, url: str, body=None, params=None):
+    def is_ready(self):
+        """True if bw serve is running and accepting requests, False while it
+        is stopped or being restarted (use the CLI instead)"""
+        return self._ready.is_set()
+
+    def request(
+        self, method: str, url: str, body=None, params=None, timeout=None
+    ):
         """Make HTTP request to bw serve API
 
+        If bw serve crashes, the request waits for the supervisor to restart
+        it. Idempotent requests (see IDEMPOTENT_METHODS and IDEMPOTENT_POSTS)
+        that were in flight during the crash are sent again once. A request
+        that times out is not sent again; bw serve is assumed to be hung and
+        is restarted.
+
         Args: method - HTTP method (GET, POST, PUT, DELETE)
               url - API endpoint URL
               body - Request body (dict)
               params - Query parameters (dict)
+              timeout - seconds (default: the [timeouts] budget for the
+                        endpoint, see OPERATIONS)
 
         Returns: tuple (success: bool, data: dict or error message)
         """
-        if not self._initialized:
+        if self._serve_session is None:
             logging.error(
                 "BWCLIServer not initialized, call start() with session first"
             )
             return False, "bw serve not initialized"
 
-        try:
-            conn = BWHTTPConnection(self.client_sock)
-            encoded_body = None
-            headers = {}
+        replay = method in IDEMPOTENT_METHODS or (
+            method == "POST" and url in IDEMPOTENT_POSTS
+        )
+        operation = next(
+            (op for prefix, op in OPERATIONS if url.startswith(prefix)),
+            "serve",
+        )
+        if timeout is None:
+            timeout = bwcli.timeout(operation)
+        for attempt in range(2):
+            if not self._ready.wait(RESTART_WAIT):
+                logging.error(f"bw serve unavailable for {method} {url}")
+                return False, "bw serve unavailable (restarting)"
+            process = self.process
+            try:
+                name = endpoint(url)
+                with trace.span(
+                    "serve", method=method, endpoint=name
+                ), metrics.timed(f"serve {method} {name}"):
+                    return self._send(method, url, body, params, timeout)
+            except TimeoutError:
+                err = BWTimeoutError(operation, timeout)
+                logging.error(f"{err}: {method} {url}")
+                self.timeouts += 1
+                metrics.incr("serve timeouts")
+                self._crashed(process)
+                return False, str(err)
+            except (OSError, HTTPException) as e:
+                logging.error(f"Connection to bw serve lost: {e!r}")
+                error = (False, f"Connection reset: {e}")
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error(f"Request failed: {e}")
+                return False, f"Request failed: {e}"
+            self._crashed(process)
+            if not replay or attempt:
+                return error
+            logging.info(f"Replaying {method} {url} after bw serve restart")
+        return error
+
+    def _send(self, method, url, body=None, params=None, timeout=None):
+        """Send one request over the socket
+
+        Returns: tuple (success: bool, data: dict or error message)
+        Raises: TimeoutError after timeout seconds, OSError or HTTPException
+                if the connection to bw serve failed
+        """
+        encoded_body = None
+        headers = {}
 
-            if body:
-                encoded_body = json.dumps(body).encode("utf-8")
-                headers["Content-Type"] = "application/json"
-                headers["Content-Length"] = str(len(encoded_body))
+        if body:
+            encoded_body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+            headers["Content-Length"] = str(len(encoded_body))
 
-            # Add any query parameters (session is handled via BW_SESSION env var)
-            if params:
-                url = f"{url}?{urlencode(params)}"
+        # Add any query parameters (session is handled via BW_SESSION env var)
+        if params:
+            url = f"{url}?{urlencode(params)}"
 
-            # Debug logging
-            logging.debug(f"BW Serve Request: {method} {url}")
+        # Debug logging
+        logging.debug(f"BW Serve Request: {method} {url}")
 
+        # One request at a time on the shared socket
+        with self._lock:
+            self.client_sock.settimeout(timeout)
+            conn = BWHTTPConnection(self.client_sock)
             conn.request(method, url, encoded_body, headers)
-
             response = conn.getresponse()
             response_body = response.read().decode("utf-8")
 
-            # Debug logging
-            logging.debug(f"Response status: {response.status}")
-            logging.debug(
-                f"Response body (first 200 chars): {response_body[:200]}"
-            )
-
-            if not response_body:
-                return False, "Empty response from server"
-
-            try:
-                json_response = json.loads(response_body)
-            except json.JSONDecodeError as e:
-                logging.error(f"Failed to parse JSON response: {e}")
-                return False, f"Invalid JSON response: {response_body[:100]}"
-
-            success = json_response.get("success", False)
-
-            if success:
-                return True, json_response.get("data", {})
-            else:
-                error_msg = json_response.get("message", "Unknown error")
-                return False, error_msg
-
-        except ConnectionResetError as e:
-            logging.error(f"Connection reset: {e}")
-            return False, f"Connection reset: {e}"
-        except Exception as e:
-            logging.error(f"Request failed: {e}")
-            return False, f"Request failed: {e}"
+        # Debug logging
+        logging.debug(f"Response status: {response.status}")
+        return parse_response(response_body)
 
 
 # vim: set et ts=4 sw=4 :
@@ -0,0 +1,338 @@
+"""
+Asyncio client for the `bw serve` REST API with a connection pool, so several
+requests (e.g. a background sync, a prefetch and an interactive edit) can be
+in flight at once.
+
+BWServePool is a drop-in, synchronous replacement for BWCLIServer: bw serve
+listens on a Unix socket (`--hostname fd+listening://<fd>`) and each request
+runs on a private event loop thread using one of the pooled connections.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from os import unlink
+from os.path import exists, join
+import shutil
+import socket
+from tempfile import mkdtemp
+from threading import Thread
+from urllib.parse import urlencode
+
+from bwm.bwcli import Item
+from bwm.bwserve import BWCLIServer, parse_response
+
+# Default number of connections to bw serve
+POOL_SIZE = 4
+# Default seconds before a request is cancelled (BWServePool passes the
+# [timeouts] budget of each request)
+REQUEST_TIMEOUT = 30
+
+
+class AsyncBWClient:
+    """HTTP/1.1 client for bw serve over a pool of Unix socket connections
+
+    Every request has a timeout and can be cancelled. A connection that was
+    in use by a timed out, cancelled or failed request is closed rather than
+    returned to the pool, as its state is unknown.
+
+    """
+
+    def __init__(self, path, size=POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        """Create a client. Connections are opened as needed.
+
+        Args: path - Unix socket path bw serve listens on
+              size - maximum number of connections
+              timeout - default seconds before a request is cancelled
+
+        """
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._slots = None
+
+    async def request(self, method, url, body=None, params=None, timeout=None):
+        """Send a request to bw serve
+
+        Args: method - HTTP method (GET, POST, PUT, DELETE)
+              url - API endpoint URL
+              body - Request body (dict or list)
+              params - Query parameters (dict)
+              timeout - seconds (default: self.timeout)
+
+        Returns: tuple (success: bool, data: dict or error message)
+        Raises: OSError if bw serve can't be reached, asyncio.TimeoutError,
+                asyncio.CancelledError
+
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        async with self._slots:
+            for reused in (bool(self._idle), False):
+                conn = (
+                    self._idle.pop()
+                    if reused
+                    else await asyncio.open_unix_connection(self.path)
+                )
+                try:
+                    keep, response = await asyncio.wait_for(
+                        self._exchange(conn, method, url, data),
+                        timeout or self.timeout,
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    conn[1].close()
+                    if not reused:
+                        raise ConnectionResetError(
+                            f"bw serve closed the connection: {method} {url}"
+                        ) from None
+                    # Idle connection closed by bw serve; use a new one
+                    continue
+                except BaseException:
+                    conn[1].close()
+                    raise
+                if keep:
+                    self._idle.append(conn)
+                else:
+                    conn[1].close()
+                return parse_response(response)
+        return False, "Request failed"
+
+    @staticmethod
+    async def _exchange(conn, method, url, data):
+        """Write one request and read its response
+
+        Returns: tuple (keep_alive: bool, response body: string)
+        """
+        reader, writer = conn
+        head = [
+            f"{method} {url} HTTP/1.1",
+            "Host: bwserver",
+            f"Content-Length: {len(data)}",
+        ]
+        if data:
+            head.append("Content-Type: application/json")
+        writer.write("\r\n".join(head).encode("ascii") + b"\r\n\r\n" + data)
+        await writer.drain()
+        status = await reader.readline()
+        if not status:
+            raise ConnectionResetError("Empty response from bw serve")
+        logging.debug(f"bw serve async: {method} {url} {status.strip()!r}")
+        headers = {}
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip().lower()
+        keep = headers.get("connection") != "close"
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding") == "chunked":
+            chunks = []
+            while size := int((await reader.readline()).split(b";")[0], 16):
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            await reader.readline()
+            body = b"".join(chunks)
+        else:
+            body = await reader.read()
+            keep = False
+        return keep, body.decode("utf-8")
+
+    def close(self):
+        """Close the idle connections (call from the event loop thread)"""
+        while self._idle:
+            self._idle.pop()[1].close()
+
+    async def status(self):
+        """GET /status"""
+        return await self.request("GET", "/status")
+
+    async def list(self, obj, params=None):
+        """List objects (items, folders, collections, org-collections,
+        organizations)"""
+        return await self.request("GET", f"/list/object/{obj}", params=params)
+
+    async def get(self, obj, obj_id, params=None):
+        """Get a single object"""
+        return await self.request(
+            "GET", f"/object/{obj}/{obj_id}", params=params
+        )
+
+    async def create(self, obj, body, params=None):
+        """Create an object"""
+        return await self.request("POST", f"/object/{obj}", body, params)
+
+    async def edit(self, obj, obj_id, body, params=None):
+        """Replace an object"""
+        return await self.request(
+            "PUT", f"/object/{obj}/{obj_id}", body, params
+        )
+
+    async def delete(self, obj, obj_id, params=None):
+        """Delete an object"""
+        return await self.request(
+            "DELETE", f"/object/{obj}/{obj_id}", params=params
+        )
+
+    async def move(self, item_id, org_id, collection_ids):
+        """Move an item to an organization"""
+        return await self.request(
+            "POST", f"/move/{item_id}/{org_id}", collection_ids
+        )
+
+    async def sync(self):
+        """Sync with the server"""
+        return await self.request("POST", "/sync")
+
+    async def unlock(self, password):
+        """Unlock the vault"""
+        return await self.request("POST", "/unlock", {"password": password})
+
+    async def lock(self):
+        """Lock the vault"""
+        return await self.request("POST", "/lock")
+
+
+class BWServePool(BWCLIServer):
+    """BWCLIServer using a pool of connections so requests from several
+    threads run concurrently instead of one at a time.
+
+    Process supervision, restarts and all of the BWCLIServer methods are
+    inherited; only the transport is replaced.
+
+    """
+
+    def __init__(self, env=None, size=POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        """Start the event loop thread. bw serve is started by start().
+
+        Args: env - environment for the bw serve process
+              size - number of connections to bw serve
+              timeout - seconds before a request is cancelled
+
+        """
+        self.size = size
+        self.timeout = timeout
+        self.client = None
+        self._sockdir = None
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = Thread(
+            target=self._loop.run_forever, name="bw-serve-loop", daemon=True
+        )
+        self._loop_thread.start()
+        super().__init__(env=env)
+
+    def _listen(self):
+        """Listen on a Unix socket in a private directory
+
+        Returns: tuple (socket passed to bw serve, --hostname argument)
+        """
+        if self._sockdir is None:
+            self._sockdir = mkdtemp(prefix="bwm-")
+        path = join(self._sockdir, "serve.sock")
+        if exists(path):
+            # Left over from a crashed bw serve
+            unlink(path)
+        server_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server_sock.bind(path)
+        server_sock.listen(self.size)
+        self.client = AsyncBWClient(path, self.size, self.timeout)
+        return server_sock, f"fd+listening://{server_sock.fileno()}"
+
+    def _ping(self):
+        """Send a status request, raising ConnectionError if bw serve is not
+        accepting requests yet"""
+        self.submit("GET", "/status").result()
+
+    def submit(self, method, url, body=None, params=None, timeout=None):
+        """Start a request without waiting for it
+
+        Args: see AsyncBWClient.request
+        Returns: concurrent.futures.Future of (success, data). Cancelling it
+                 cancels the request.
+
+        """
+        return asyncio.run_coroutine_threadsafe(
+            self.client.request(method, url, body, params, timeout),
+            self._loop,
+        )
+
+    def _send(self, method, url, body=None, params=None, timeout=None):
+        """Send one request using the connection pool
+
+        Returns: tuple (success: bool, data: dict or error message)
+        Raises: TimeoutError after timeout seconds, OSError if the connection
+                to bw serve failed
+        """
+        logging.debug(f"BW Serve Request: {method} {url}")
+        try:
+            return self.submit(method, url, body, params, timeout).result()
+        except asyncio.TimeoutError:
+            # Not a TimeoutError subclass before Python 3.11
+            raise TimeoutError(f"{method} {url}") from None
+        except asyncio.CancelledError:
+            return False, "Request cancelled"
+
+    def get_entries(self, org_name=""):
+        """Get all entries, folders, collections and orgs from vault, with the
+        four lists requested concurrently
+
+        Args: org_name - name of organization (currently unused)
+        Returns: items (list of Items), folders, collections, orgs
+                 or (False, False, False, False) on error
+        """
+        with ThreadPoolExecutor(max_workers=3) as pool:
+            folders = pool.submit(self.get_folders)
+            collections = pool.submit(self.get_collections, org_name)
+            orgs = pool.submit(self.get_orgs)
+            successful, data = self.request("GET", "/list/object/items")
+            folders, collections, orgs = (
+                folders.result(),
+                collections.result(),
+                orgs.result(),
+            )
+        if not successful:
+            error_msg = data if isinstance(data, str) else "Failed to get items"
+            logging.error(f"Get entries error: {error_msg}")
+            return False, False, False, False
+        if folders is False or collections is False or orgs is False:
+            return False, False, False, False
+        items = [Item(i) for i in data["data"]] if "data" in data else []
+        return items, folders, collections, orgs
+
+    def _close(self):
+        """Stop the bw serve process and close the pooled connections"""
+        super()._close()
+        if self.client is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self.client.close)
+
+    @staticmethod
+    async def _cancel_tasks():
+        """Cancel the requests still running on the event loop"""
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stop(self):
+        """Stop bw serve, the event loop and remove the socket"""
+        super().stop()
+        if not self._loop.is_closed():
+            try:
+                asyncio.run_coroutine_threadsafe(
+                    self._cancel_tasks(), self._loop
+                ).result(timeout=5)
+            except Exception:  # pylint: disable=broad-except
+                pass
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join(timeout=5)
+            if not self._loop.is_running():
+                self._loop.close()
+        if self._sockdir is not None:
+            shutil.rmtree(self._sockdir, ignore_errors=True)
+            self._sockdir = None
+
+
+# vim: set et ts=4 sw=4 :
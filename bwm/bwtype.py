@@ -9,9 +9,18 @@ from threading import Timer
 
 from bwm.menu import dmenu_err
 from bwm.totp import gen_otp
+from bwm.trace import traced
+from bwm import metrics
 import bwm
 
 
+def type_error(msg):
+    """Show an error that stopped typing, counted for bwm --stats. Use
+    dmenu_err for notices about entries that aren't typed by design."""
+    metrics.incr("type errors")
+    dmenu_err(msg)
+
+
 def autotype_seq(entry):
     """Return value for autotype sequence
 
@@ -76,7 +85,7 @@ def tokenize_autotype(autotype):
 
         closing_idx = autotype.find("}")
         if closing_idx == -1:
-            dmenu_err(
+            type_error(
                 "Unable to find matching right brace (}) while"
                 + f"tokenizing auto-type string: {autotype}\n"
             )
@@ -123,7 +132,7 @@ PLACEHOLDER_AUTOTYPE_TOKENS = {
     "{PASSWORD}": lambda e: e["login"]["password"],
     "{NOTES}": lambda e: e["notes"],
     "{CARDNUM}": lambda e: e["card"]["number"],
-    "{TOTP}": lambda e: gen_otp(e["login"]["totp"]),
+    "{TOTP}": lambda e: gen_otp(e["login"]["totp"], e.get("id")),
 }
 
 STRING_AUTOTYPE_TOKENS = {
@@ -169,7 +178,7 @@ def type_entry_pynput(entry, tokens):  # pylint: disable=too-many-branches
                     try:
                         kbd.type(to_type)
                     except kbd.InvalidCharacterException:
-                        dmenu_err(
+                        type_error(
                             "Unable to type string...bad character.\n"
                             "Try setting `type_library = xdotool` in config.ini"
                         )
@@ -179,7 +188,7 @@ def type_entry_pynput(entry, tokens):  # pylint: disable=too-many-branches
                 try:
                     kbd.type(to_type)
                 except kbd.InvalidCharacterException:
-                    dmenu_err(
+                    type_error(
                         "Unable to type string...bad character.\n"
                         "Try setting `type_library = xdotool` in config.ini"
                     )
@@ -193,13 +202,13 @@ def type_entry_pynput(entry, tokens):  # pylint: disable=too-many-branches
                     kbd.tap(to_tap)
                     enter_idx = False
             else:
-                dmenu_err(f"Unsupported auto-type token (pynput): {token}")
+                type_error(f"Unsupported auto-type token (pynput): {token}")
                 return
         else:
             try:
                 kbd.type(token)
             except kbd.InvalidCharacterException:
-                dmenu_err(
+                type_error(
                     "Unable to type string...bad character.\n"
                     "Try setting `type_library = xdotool` in config.ini"
                 )
@@ -233,7 +242,7 @@ def type_entry_xdotool(entry, tokens):
                     call(cmd)
                     enter_idx = False
             else:
-                dmenu_err(f"Unsupported auto-type token (xdotool): {token}")
+                type_error(f"Unsupported auto-type token (xdotool): {token}")
                 return
         else:
             call(["xdotool", "type", token])
@@ -259,7 +268,7 @@ def type_entry_ydotool(entry, tokens):
                 cmd = ["ydotool"] + AUTOTYPE_TOKENS[token]
                 call(cmd)
             else:
-                dmenu_err(f"Unsupported auto-type token (ydotool): {token}")
+                type_error(f"Unsupported auto-type token (ydotool): {token}")
                 return
         else:
             call(["ydotool", "type", "-e", "0", token])
@@ -285,12 +294,14 @@ def type_entry_wtype(entry, tokens):
                 cmd = ["wtype", "-k", AUTOTYPE_TOKENS[token]]
                 call(cmd)
             else:
-                dmenu_err(f"Unsupported auto-type token (wtype): {token}")
+                type_error(f"Unsupported auto-type token (wtype): {token}")
                 return
         else:
             call(["wtype", "--", token])
 
 
+@traced("type")
+@metrics.timed("type")
 def type_entry(entry, atype=""):
     """Pick which library to use to type strings
 
@@ -341,6 +352,8 @@ def type_entry(entry, atype=""):
         type_entry_pynput(entry, tokens)
 
 
+@traced("type")
+@metrics.timed("type")
 def type_text(data):
     """Type the given text data"""
     if bwm.CLIPBOARD is True:
@@ -364,7 +377,7 @@ def type_text(data):
         try:
             kbd.type(data)
         except kbd.InvalidCharacterException:
-            dmenu_err(
+            type_error(
                 "Unable to type string...bad character.\n"
                 "Try setting `type_library = xdotool` in config.ini"
             )
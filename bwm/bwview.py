@@ -1,12 +1,20 @@
 """Bitwarden-menu view functions"""
 
+from itertools import chain
 from os.path import join
+import re
+from subprocess import TimeoutExpired
+import time
 import webbrowser
 
-from bwm.menu import dmenu_select
-from bwm.totp import gen_otp
+from bwm.menu import dmenu_err, dmenu_select, dmenu_stream
+from bwm.totp import gen_otp, gen_otps
+from bwm import trace
 import bwm
 
+# Entries formatted per chunk when streaming the main menu
+STREAM_CHUNK = 1000
+
 
 def obj_name(obj, oid):
     """Return name of folder/collection object based on id
@@ -21,13 +29,15 @@ def obj_name(obj, oid):
     return path
 
 
-def view_all_entries(options, vault_entries, folders):
-    """Generate numbered list of all vault entries and open with dmenu.
+def entry_rows(numbered_entries, folders, num_align):
+    """Format numbered vault entries as launcher rows
 
-    Returns: dmenu selection
+    Args: numbered_entries - iterable of (number, entry)
+          folders - dict of folder dicts
+          num_align - width of the entry number column
+    Returns: list of strings
 
     """
-    num_align = len(str(len(vault_entries)))
     # Login: Num(l) - Folder/name - username - url
     bw_login_pattern = str("{:>{na}}(l) - {} - {} - {}")
     # Secure Note: Num(n) - Folder/name
@@ -38,7 +48,7 @@ def view_all_entries(options, vault_entries, folders):
     bw_ident_pattern = str("{:>{na}}(i) - {} - {}, {} - {} - {}")
     # Have to number each entry to capture duplicates correctly
     ven = []
-    for j, i in enumerate(vault_entries):
+    for j, i in numbered_entries:
         if i["type"] == 1:
             ven.append(
                 bw_login_pattern.format(
@@ -80,17 +90,244 @@ def view_all_entries(options, vault_entries, folders):
                     na=num_align,
                 )
             )
-    vault_entries_s = str("\n").join(ven)
-    if options:
-        options_s = "\n".join(options) + "\n"
-        entries_s = options_s + vault_entries_s
-    else:
-        entries_s = vault_entries_s
+    return ven
+
+
+def encode_rows(vault_entries, folders):
+    """Format numbered vault entries as launcher input
+
+    Args: vault_entries - list of entries
+          folders - dict of folder dicts
+    Returns: bytes (bwm.ENC encoded, newline separated rows)
+
+    """
+    num_align = len(str(len(vault_entries)))
+    rows = entry_rows(enumerate(vault_entries), folders, num_align)
+    return "\n".join(rows).encode(bwm.ENC)
+
+
+def _segments(rows, skip, count):
+    """Return buffers of encoded rows leaving out the rows at some positions
+
+    Args: rows - bytes (newline separated rows, see encode_rows)
+          skip - sorted list of row positions to leave out
+          count - number of entries the rows were formatted from
+    Returns: list of memoryviews (slices of rows) and bytes, each row newline
+             terminated. None if some entries have no row (unknown type).
+
+    """
+    if not rows:
+        return None if count else []
+    if rows.count(b"\n") + 1 != count:
+        return None
+    view = memoryview(rows)
+    starts = [0]
+    if skip:
+        starts += [i.end() for i in re.finditer(b"\n", rows)]
+    buffers = []
+    prev = 0
+    for num in skip:
+        if num > prev:
+            buffers.append(view[starts[prev] : starts[num]])
+        prev = num + 1
+    if prev < count:
+        buffers += [view[starts[prev] :], b"\n"]
+    return buffers
+
+
+def stream_rows(vault_entries, folders, first=(), rows=None, parts=None):
+    """Generate the encoded rows of all vault entries chunk by chunk, those
+    at the positions in first (e.g. the most used entries) first. Rows are
+    numbered as by encode_rows.
+
+    Only the first rows are formatted before the first chunk is written. The
+    others are sliced from rows without copying or, if rows is None,
+    formatted STREAM_CHUNK entries at a time.
+
+    Args: vault_entries - list of entries
+          folders - dict of folder dicts
+          first - list of positions in vault_entries
+          rows - vault_entries already formatted by encode_rows, or None
+          parts - list. If given (and rows is None), the encoded rows of all
+                  entries are appended to it so b"\n".join(parts) equals
+                  encode_rows() once all chunks are generated.
+    Returns: generator of lists of bytes-like buffers
+
+    """
+    count = len(vault_entries)
+    num_align = len(str(count))
+    first = list(dict.fromkeys(i for i in first if 0 <= i < count))
+    if first:
+        head = entry_rows(
+            ((i, vault_entries[i]) for i in first), folders, num_align
+        )
+        yield [("\n".join(head) + "\n").encode(bwm.ENC)]
+    skip = sorted(first)
+    if rows is not None:
+        buffers = _segments(rows, skip, count)
+        if buffers is not None:
+            yield buffers
+            return
+        parts = None
+    for start in range(0, count, STREAM_CHUNK):
+        end = min(start + STREAM_CHUNK, count)
+        batch = "\n".join(
+            entry_rows(
+                ((j, vault_entries[j]) for j in range(start, end)),
+                folders,
+                num_align,
+            )
+        ).encode(bwm.ENC)
+        if parts is not None and batch:
+            parts.append(batch)
+        local = [j - start for j in skip if start <= j < end]
+        buffers = _segments(batch, local, end - start)
+        if buffers is None:
+            # Entries of unknown types have no row, so format those kept
+            kept = entry_rows(
+                (
+                    (j, vault_entries[j])
+                    for j in range(start, end)
+                    if j - start not in local
+                ),
+                folders,
+                num_align,
+            )
+            buffers = [("\n".join(kept) + "\n").encode(bwm.ENC)] if kept else []
+        yield buffers
+
+
+def view_all_entries(options, vault_entries, folders, rows=None):
+    """Generate numbered list of all vault entries and open with dmenu.
+
+    The options and the rows are written to the launcher as separate chunks,
+    so cached rows aren't copied.
+
+    Args: options - list of menu options
+          vault_entries - list of entries
+          folders - dict of folder dicts
+          rows - vault_entries already formatted by encode_rows (e.g. cached
+                 by the caller), or a generator of lists of buffers from
+                 stream_rows to stream them. Formatted here if None.
+    Returns: dmenu selection
+
+    """
+    with trace.span("render", rows=len(vault_entries)):
+        if rows is None:
+            rows = encode_rows(vault_entries, folders)
+        opts = ("\n".join(options) + "\n").encode(bwm.ENC) if options else b""
+        if isinstance(rows, (bytes, bytearray, memoryview)):
+            chunks = [opts, rows]
+        else:
+            # Written as each list of buffers is generated
+            chunks = chain(([opts],), rows)
     return dmenu_select(
-        min(bwm.MAX_LEN, len(options) + len(vault_entries)), inp=entries_s
+        min(bwm.MAX_LEN, len(options) + len(vault_entries)), inp=chunks
     )
 
 
+def view_folder(node, entries, folders, subfolders=None):
+    """Show one level of the folder tree: the parent folder, the subfolders
+    with their entry counts and the entries in the folder itself.
+
+    Only the rows of this level are formatted and sent to the launcher.
+
+    Args: node - foldertree.Node
+          entries - list of entries in the folder (FolderTree.entries)
+          folders - dict of folder dicts
+          subfolders - list of (Node, entry count) to list. All subfolders
+                       of node with their counts if None.
+    Returns: Node (parent or subfolder), entry or None
+
+    """
+    if subfolders is None:
+        subfolders = [(i, i.count) for i in node.subfolders()]
+    nodes = {f"{i.name}/ ({count})": i for i, count in subfolders}
+    if node.parent is not None:
+        nodes = {"../": node.parent, **nodes}
+    rows = entry_rows(enumerate(entries), folders, len(str(len(entries))))
+    sel = dmenu_select(
+        min(bwm.MAX_LEN, len(nodes) + len(rows)),
+        node.path or "Folders",
+        inp="\n".join(chain(nodes, rows)),
+    )
+    if sel in nodes:
+        return nodes[sel]
+    try:
+        return entries[int(sel.split("(", 1)[0])]
+    except (AttributeError, ValueError, IndexError):
+        return None
+
+
+def view_merged_entries(options, listings, num_lines):
+    """Show the main menu with entries from several vaults.
+
+    Each listing is the already formatted (and vault tagged) rows of one vault.
+    Listings are sent to the launcher as they become available, so rows of a
+    vault that is still loading are added once it has loaded.
+
+    Args: options - list of menu options
+          listings - iterable of strings (newline separated rows)
+          num_lines - number of lines to display
+    Returns: dmenu selection
+
+    """
+
+    def chunks():
+        if options:
+            yield "\n".join(options)
+        for listing in listings:
+            if listing:
+                yield listing
+
+    return dmenu_stream(min(bwm.MAX_LEN, num_lines), inp=chunks())
+
+
+def view_totp_codes(vault_entries, folders):
+    """Show the current TOTP code for every login entry that has one.
+
+    All codes are generated in one pass. The launcher is closed and reopened
+    with fresh codes when the earliest code expires.
+
+    Returns: current code of the selected entry or ""
+
+    """
+    otp_entries = [
+        (j, i)
+        for j, i in enumerate(vault_entries)
+        if (i.get("login") or {}).get("totp")
+    ]
+    if not otp_entries:
+        dmenu_err("No entries with TOTP found")
+        return ""
+    num_align = len(str(len(vault_entries)))
+    while True:
+        codes = gen_otps((i for _, i in otp_entries), time.time())
+        ven = [
+            f"{j:>{num_align}} - "
+            f"{join(obj_name(folders, i['folderId']), i['name'])} - "
+            f"{codes[i['id']][0]} ({codes[i['id']][1]}s)"
+            for j, i in otp_entries
+            if i["id"] in codes
+        ]
+        try:
+            sel = dmenu_select(
+                min(bwm.MAX_LEN, len(ven)),
+                "TOTP",
+                inp="\n".join(ven),
+                timeout=min(i[1] for i in codes.values()) if codes else None,
+            )
+        except TimeoutExpired:
+            continue
+        break
+    try:
+        entry = vault_entries[int(sel.split(" - ", 1)[0])]
+    except (AttributeError, ValueError, IndexError):
+        return ""
+    # Regenerate in case the code rolled over while the menu was open
+    return gen_otp(entry["login"]["totp"], entry.get("id"))
+
+
 def view_entry(entry, folders):
     """Show an entry (login, card, identity or secure note)"""
     entry_types = {1: view_login, 2: view_note, 3: view_card, 4: view_ident}
@@ -135,7 +372,7 @@ def view_login(entry, folders):
     elif sel == "Password: **********":
         sel = entry["login"]["password"]
     elif sel == "TOTP: ******":
-        sel = gen_otp(entry["login"]["totp"])
+        sel = gen_otp(entry["login"]["totp"], entry.get("id"))
     elif sel.startswith("URL"):
         if sel != "URL: None":
             webbrowser.open(sel.split(": ", 1)[-1])
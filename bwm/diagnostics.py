@@ -0,0 +1,187 @@
+"""Memory use of the daemon and copies of secrets it holds, shown by
+'bwm --diagnostics'
+
+With [diagnostics] tracemalloc = True (or PYTHONTRACEMALLOC set) the daemon
+traces its allocations from startup and the report groups the memory still
+allocated by the bwm module that allocated it: JSON parsed in bwcli counts as
+bwcli, rows formatted in bwview as bwview. Tracing slows the daemon and uses
+extra memory, so it is off by default.
+
+Secrets are counted, never reported. For each kind (passwords, TOTP keys,
+card numbers...) the report has the number of distinct secrets in the loaded
+vaults, the number of separate string objects holding one and the number of
+large strings or bytes (bw output, rendered menus) containing one.
+
+"""
+
+from collections import Counter
+import gc
+from os.path import basename, dirname
+import re
+import resource
+import tracemalloc
+
+import bwm
+from bwm import metrics
+
+TRACEMALLOC = bwm.CONF.getboolean("diagnostics", "tracemalloc", fallback=False)
+# Frames kept per allocation to find the bwm module that made it
+FRAMES = 25
+# Strings and bytes at least this long are searched for secrets
+BLOB_SIZE = 1024
+
+PACKAGE_DIR = dirname(__file__)
+JSON_STRING = re.compile(r'"((?:[^"\\\n]|\\.)*)"')
+JSON_BYTES = re.compile(rb'"((?:[^"\\\n]|\\.)*)"')
+
+
+def start():
+    """Start tracing allocations if enabled in config.ini"""
+    if TRACEMALLOC and not tracemalloc.is_tracing():
+        tracemalloc.start(FRAMES)
+
+
+def subsystem(traceback):
+    """Return the bwm module that made an allocation
+
+    Args: traceback - tracemalloc.Traceback
+    Returns: module name ('bwcli', 'bwview'...) or 'other'
+
+    """
+    # Frames are ordered from the oldest call to the most recent
+    for frame in reversed(traceback):
+        if dirname(frame.filename) == PACKAGE_DIR:
+            return basename(frame.filename).removesuffix(".py")
+    return "other"
+
+
+def memory():
+    """Return the traced memory still allocated by each bwm module
+
+    Returns: dict, None if allocations aren't traced
+
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    )
+    sizes = Counter()
+    blocks = Counter()
+    for stat in snapshot.statistics("traceback"):
+        name = subsystem(stat.traceback)
+        sizes[name] += stat.size
+        blocks[name] += stat.count
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "subsystems": {
+            name: {"bytes": size, "blocks": blocks[name]}
+            for name, size in sizes.most_common()
+        },
+    }
+
+
+def entry_secrets(entry):
+    """Yield (kind, value) of each secret of an entry
+
+    Args: entry - Item
+    Returns: generator of (string, string)
+
+    """
+    login = entry.get("login") or {}
+    yield "passwords", login.get("password")
+    yield "totp keys", login.get("totp")
+    for old in entry.get("passwordHistory") or []:
+        yield "passwords", old.get("password")
+    card = entry.get("card") or {}
+    yield "card numbers", card.get("number")
+    yield "card codes", card.get("code")
+    identity = entry.get("identity") or {}
+    for key in ("ssn", "passportNumber", "licenseNumber"):
+        yield "identity numbers", identity.get(key)
+    for field in entry.get("fields") or []:
+        if field.get("type") == 1:
+            yield "hidden fields", field.get("value")
+
+
+def _blob_secrets(blob, secrets):
+    """Return True if a JSON string or a line of blob is a secret
+
+    Args: blob - str, bytes or bytearray
+          secrets - dict {secret: kind}
+    Returns: bool
+
+    """
+    if isinstance(blob, str):
+        found = JSON_STRING.findall(blob)
+        lines = blob.splitlines()
+    else:
+        found = [i.decode("utf-8", "replace") for i in JSON_BYTES.findall(blob)]
+        lines = blob.decode("utf-8", "replace").splitlines()
+    return any(i in secrets for i in found) or any(i in secrets for i in lines)
+
+
+def secret_copies(vaults):
+    """Count the objects in memory holding secrets of the loaded vaults
+
+    Args: vaults - list of Vault objects
+    Returns: dict {kind: {secrets: int, copies: int}, 'blobs': int,
+             'blob_bytes': int}. 'copies' are separate string objects equal
+             to a secret. 'blobs' are strings or bytes of at least BLOB_SIZE
+             with a secret as a JSON string or a line. Objects are found
+             through the containers tracked by the garbage collector, so
+             strings only held in local variables of running functions are
+             missed.
+
+    """
+    secrets = {}
+    for vault in vaults:
+        for entry in vault.entries or []:
+            for kind, value in entry_secrets(entry):
+                if value:
+                    secrets[value] = kind
+    copies = Counter()
+    blobs = blob_bytes = 0
+    seen = set()
+    gc.collect()
+    for obj in gc.get_objects():
+        for ref in gc.get_referents(obj):
+            if not isinstance(ref, (str, bytes, bytearray)) or id(ref) in seen:
+                continue
+            if isinstance(ref, str) and ref in secrets:
+                seen.add(id(ref))
+                copies[secrets[ref]] += 1
+            elif len(ref) >= BLOB_SIZE:
+                seen.add(id(ref))
+                if _blob_secrets(ref, secrets):
+                    blobs += 1
+                    blob_bytes += len(ref)
+    res = {
+        kind: {"secrets": count, "copies": copies[kind]}
+        for kind, count in sorted(Counter(secrets.values()).items())
+    }
+    res["blobs"] = blobs
+    res["blob_bytes"] = blob_bytes
+    return res
+
+
+def report(vaults=()):
+    """Return the diagnostics report
+
+    Args: vaults - list of Vault objects
+    Returns: dict (JSON serializable)
+
+    """
+    # Linux reports kilobytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {
+        "max_rss_bytes": max_rss,
+        "vaults": [metrics.vault_stats(i) for i in vaults],
+        "memory": memory(),
+        "secrets": secret_copies(vaults),
+    }
+
+
+# vim: set et ts=4 sw=4 :
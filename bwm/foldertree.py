@@ -0,0 +1,156 @@
+"""Tree of the vault folders for browsing the vault one folder at a time
+
+Bitwarden folders are nested by name: 'Work/Infra/DB' is the 'DB' subfolder
+of 'Work/Infra', which may or may not exist as a folder itself. The tree has
+a node for each path, with the number of entries in its subtree.
+
+Entries are kept by folder id, so the tree is updated incrementally as
+entries change (see VaultIndex) and only the folder structure is rebuilt,
+without going through the entries, when folders are added or renamed.
+
+"""
+
+
+class Node:
+    """A folder path in the tree
+
+    Attributes: name - last part of the path ('' for the root)
+                path - full path ('Work/Infra', '' for the root)
+                parent - Node or None for the root
+                children - dict {name: Node}
+                folders - ids of the folders with this path
+                count - number of entries in the folder and its subfolders
+
+    """
+
+    __slots__ = ("name", "path", "parent", "children", "folders", "count")
+
+    def __init__(self, name="", parent=None):
+        self.name = name
+        self.parent = parent
+        self.path = f"{parent.path}/{name}" if parent and parent.path else name
+        self.children = {}
+        self.folders = []
+        self.count = 0
+
+    def subfolders(self):
+        """Return the child nodes sorted by name"""
+        return sorted(self.children.values(), key=lambda i: i.name.casefold())
+
+    def walk(self):
+        """Generate the node and all nodes below it"""
+        yield self
+        for child in self.children.values():
+            yield from child.walk()
+
+
+class FolderTree:
+    """Entries grouped by folder and the tree of folder paths
+
+    Args: folders - folders dict, kept by reference so renamed folders are
+                    found without re-adding the entries
+
+    """
+
+    def __init__(self, folders=None):
+        self.folders = folders if folders is not None else {}
+        # {folder id: {entry id: entry}} and {entry id: folder id}
+        self._entries = {}
+        self._folder_of = {}
+        self._root = None
+        self._key = None
+        # {folder id: Node}
+        self._nodes = {}
+
+    def __len__(self):
+        return len(self._folder_of)
+
+    def _build(self):
+        """Build the nodes from the folder names and count their entries"""
+        self._root = Node()
+        self._nodes = {}
+        for fid, folder in self.folders.items():
+            if fid is None:
+                continue
+            node = self._root
+            for name in folder["name"].split("/"):
+                if name:
+                    node = node.children.setdefault(name, Node(name, node))
+            node.folders.append(fid)
+            self._nodes[fid] = node
+        self._root.folders.append(None)
+        for fid, entries in self._entries.items():
+            self._count(fid, len(entries))
+
+    def _count(self, fid, num):
+        """Add num to the counts of the folder of fid and its parents"""
+        node = self._nodes.get(fid, self._root)
+        while node is not None:
+            node.count += num
+            node = node.parent
+
+    def _current(self):
+        """Return True if the nodes match the folder names"""
+        key = tuple((k, v["name"]) for k, v in self.folders.items())
+        if key != self._key:
+            self._key = key
+            self._root = None
+        return self._root is not None
+
+    def add(self, entry):
+        """Add an entry (moving it if it is already in another folder)"""
+        if entry.get("id") is None:
+            return
+        self.remove(entry)
+        fid = entry.get("folderId")
+        self._entries.setdefault(fid, {})[entry["id"]] = entry
+        self._folder_of[entry["id"]] = fid
+        if self._root is not None:
+            self._count(fid, 1)
+
+    def remove(self, entry):
+        """Remove an entry from the folder it was added to"""
+        if entry.get("id") not in self._folder_of:
+            return
+        fid = self._folder_of.pop(entry["id"])
+        entries = self._entries[fid]
+        del entries[entry["id"]]
+        if not entries:
+            del self._entries[fid]
+        if self._root is not None:
+            self._count(fid, -1)
+
+    def rebuild(self, entries, folders):
+        """Add all entries from scratch
+
+        Args: entries - list of Items
+              folders - folders dict
+
+        """
+        self.folders = folders if folders is not None else {}
+        self._entries = {}
+        self._folder_of = {}
+        self._root = None
+        for entry in entries or []:
+            self.add(entry)
+
+    def root(self):
+        """Return the root node (entries without a folder)"""
+        if not self._current():
+            self._build()
+        return self._root
+
+    def entries(self, node):
+        """Return the entries directly in the folder(s) of a node
+
+        Entries of unknown folders are listed in the root.
+
+        """
+        if node is self._root:
+            fids = [i for i in self._entries if i not in self._nodes]
+        else:
+            fids = node.folders
+        return [j for i in fids for j in self._entries.get(i, {}).values()]
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,102 @@
+"""Frecency (frequency and recency) of typed entries
+
+Used to list the most used entries first when the main menu is streamed to
+the launcher ([dmenu] stream = True). The times entries are typed are saved
+per vault in DATA_HOME as entry ids and timestamps, never names or secrets.
+
+"""
+
+from hashlib import sha1
+import json
+import logging
+import os
+from os.path import join
+import time
+
+import bwm
+
+DAY = 86400
+# Weight of a visit by its age in days (older visits weigh OLD_WEIGHT), as
+# in the Firefox address bar
+WEIGHTS = ((4, 100), (14, 70), (31, 50), (90, 30))
+OLD_WEIGHT = 10
+# Visits kept per entry and entries kept per vault
+MAX_VISITS = 10
+MAX_ENTRIES = 1000
+
+
+def weight(age):
+    """Return the weight of a visit
+
+    Args: age - seconds since the visit
+    Returns: int
+
+    """
+    for days, value in WEIGHTS:
+        if age < days * DAY:
+            return value
+    return OLD_WEIGHT
+
+
+class Frecency:
+    """Visits of the entries of one vault, loaded from DATA_HOME on first use
+
+    Args: url - vault URL
+          email - login email
+
+    """
+
+    def __init__(self, url, email):
+        key = f"{url}\0{email}"
+        self.path = join(
+            bwm.DATA_HOME,
+            f"frecency-{sha1(key.encode()).hexdigest()[:16]}.json",
+        )
+        self._visits = None
+
+    @property
+    def visits(self):
+        """Dict {entry id: list of visit timestamps}"""
+        if self._visits is None:
+            try:
+                with open(self.path, encoding=bwm.ENC) as fin:
+                    self._visits = dict(json.load(fin))
+            except (OSError, ValueError, TypeError):
+                self._visits = {}
+        return self._visits
+
+    def score(self, entry_id, now=None):
+        """Return the frecency of an entry (0 if it was never typed)"""
+        now = time.time() if now is None else now
+        return sum(weight(now - i) for i in self.visits.get(entry_id, ()))
+
+    def top(self, num, now=None):
+        """Return the ids of the num entries with the highest frecency"""
+        now = time.time() if now is None else now
+        scores = {i: self.score(i, now) for i in self.visits}
+        return sorted(scores, key=scores.get, reverse=True)[:num]
+
+    def visit(self, entry_id, now=None):
+        """Record that an entry was typed and save the visits"""
+        now = time.time() if now is None else now
+        visits = self.visits.setdefault(entry_id, [])
+        visits.append(now)
+        del visits[:-MAX_VISITS]
+        if len(self.visits) > MAX_ENTRIES:
+            keep = set(self.top(MAX_ENTRIES, now))
+            self._visits = {k: v for k, v in self.visits.items() if k in keep}
+        self.save()
+
+    def save(self):
+        """Write the visits"""
+        tmp = f"{self.path}.part"
+        try:
+            os.makedirs(bwm.DATA_HOME, exist_ok=True)
+            with open(tmp, "w", encoding=bwm.ENC) as out:
+                json.dump(self.visits, out)
+            os.replace(tmp, self.path)
+        except OSError as err:
+            logging.error(f"Saving {self.path} failed: {err}")
+
+
+# vim: set et ts=4 sw=4 :
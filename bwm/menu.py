@@ -1,11 +1,18 @@
 """Launcher functions"""
 
+import logging
+import os
 import shlex
 import sys
-from subprocess import run
+from subprocess import DEVNULL, PIPE, Popen, TimeoutExpired, run
+from threading import Thread
 
+from bwm import trace
 import bwm
 
+# Most buffers passed to one os.writev call (the usual Linux IOV_MAX)
+IOV_MAX = 1024
+
 
 def dmenu_cmd(num_lines, prompt):
     """Parse config.ini for dmenu options
@@ -69,28 +76,138 @@ def dmenu_pass(command):
     return ["-P"] if dm_patch else ["-nb", color, "-nf", color]
 
 
-def dmenu_select(num_lines, prompt="Entries", inp=""):
+def write_chunks(fd, chunks):
+    """Write byte chunks to a file descriptor without joining them, with as
+    few system calls as possible
+
+    Args: fd - file descriptor (int)
+          chunks - iterable of bytes-like objects
+
+    """
+    views = [memoryview(i) for i in chunks if i]
+    while views:
+        written = os.writev(fd, views[:IOV_MAX])
+        # Drop the chunks written and continue after a partial write
+        while views and written >= len(views[0]):
+            written -= len(views.pop(0))
+        if written:
+            views[0] = views[0][written:]
+
+
+def dmenu_select(num_lines, prompt="Entries", inp="", timeout=None):
     """Call dmenu and return the selected entry
 
     Args: num_lines - number of lines to display
           prompt - prompt to show
-          inp - string to pass to dmenu via STDIN
+          inp - string to pass to dmenu via STDIN, a list of already encoded
+                (bwm.ENC) byte chunks written to it as they are, or an
+                iterator of such lists, each written as soon as it is
+                generated (see dmenu_stream)
+          timeout - seconds before the launcher is closed. Raises
+                    subprocess.TimeoutExpired when reached.
 
     Returns: sel - string
 
     """
+    if not isinstance(inp, str):
+        if isinstance(inp, (list, tuple)):
+            inp = [inp]
+        return dmenu_stream(num_lines, prompt, inp, timeout)
     cmd = dmenu_cmd(num_lines, prompt)
-    res = run(
-        cmd,
-        capture_output=True,
-        check=False,
-        input=inp,
-        encoding=bwm.ENC,
-        env=bwm.ENV,
-    )
+    with trace.span("launcher", prompt=prompt):
+        res = run(
+            cmd,
+            capture_output=True,
+            check=False,
+            input=inp,
+            encoding=bwm.ENC,
+            env=bwm.ENV,
+            timeout=timeout,
+        )
     return res.stdout.rstrip("\n") if res.stdout is not None else None
 
 
+def dmenu_stream(num_lines, prompt="Entries", inp=(), timeout=None):
+    """Call dmenu, writing the input as it becomes available, and return the
+    selected entry
+
+    Launchers that read their input asynchronously (e.g. rofi, fzf) show the
+    first chunks right away. Others show the menu once all input is written.
+
+    Args: num_lines - number of lines to display
+          prompt - prompt to show
+          inp - iterable of strings (newline separated lines) or of lists of
+                encoded (bwm.ENC) byte chunks, written as they are. May block
+                between items.
+          timeout - seconds before the launcher is closed, whether or not
+                    all input was written. Raises subprocess.TimeoutExpired
+                    when reached.
+
+    Returns: sel - string
+
+    """
+    cmd = dmenu_cmd(num_lines, prompt)
+    read_fd, write_fd = os.pipe()
+    try:
+        proc = Popen(
+            cmd, stdin=read_fd, stdout=PIPE, stderr=DEVNULL, env=bwm.ENV
+        )
+    except OSError:
+        os.close(write_fd)
+        raise
+    finally:
+        os.close(read_fd)
+
+    def write():
+        try:
+            for chunk in inp:
+                if isinstance(chunk, str):
+                    chunk = [(chunk + "\n").encode(bwm.ENC)]
+                write_chunks(write_fd, chunk)
+        except BrokenPipeError:
+            # Launcher closed (selection made) before all input was written
+            pass
+        finally:
+            os.close(write_fd)
+
+    # Written from a thread so a selection made while input is still pending
+    # returns immediately and the timeout covers writing the input
+    Thread(target=write, daemon=True).start()
+    with trace.span("launcher", prompt=prompt, stream=True):
+        try:
+            out, _ = proc.communicate(timeout=timeout)
+        except TimeoutExpired:
+            proc.kill()
+            proc.wait()
+            raise
+    return out.decode(bwm.ENC).rstrip("\n")
+
+
+def notify(message, tag=None):
+    """Show a desktop notification with notify-send, if it is installed. The
+    message is logged either way.
+
+    Args: message - string
+          tag - notifications with the same tag replace each other (e.g.
+                progress updates), where the notification daemon supports it
+
+    """
+    logging.info(message)
+    cmd = ["notify-send", "-a", "bwm"]
+    if tag is not None:
+        cmd += ["-h", f"string:x-canonical-private-synchronous:{tag}"]
+    try:
+        run(
+            [*cmd, "bwm", message],
+            capture_output=True,
+            check=False,
+            env=bwm.ENV,
+            timeout=5,
+        )
+    except (OSError, TimeoutExpired):
+        pass
+
+
 def dmenu_err(prompt):
     """Pops up a dmenu prompt with an error message"""
     try:
@@ -0,0 +1,185 @@
+"""Counters and latency histograms of the daemon, shown by 'bwm --stats'
+
+Counters (reloads, bw serve restarts, CLI fallbacks, timeouts, typing errors,
+cache hits and misses) and per operation latencies are kept in the daemon
+process for its lifetime. They cost a dict update per event and are always
+on, unlike the timing spans of bwm.trace.
+
+"""
+
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+import resource
+import sys
+from threading import Lock
+import time
+
+# Upper bounds (ms) of the latency histogram buckets. Slower operations go in
+# a last, unbounded bucket.
+BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+LABELS = tuple(f"<={i}" for i in BUCKETS) + (f">{BUCKETS[-1]}",)
+
+START = time.monotonic()
+COUNTERS = Counter()
+HISTOGRAMS = {}
+
+_LOCK = Lock()
+
+
+class Histogram:
+    """Latencies of one operation in fixed buckets"""
+
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, ms):
+        """Add one latency (ms)"""
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.buckets[bisect_left(BUCKETS, ms)] += 1
+
+    def percentile(self, pct):
+        """Return the upper bound of the bucket holding the pct percentile
+        (the maximum for the unbounded bucket)
+
+        """
+        rank = pct / 100 * self.count
+        seen = 0
+        for num, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return BUCKETS[num] if num < len(BUCKETS) else self.max
+        return 0.0
+
+    def stats(self):
+        """Return a JSON serializable summary"""
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 3) if self.count else 0,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "max_ms": round(self.max, 3),
+            "buckets": {j: i for i, j in zip(self.buckets, LABELS) if i},
+        }
+
+
+def incr(name, num=1):
+    """Increment a counter"""
+    with _LOCK:
+        COUNTERS[name] += num
+
+
+def cache(name, hit):
+    """Count a hit or miss of a cache"""
+    incr(f"{name} {'hits' if hit else 'misses'}")
+
+
+def observe(name, seconds):
+    """Add a latency to the histogram of an operation"""
+    with _LOCK:
+        hist = HISTOGRAMS.get(name)
+        if hist is None:
+            hist = HISTOGRAMS[name] = Histogram()
+        hist.observe(seconds * 1000)
+
+
+@contextmanager
+def timed(name):
+    """Context manager adding the duration of the block to the histogram of
+    an operation. Blocks that raise are also counted as '<name> errors'.
+
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        incr(f"{name} errors")
+        raise
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def deep_size(obj, seen=None):
+    """Approximate memory used by a structure of dicts, lists and scalars
+
+    Args: obj - object
+          seen - set of ids already counted
+    Returns: int (bytes)
+
+    """
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(
+            deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items()
+        )
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(i, seen) for i in obj)
+    return size
+
+
+def vault_stats(vault):
+    """Return the size of a loaded vault
+
+    Args: vault - Vault object
+    Returns: dict
+
+    """
+    return {
+        "url": vault.url,
+        "entries": len(vault.entries),
+        "folders": len(vault.folders),
+        "bytes": deep_size(
+            (vault.entries, vault.folders, vault.collections, vault.orgs)
+        ),
+        "serve": vault.bwcliserver is not None,
+    }
+
+
+def stats(vaults=()):
+    """Return all metrics
+
+    Args: vaults - list of Vault objects
+    Returns: dict (JSON serializable)
+
+    """
+    with _LOCK:
+        counters = dict(sorted(COUNTERS.items()))
+        latency = {k: v.stats() for k, v in sorted(HISTOGRAMS.items())}
+    caches = {}
+    for name in counters:
+        if name.endswith(" hits") or name.endswith(" misses"):
+            cache_name = name.rsplit(" ", 1)[0]
+            hits = counters.get(f"{cache_name} hits", 0)
+            total = hits + counters.get(f"{cache_name} misses", 0)
+            caches[cache_name] = round(hits / total, 3)
+    # Linux reports kilobytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {
+        "uptime_s": round(time.monotonic() - START),
+        "max_rss_bytes": max_rss,
+        "vaults": [vault_stats(i) for i in vaults],
+        "counters": counters,
+        "cache_hit_rates": caches,
+        "latency": latency,
+    }
+
+
+def reset():
+    """Clear all counters and histograms"""
+    with _LOCK:
+        COUNTERS.clear()
+        HISTOGRAMS.clear()
+
+
+# vim: set et ts=4 sw=4 :
@@ -1,11 +1,90 @@
 """TOTP generation"""
 
 import base64
+import binascii
+from dataclasses import dataclass
 import hmac
+import logging
 import struct
 import time
 from urllib import parse
 
+from bwm import metrics
+
+STEAM_CHARS = "23456789BCDFGHJKMNPQRTVWXY"
+
+# otpauth 'algorithm' values (upper case, dashes removed) to hashlib names
+ALGORITHMS = {"SHA1": "sha1", "SHA256": "sha256", "SHA512": "sha512"}
+
+# Allowed code lengths. 10 digits is the most a 31 bit truncated HMAC provides.
+MIN_DIGITS = 1
+MAX_DIGITS = 10
+
+
+@dataclass(frozen=True)
+class OTPKey:
+    """Parsed otpauth URL with the secret already base32 decoded"""
+
+    key: bytes
+    period: int = 30
+    digits: int = 6
+    digest: str = "sha1"
+    steam: bool = False
+
+
+# Parsed keys by item id: {id: (otp_url, OTPKey)}. The otp_url is kept so an
+# edited entry never returns a stale key even if invalidate() wasn't called.
+OTP_CACHE = {}
+
+
+def decode_secret(secret):
+    """Base32 decode a TOTP secret, adding any missing padding
+
+    Args: secret - string
+    Returns: bytes. Raises binascii.Error on invalid characters
+
+    """
+    return base64.b32decode(secret.upper() + "=" * ((8 - len(secret)) % 8))
+
+
+def _encode_decimal(binary, digits):
+    """RFC 4226 decimal code"""
+    return str(binary)[-digits:].rjust(digits, "0")
+
+
+def _encode_steam(binary, digits):
+    """Steam Guard alphanumeric code"""
+    code = ""
+    for _ in range(digits):
+        code += STEAM_CHARS[binary % len(STEAM_CHARS)]
+        binary //= len(STEAM_CHARS)
+    return code
+
+
+# steam flag to code encoder
+ENCODERS = {False: _encode_decimal, True: _encode_steam}
+
+
+def _hotp(key, counter, digits=6, digest="sha1", steam=False):
+    """Generates HMAC OTP from an already decoded key
+
+    Args: key - Secret key (bytes)
+          counter - Moving factor
+
+    Returns: otp
+
+    """
+    return _truncate(
+        hmac.digest(key, struct.pack(">Q", counter), digest), digits, steam
+    )
+
+
+def _truncate(mac, digits, steam):
+    """RFC 4226 dynamic truncation of an HMAC into a code"""
+    offset = mac[-1] & 0x0F
+    binary = struct.unpack(">L", mac[offset : offset + 4])[0] & 0x7FFFFFFF
+    return ENCODERS[steam](binary, digits)
+
 
 def hotp(key, counter, digits=6, digest="sha1", steam=False):
     """Generates HMAC OTP.  Taken from https://github.com/susam/mintotp
@@ -19,23 +98,7 @@ def hotp(key, counter, digits=6, digest="sha1", steam=False):
     Returns: otp
 
     """
-    key = base64.b32decode(key.upper() + "=" * ((8 - len(key)) % 8))
-    counter = struct.pack(">Q", counter)
-    mac = hmac.new(key, counter, digest).digest()
-    offset = mac[-1] & 0x0F
-    binary = struct.unpack(">L", mac[offset : offset + 4])[0] & 0x7FFFFFFF
-    code = ""
-
-    if steam:
-        chars = "23456789BCDFGHJKMNPQRTVWXY"
-        full_code = int(binary)
-        for _ in range(digits):
-            code += chars[full_code % len(chars)]
-            full_code //= len(chars)
-    else:
-        code = str(binary)[-digits:].rjust(digits, "0")
-
-    return code
+    return _hotp(decode_secret(key), counter, digits, digest, steam)
 
 
 def totp(key, time_step=30, digits=6, digest="sha1", steam=False):
@@ -53,31 +116,146 @@ def totp(key, time_step=30, digits=6, digest="sha1", steam=False):
     return hotp(key, int(time.time() / time_step), digits, digest, steam)
 
 
-def gen_otp(otp_url):
+def parse_otp(otp_url):
+    """Parse a TOTP URL into an OTPKey
+
+    Accepts otpauth://totp/ URLs, steam://<secret> and a bare base32 secret
+    (both of which Bitwarden also stores in login.totp).
+
+    Args: otp_url - KeePassXC url encoding with information on how to generate otp
+    Returns: OTPKey or None if the URL is incomplete or invalid
+
+    """
+    if not otp_url:
+        return None
+    if otp_url.lower().startswith("steam://"):
+        query = {"secret": otp_url[8:], "digits": "5", "encoder": "steam"}
+    elif "://" not in otp_url:
+        query = {"secret": otp_url}
+    else:
+        query_string = parse.parse_qs(parse.urlparse(otp_url).query)
+        # period and digits are optional in otpauth URLs (30 and 6)
+        if "secret" not in query_string:
+            return None
+        query = {k: v[0] for k, v in query_string.items()}
+
+    steam = query.get("encoder", "").lower() == "steam"
+    algorithm = query.get("algorithm", "SHA1").upper().replace("-", "")
+    try:
+        key = OTPKey(
+            decode_secret(query["secret"].replace(" ", "")),
+            int(query.get("period", 30)),
+            int(query.get("digits", 5 if steam else 6)),
+            ALGORITHMS[algorithm],
+            steam,
+        )
+    except (binascii.Error, KeyError, ValueError) as err:
+        logging.warning(f"Invalid TOTP settings: {err!r}")
+        return None
+    if (
+        not key.key
+        or key.period <= 0
+        or not MIN_DIGITS <= key.digits <= MAX_DIGITS
+    ):
+        logging.warning("Invalid TOTP settings: secret, period or digits")
+        return None
+    return key
+
+
+def get_otp_key(otp_url, item_id=None):
+    """Return the OTPKey for an otpauth URL, cached by item id
+
+    Args: otp_url - string
+          item_id - vault item id. If None the URL is parsed without caching
+    Returns: OTPKey or None
+
+    """
+    if item_id is None:
+        return parse_otp(otp_url)
+    cached = OTP_CACHE.get(item_id)
+    if cached is not None and cached[0] == otp_url:
+        metrics.cache("totp key", True)
+        return cached[1]
+    metrics.cache("totp key", False)
+    key = parse_otp(otp_url)
+    if key is None:
+        OTP_CACHE.pop(item_id, None)
+    else:
+        OTP_CACHE[item_id] = (otp_url, key)
+    return key
+
+
+def invalidate(item_id):
+    """Drop the cached OTPKey for an item after it is edited or deleted"""
+    OTP_CACHE.pop(item_id, None)
+
+
+def otp_now(key, now=None):
+    """Generate the current code for an OTPKey
+
+    Args: key - OTPKey
+          now - unix time (default: time.time())
+    Returns: otp
+
+    """
+    now = time.time() if now is None else now
+    return _hotp(
+        key.key, int(now / key.period), key.digits, key.digest, key.steam
+    )
+
+
+def time_remaining(key, now=None):
+    """Return the number of seconds the current code for an OTPKey is valid"""
+    now = time.time() if now is None else now
+    return key.period - int(now) % key.period
+
+
+def gen_otp(otp_url, item_id=None):
     """Generates one time password
 
     Args: otp_url - KeePassXC url encoding with information on how to generate otp
+          item_id - vault item id used to cache the parsed URL
     Returns: otp
 
     """
-    parsed_otp_url = parse.urlparse(otp_url)
-    query_string = parse.parse_qs(parsed_otp_url.query)
+    key = get_otp_key(otp_url, item_id)
+    if key is None:
+        return ""
+    return otp_now(key)
 
-    for required in ("secret", "period", "digits"):
-        if required not in query_string:
-            return ""
 
-    try:
-        steam = query_string["encoder"][0] == "steam"
-    except KeyError:
-        steam = False
-
-    return totp(
-        query_string["secret"][0],
-        int(query_string["period"][0]),
-        int(query_string["digits"][0]),
-        "sha1"
-        if "algorihm" not in query_string
-        else query_string["algorithm"][0].lower(),
-        steam,
-    )
+def gen_otps(entries, now=None):
+    """Generate the current codes for many login entries in one pass
+
+    Uses a single timestamp for all entries so every code belongs to the same
+    time step. Entries without an id or a TOTP URL are skipped.
+
+    Args: entries - iterable of Items
+          now - unix time (default: time.time())
+    Returns: dict {item id: (otp, seconds remaining)}
+
+    """
+    now = time.time() if now is None else now
+    # Packed counter and seconds remaining for each distinct period
+    steps = {}
+    codes = {}
+    for entry in entries:
+        otp_url = (entry.get("login") or {}).get("totp")
+        if not otp_url or entry.get("id") is None:
+            continue
+        key = get_otp_key(otp_url, entry["id"])
+        if key is None:
+            continue
+        step = steps.get(key.period)
+        if step is None:
+            step = steps[key.period] = (
+                struct.pack(">Q", int(now / key.period)),
+                time_remaining(key, now),
+            )
+        codes[entry["id"]] = (
+            _truncate(
+                hmac.digest(key.key, step[0], key.digest), key.digits, key.steam
+            ),
+            step[1],
+        )
+    return codes
@@ -0,0 +1,157 @@
+"""Timing spans for finding where the time of a hotkey press goes
+
+Phases (client IPC, menu rendering, the launcher, bw serve requests, bw CLI
+commands, typing) are wrapped in spans:
+
+    with trace.span("serve", endpoint="/list/object/items"):
+        ...
+
+When tracing is enabled in config.ini ([trace] enabled = True) each finished
+span is kept in an in-memory ring buffer and, if [trace] file is set,
+appended to that file as one JSON object per line. Spans of one hotkey press
+share a trace id, passed from the client to the daemon with the arguments.
+
+When tracing is disabled span() returns a shared no-op context manager.
+
+Records never include secrets: only span names, timings and the attributes
+given by the caller (endpoints, bw subcommands, launcher prompts).
+
+"""
+
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+import json
+import logging
+import os
+from threading import Lock, current_thread, local
+import time
+import uuid
+
+import bwm
+
+ENABLED = bwm.CONF.getboolean("trace", "enabled", fallback=False)
+TRACE_FILE = os.path.expanduser(bwm.CONF.get("trace", "file", fallback=""))
+RECORDS = deque(maxlen=bwm.CONF.getint("trace", "buffer", fallback=1000))
+
+_NOOP = nullcontext()
+_LOCAL = local()
+_LOCK = Lock()
+
+
+def new_trace(trace_id=None):
+    """Start a new trace in the calling thread
+
+    Args: trace_id - id received from another process (default: a new id)
+    Returns: trace id (string) or None when tracing is disabled
+
+    """
+    if not ENABLED:
+        return None
+    _LOCAL.trace = trace_id or uuid.uuid4().hex[:16]
+    return _LOCAL.trace
+
+
+def current_trace():
+    """Return the trace id of the calling thread (None if there is none)"""
+    return getattr(_LOCAL, "trace", None)
+
+
+class Span:
+    """Time a block of code and record it when the block exits"""
+
+    __slots__ = ("name", "attrs", "start", "wall", "parent")
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+        self.wall = None
+        self.parent = None
+
+    def __enter__(self):
+        stack = _LOCAL.__dict__.setdefault("stack", [])
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        _LOCAL.stack.pop()
+        record = {
+            "trace": current_trace(),
+            "span": self.name,
+            "parent": self.parent,
+            "start": round(self.wall, 6),
+            "ms": round(elapsed * 1000, 3),
+            "pid": os.getpid(),
+            "thread": current_thread().name,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        record.update(self.attrs)
+        _record(record)
+        return False
+
+
+def span(name, **attrs):
+    """Return a context manager timing a phase
+
+    Args: name - phase name (ipc, hotkey, render, launcher, serve, bw, type)
+          attrs - extra JSON serializable attributes to record. Must not
+                  contain secrets.
+    Returns: Span, or a no-op context manager when tracing is disabled
+
+    """
+    if not ENABLED:
+        return _NOOP
+    return Span(name, attrs)
+
+
+def traced(name):
+    """Decorator recording a span for every call of a function"""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _record(record):
+    """Add a finished span to the ring buffer and the trace file"""
+    with _LOCK:
+        RECORDS.append(record)
+        if not TRACE_FILE:
+            return
+        try:
+            # Opened for each record so client and daemon processes can
+            # append to the same file
+            with open(TRACE_FILE, "a", encoding="utf-8") as fout:
+                fout.write(json.dumps(record) + "\n")
+        except OSError as err:
+            logging.warning(f"Trace file {TRACE_FILE}: {err}")
+
+
+def records(trace_id=None):
+    """Return the buffered span records
+
+    Args: trace_id - only return the spans of this trace
+    Returns: list of dicts (oldest first)
+
+    """
+    with _LOCK:
+        return [
+            i for i in RECORDS if trace_id is None or i["trace"] == trace_id
+        ]
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,301 @@
+"""Match a URL to vault entries using the Bitwarden URI match types
+
+Match types (login.uris[].match):
+
+    None - the default match type (Domain unless set otherwise)
+    0 Domain - same registrable domain, e.g. login.example.com ~ example.com
+    1 Host - same host name and port
+    2 StartsWith - the URL starts with the URI
+    3 Exact - the URL is the URI
+    4 RegEx - the URI is a case insensitive regular expression found in the URL
+    5 Never - never matches
+
+"""
+
+from functools import lru_cache
+import ipaddress
+import logging
+import re
+from urllib.parse import urlsplit
+
+DOMAIN, HOST, STARTS_WITH, EXACT, REGEX, NEVER = range(6)
+
+# Lower ranks are more specific and are listed first
+RANKS = {EXACT: 0, STARTS_WITH: 1, REGEX: 2, HOST: 3, DOMAIN: 4}
+
+# Public suffixes with two labels that are common enough to matter when
+# guessing the registrable domain without shipping the full suffix list.
+MULTI_PART_SUFFIXES = {
+    "ac.uk",
+    "co.uk",
+    "gov.uk",
+    "ltd.uk",
+    "me.uk",
+    "org.uk",
+    "com.au",
+    "net.au",
+    "org.au",
+    "co.jp",
+    "ne.jp",
+    "or.jp",
+    "co.nz",
+    "org.nz",
+    "co.za",
+    "com.br",
+    "com.cn",
+    "com.mx",
+    "com.tr",
+    "co.in",
+    "co.kr",
+    "github.io",
+    "gitlab.io",
+}
+
+
+@lru_cache(maxsize=65536)
+def uri_host(uri):
+    """Return the lower case host name of a URI, without port
+
+    URIs without a scheme (e.g. 'example.com/login') are accepted. Cached as
+    the same URIs are parsed by the search index and the URI matcher on every
+    vault load.
+
+    Returns: string (empty if no host)
+
+    """
+    if not uri:
+        return ""
+    if "://" not in uri:
+        uri = f"http://{uri}"
+    try:
+        return (urlsplit(uri).hostname or "").rstrip(".")
+    except ValueError:
+        return ""
+
+
+def registrable_domain(host):
+    """Return the registrable domain (eTLD+1) for a host name
+
+    Args: host - string
+    Returns: string. IP addresses and single label hosts are returned as-is.
+
+    """
+    # Only hosts ending in a digit (IPv4) or containing ':' (IPv6) can be IP
+    # addresses, which saves raising ValueError for every other host.
+    if host[-1:].isdigit() or ":" in host:
+        try:
+            ipaddress.ip_address(host)
+            return host
+        except ValueError:
+            pass
+    labels = host.split(".")
+    if len(labels) > 2 and ".".join(labels[-2:]) in MULTI_PART_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def host_port(uri):
+    """Return 'host[:port]' of a URI, lower case without user info
+
+    Returns: string (empty if no host)
+
+    """
+    if not uri:
+        return ""
+    if "://" not in uri:
+        uri = f"http://{uri}"
+    try:
+        parts = urlsplit(uri)
+        port = parts.port
+    except ValueError:
+        return ""
+    host = (parts.hostname or "").rstrip(".")
+    return f"{host}:{port}" if host and port is not None else host
+
+
+@lru_cache(maxsize=4096)
+def compile_regex(pattern):
+    """Compile (and cache) a RegEx match URI
+
+    Returns: compiled pattern or None if invalid
+
+    """
+    try:
+        return re.compile(pattern, re.IGNORECASE)
+    except re.error as err:
+        logging.warning(f"Invalid RegEx URI '{pattern}': {err}")
+        return None
+
+
+def uri_matches(url, uri, match=None, default=DOMAIN):
+    """Check a single URI against a URL. Used for one-off checks; use
+    UriMatcher to search a whole vault.
+
+    Args: url - string
+          uri - string. The login URI
+          match - match type or None for the default
+          default - match type used when match is None
+    Returns: bool
+
+    """
+    match = default if match is None else match
+    if not url or not uri or match == NEVER:
+        return False
+    if match == EXACT:
+        return url == uri
+    if match == STARTS_WITH:
+        return url.startswith(uri)
+    if match == REGEX:
+        regex = compile_regex(uri)
+        return bool(regex and regex.search(url))
+    if match == HOST:
+        return host_port(url) != "" and host_port(url) == host_port(uri)
+    host, url_host = uri_host(uri), uri_host(url)
+    if not host or not url_host:
+        return False
+    return registrable_domain(host) == registrable_domain(url_host)
+
+
+def _labels(host):
+    """Trie path for a host name: labels from the top level domain down"""
+    return host.split(".")[::-1]
+
+
+def _anchored(uri):
+    """True if the host of a StartsWith URI is complete, i.e. a URL can only
+    start with the URI if it has the same host.
+
+    """
+    rest = uri.split("://", 1)[-1]
+    return any(i in rest for i in "/?#")
+
+
+class _Node:
+    """Trie node for one host name label"""
+
+    __slots__ = ("children", "domain", "host")
+
+    def __init__(self):
+        self.children = {}
+        # Domain rules: [(item id, uri)]
+        self.domain = []
+        # Host, StartsWith and Exact rules: [(item id, match, uri)]
+        self.host = []
+
+
+class UriMatcher:
+    """Find the vault entries with a URI matching a URL without checking every
+    URI in the vault.
+
+    URIs are stored in a trie of reversed host name labels. Domain rules live
+    on the node of their registrable domain and Host, StartsWith and Exact
+    rules on the node of their host, so a lookup only walks the labels of the
+    URL host and verifies the few rules found there. RegEx rules can't be
+    indexed and are checked in turn using a compiled pattern cache.
+
+    """
+
+    def __init__(self, default=DOMAIN):
+        """Args: default - match type used for URIs without one"""
+        self.default = default
+        self._root = _Node()
+        # Rules that can't be placed in the trie: [(item id, match, uri)]
+        self._regex = []
+        self._other = []
+        # {item id: [(rule list, rule)]} for removal
+        self._rules = {}
+
+    def __len__(self):
+        return len(self._rules)
+
+    def _node(self, host):
+        node = self._root
+        for label in _labels(host):
+            node = node.children.setdefault(label, _Node())
+        return node
+
+    def _place(self, item_id, match, uri):
+        """Return the (rule list, rule) a URI is stored in or None"""
+        if match == REGEX:
+            return self._regex, (item_id, match, uri)
+        host = uri_host(uri)
+        if match == DOMAIN and host:
+            return self._node(registrable_domain(host)).domain, (item_id, uri)
+        if match in (HOST, EXACT) and host:
+            return self._node(host).host, (item_id, match, uri)
+        if match == STARTS_WITH and host and _anchored(uri):
+            return self._node(host).host, (item_id, match, uri)
+        if match in RANKS:
+            return self._other, (item_id, match, uri)
+        return None
+
+    def add(self, entry):
+        """Add the URIs of an entry"""
+        item_id = entry.get("id")
+        if item_id is None:
+            return
+        self.remove(entry)
+        rules = []
+        for uri in (entry.get("login") or {}).get("uris") or []:
+            match = uri.get("match")
+            match = self.default if match is None else match
+            if not uri.get("uri") or match == NEVER:
+                continue
+            placed = self._place(item_id, match, uri["uri"])
+            if placed is not None:
+                placed[0].append(placed[1])
+                rules.append(placed)
+        if rules:
+            self._rules[item_id] = rules
+
+    def remove(self, entry):
+        """Remove the URIs of an entry"""
+        for rules, rule in self._rules.pop(entry.get("id"), []):
+            rules.remove(rule)
+
+    def rebuild(self, entries):
+        """Index all entries from scratch"""
+        self._root = _Node()
+        self._regex = []
+        self._other = []
+        self._rules = {}
+        for entry in entries or []:
+            self.add(entry)
+
+    def match(self, url):
+        """Find the entries with a URI matching a URL
+
+        Args: url - string
+        Returns: dict {item id: rank} where rank is the most specific match
+                 (see RANKS)
+
+        """
+        found = {}
+
+        def hit(item_id, match):
+            rank = RANKS[match]
+            if rank < found.get(item_id, len(RANKS)):
+                found[item_id] = rank
+
+        host = uri_host(url)
+        if host:
+            depth = len(_labels(registrable_domain(host)))
+            node = self._root
+            for num, label in enumerate(_labels(host), 1):
+                node = node.children.get(label)
+                if node is None:
+                    break
+                if num == depth:
+                    for item_id, _ in node.domain:
+                        hit(item_id, DOMAIN)
+            else:
+                for item_id, match, uri in node.host:
+                    if uri_matches(url, uri, match):
+                        hit(item_id, match)
+        for item_id, match, uri in self._regex + self._other:
+            if uri_matches(url, uri, match):
+                hit(item_id, match)
+        return found
+
+
+# vim: set et ts=4 sw=4 :
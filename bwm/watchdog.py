@@ -0,0 +1,151 @@
+"""Watchdog for the bwm daemon
+
+A hung launcher (e.g. a menu left open) or bw CLI process blocks the
+DmenuRunner loop, leaving the hotkey dead. The watchdog times each hotkey
+activation and, past its budget, logs where the daemon is stuck and kills
+the launcher and bw CLI processes it is waiting on so the loop can continue.
+Editors and bw serve are never killed.
+
+"""
+
+from contextlib import contextmanager
+from glob import glob
+import logging
+import os
+from os.path import basename
+import signal
+import sys
+from threading import Event, Lock, Thread, get_ident
+import time
+import traceback
+
+# Process names (/proc/<pid>/comm) that may be killed when stuck, in addition
+# to the launcher
+KILLABLE = ("bw", "node")
+
+
+def child_processes(pid=None):
+    """Return the direct children of a process
+
+    Args: pid - int (default: this process)
+    Returns: dict {pid: process name}
+
+    """
+    pid = os.getpid() if pid is None else pid
+    children = {}
+    for stat in glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat, encoding="utf-8", errors="replace") as fin:
+                data = fin.read()
+        except OSError:
+            continue
+        # 'pid (comm) state ppid ...'; comm may contain spaces or ')'
+        name = data[data.find("(") + 1 : data.rfind(")")]
+        fields = data[data.rfind(")") + 2 :].split()
+        if len(fields) > 1 and int(fields[1]) == pid:
+            children[int(data.split(" ", 1)[0])] = name
+    return children
+
+
+class Watchdog:
+    """Time-limit blocks of code running in another thread
+
+    Use 'with watchdog.watch("name"):' (or begin() and end()) around each
+    unit of work. If it runs longer than the timeout, the stack of the stuck
+    thread is logged and on_timeout(name) is called once.
+
+    """
+
+    def __init__(self, timeout, on_timeout=None, interval=1.0):
+        """Start the watchdog thread
+
+        Args: timeout - seconds (0 or None disables the watchdog)
+              on_timeout - function(name) called when a block overruns
+              interval - seconds between checks
+
+        """
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.interval = interval
+        self.fired = 0
+        self._lock = Lock()
+        self._task = None
+        self._stop = Event()
+        if timeout:
+            Thread(target=self._run, name="bwm-watchdog", daemon=True).start()
+
+    def begin(self, name):
+        """Start timing a unit of work in the calling thread"""
+        with self._lock:
+            # [name, start time, fired, thread id]
+            self._task = [name, time.monotonic(), False, get_ident()]
+
+    def end(self):
+        """Stop timing the current unit of work"""
+        with self._lock:
+            self._task = None
+
+    @contextmanager
+    def watch(self, name):
+        """Context manager timing one unit of work"""
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def stop(self):
+        """Stop the watchdog thread"""
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                task = self._task
+                if (
+                    task is None
+                    or task[2]
+                    or time.monotonic() - task[1] < self.timeout
+                ):
+                    continue
+                task[2] = True
+            self._fire(task[0], task[3])
+
+    def _fire(self, name, ident):
+        """Log the stuck thread and call on_timeout"""
+        self.fired += 1
+        frame = sys._current_frames().get(ident)
+        stack = "".join(traceback.format_stack(frame)) if frame else ""
+        logging.error(
+            f"Watchdog: '{name}' still running after {self.timeout}s\n{stack}"
+        )
+        if self.on_timeout is not None:
+            try:
+                self.on_timeout(name)
+            except Exception as err:  # pylint: disable=broad-except
+                logging.error(f"Watchdog: recovery failed: {err}")
+
+
+def kill_stuck(launcher, keep=()):
+    """Terminate the launcher and bw CLI processes started by this process
+
+    Args: launcher - launcher command name (e.g. 'dmenu', 'rofi')
+          keep - pids not to kill (bw serve)
+    Returns: list of killed pids
+
+    """
+    names = (basename(launcher), *KILLABLE)
+    killed = []
+    for pid, name in child_processes().items():
+        if pid in keep or name not in names:
+            continue
+        try:
+            os.kill(pid, signal.SIGTERM)
+            killed.append(pid)
+            logging.warning(f"Watchdog: killed stuck {name} (pid {pid})")
+        except OSError:
+            pass
+    return killed
+
+
+# vim: set et ts=4 sw=4 :
@@ -3,6 +3,8 @@
 import configparser
 import pytest
 
+from tests import vaultgen
+
 
 @pytest.fixture
 def sample_login_entry():
@@ -143,6 +145,20 @@ def sample_orgs():
     }
 
 
+@pytest.fixture
+def synthetic_vault():
+    """Return a function generating a large vault as bwm keeps it in memory:
+    (items, folders, collections, orgs). Takes the arguments of
+    tests.vaultgen.generate.
+
+    """
+
+    def make(**kwargs):
+        return vaultgen.loaded(vaultgen.generate(**kwargs))
+
+    return make
+
+
 @pytest.fixture
 def mock_config():
     """Create a mock configuration for testing."""
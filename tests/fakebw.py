@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""Stand-in for the bw CLI and `bw serve`, backed by a generated vault
+
+Runs as the `bw` executable when tests/bin is first in PATH, so bwm, its
+tests and benchmarks can be timed end to end without a Bitwarden account or
+network:
+
+    PATH=$PWD/tests/bin:$PATH FAKEBW_ITEMS=10000 FAKEBW_LATENCY=0.05 bwm
+
+Supports the commands bwm uses (status, config, login, unlock, lock, logout,
+sync, list, encode, create, edit, delete) and `bw serve --hostname
+fd+connected://<fd>` or `fd+listening://<fd>` with the REST endpoints used by
+bwm.bwserve. Every password unlocks the vault.
+
+Environment:
+    FAKEBW_VAULT - JSON file written by tests.vaultgen. Changes made by CLI
+                   commands are saved to it; bw serve keeps them in memory.
+                   Default: a vault generated from FAKEBW_ITEMS and
+                   FAKEBW_SEED for every command.
+    FAKEBW_ITEMS - number of generated items (default 100)
+    FAKEBW_SEED - seed of the generated vault (default 0)
+    FAKEBW_STARTUP - seconds each CLI command takes to start (the real CLI is
+                     a node program), default 0
+    FAKEBW_LATENCY - seconds added to each CLI command and bw serve request
+                     (server round trip), default 0
+
+"""
+
+import base64
+from http.server import BaseHTTPRequestHandler
+import json
+import os
+from os.path import abspath, dirname, join
+import socket
+import sys
+from threading import Lock, Thread
+import time
+from urllib.parse import parse_qs, urlsplit
+import uuid
+
+if __package__:
+    from tests.vaultgen import generate
+else:  # Run as tests/bin/bw
+    from vaultgen import generate  # pylint: disable=import-error
+
+BIN_DIR = join(dirname(abspath(__file__)), "bin")
+SESSION = "ZmFrZWJ3LXNlc3Npb24tdG9rZW4="
+EMAIL = "user@example.com"
+# Objects of each list command and bw serve /list/object/<name> endpoint
+LISTS = {
+    "items": "items",
+    "folders": "folders",
+    "collections": "collections",
+    "org-collections": "collections",
+    "organizations": "organizations",
+}
+# Options followed by a value
+VALUE_OPTIONS = ("--session", "--organizationid", "--hostname", "--port")
+
+
+def environ(vault_file=None, items=100, seed=0, startup=0, latency=0):
+    """Return an environment running the stand-in as bw
+
+    Args: vault_file - FAKEBW_VAULT (default: generate the vault)
+          items, seed, startup, latency - see the module docstring
+    Returns: dict (copy of os.environ)
+
+    """
+    env = dict(
+        os.environ,
+        PATH=os.pathsep.join((BIN_DIR, os.environ.get("PATH", ""))),
+        FAKEBW_ITEMS=str(items),
+        FAKEBW_SEED=str(seed),
+        FAKEBW_STARTUP=str(startup),
+        FAKEBW_LATENCY=str(latency),
+    )
+    env.pop("FAKEBW_VAULT", None)
+    if vault_file:
+        env["FAKEBW_VAULT"] = str(vault_file)
+    return env
+
+
+class FakeVault:
+    """Items, folders, collections and organizations of the stand-in"""
+
+    def __init__(self, path=None, items=100, seed=0):
+        """Load the vault file or generate a vault
+
+        Args: path - JSON file from tests.vaultgen
+              items, seed - passed to generate() if there is no path
+
+        """
+        self.path = path
+        self.lock = Lock()
+        if path:
+            with open(path, encoding="utf-8") as fin:
+                self.data = json.load(fin)
+        else:
+            self.data = generate(items=items, seed=seed)
+
+    @classmethod
+    def from_env(cls):
+        """Create the vault from the FAKEBW_* environment variables"""
+        return cls(
+            os.environ.get("FAKEBW_VAULT"),
+            int(os.environ.get("FAKEBW_ITEMS", "100")),
+            int(os.environ.get("FAKEBW_SEED", "0")),
+        )
+
+    def save(self):
+        """Write the vault back to its file (if it has one)"""
+        if not self.path:
+            return
+        with open(f"{self.path}.part", "w", encoding="utf-8") as fout:
+            json.dump(self.data, fout)
+        os.replace(f"{self.path}.part", self.path)
+
+    def list(self, name, org_id=None):
+        """Return the objects of a list command or endpoint"""
+        objs = self.data[LISTS[name]]
+        if org_id:
+            objs = [i for i in objs if i.get("organizationId") == org_id]
+        return objs
+
+    def create(self, kind, obj, org_id=None):
+        """Add an item, folder or org-collection and return it"""
+        obj = dict(obj, id=str(uuid.uuid4()))
+        if kind == "item":
+            obj.update(object="item", revisionDate=_now(), deletedDate=None)
+            obj.setdefault("collectionIds", [])
+            self.data["items"].append(obj)
+        elif kind == "folder":
+            obj["object"] = "folder"
+            self.data["folders"].append(obj)
+        else:
+            obj.update(object="collection", organizationId=org_id)
+            self.data["collections"].append(obj)
+        return obj
+
+    def _find(self, kind, obj_id):
+        """Return (list, index) of an object or (list, None)"""
+        objs = self.data[_KINDS[kind]]
+        for num, obj in enumerate(objs):
+            if obj["id"] == obj_id:
+                return objs, num
+        return objs, None
+
+    def edit(self, kind, obj_id, obj):
+        """Replace an object and return it (None if it doesn't exist)"""
+        objs, num = self._find(kind, obj_id)
+        if num is None:
+            return None
+        obj = dict(objs[num], **obj)
+        obj["id"] = obj_id
+        if kind == "item":
+            obj["revisionDate"] = _now()
+        objs[num] = obj
+        return obj
+
+    def delete(self, kind, obj_id):
+        """Remove an object. Returns False if it doesn't exist."""
+        objs, num = self._find(kind, obj_id)
+        if num is None:
+            return False
+        del objs[num]
+        return True
+
+    def move(self, item_id, org_id, collection_ids):
+        """Share an item with the collections of an organization"""
+        return self.edit(
+            "item",
+            item_id,
+            {"organizationId": org_id, "collectionIds": collection_ids},
+        )
+
+
+_KINDS = {
+    "item": "items",
+    "folder": "folders",
+    "org-collection": "collections",
+}
+
+
+def _now():
+    """Current time as a Bitwarden revision date"""
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+
+
+def status(session):
+    """bw status output for a session"""
+    return {
+        "serverUrl": "https://vault.example.com",
+        "lastSync": _now(),
+        "userEmail": EMAIL,
+        "userId": "00000000-0000-4000-8000-000000000000",
+        "status": "unlocked" if session else "locked",
+    }
+
+
+def parse_args(argv):
+    """Split bw arguments into positionals and options
+
+    Returns: tuple (list of positionals, dict of options)
+
+    """
+    args, opts = [], {}
+    argv = iter(argv)
+    for arg in argv:
+        if arg in VALUE_OPTIONS:
+            opts[arg] = next(argv, "")
+        elif arg.startswith("--"):
+            opts[arg] = True
+        else:
+            args.append(arg)
+    return args, opts
+
+
+def _decode(encoded):
+    """Decode the base64 JSON argument of create and edit"""
+    return json.loads(base64.b64decode(encoded))
+
+
+def cli(argv, stdin, stdout, stderr):
+    """Run one bw command
+
+    Args: argv - arguments after 'bw'
+          stdin, stdout, stderr - text files
+    Returns: exit status
+
+    """
+    args, opts = parse_args(argv)
+    cmd = args[0] if args else ""
+    session = opts.get("--session") or os.environ.get("BW_SESSION", "")
+    if cmd == "serve":
+        serve(opts.get("--hostname", ""), FakeVault.from_env())
+        return 0
+    time.sleep(float(os.environ.get("FAKEBW_LATENCY", "0")))
+    if cmd == "encode":
+        stdout.write(base64.b64encode(stdin.read().encode()).decode())
+        return 0
+    if cmd == "status":
+        stdout.write(json.dumps(status(session)))
+        return 0
+    if cmd in ("login", "unlock"):
+        stdout.write(SESSION)
+        return 0
+    if cmd in ("config", "sync", "lock"):
+        stdout.write(f"{cmd} done")
+        return 0
+    if cmd == "logout":
+        stderr.write("You have logged out.")
+        return 0
+    if not session:
+        stderr.write("Vault is locked.")
+        return 1
+    vault = FakeVault.from_env()
+    if cmd == "list" and len(args) > 1 and args[1] in LISTS:
+        stdout.write(
+            json.dumps(vault.list(args[1], opts.get("--organizationid")))
+        )
+        return 0
+    if len(args) < 3 or args[1] not in _KINDS:
+        stderr.write(f"Unsupported command: {' '.join(args)}")
+        return 1
+    kind = args[1]
+    if cmd == "create":
+        res = vault.create(kind, _decode(args[2]), opts.get("--organizationid"))
+    elif cmd == "edit" and len(args) > 3:
+        res = vault.edit(kind, args[2], _decode(args[3]))
+    elif cmd == "delete":
+        res = vault.delete(kind, args[2]) or None
+    else:
+        stderr.write(f"Unsupported command: {' '.join(args)}")
+        return 1
+    if res is None:
+        stderr.write("Not found.")
+        return 1
+    vault.save()
+    if res is not True:
+        stdout.write(json.dumps(res))
+    return 0
+
+
+class Handler(BaseHTTPRequestHandler):
+    """bw serve REST API of the stand-in"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Don't log requests to stderr"""
+
+    def _reply(self, data=None, code=200, message=None):
+        """Send a bw serve JSON response"""
+        if message is None:
+            body = {"success": True}
+            if data is not None:
+                body["data"] = data
+        else:
+            body = {"success": False, "message": message}
+        out = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def _handle(self):
+        """Answer one request"""
+        time.sleep(self.server.latency)
+        url = urlsplit(self.path)
+        # Padded so endpoints can be matched by position
+        parts = url.path.strip("/").split("/") + ["", ""]
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        vault = self.server.vault
+        method = self.command
+        with vault.lock:
+            if parts[0] == "status":
+                return self._reply(
+                    {"object": "template", "template": status(SESSION)}
+                )
+            if parts[0] in ("unlock", "login") and method == "POST":
+                return self._reply({"raw": SESSION})
+            if parts[0] in ("lock", "logout", "sync", "config"):
+                return self._reply({"title": f"{parts[0]} done"})
+            if parts[:2] == ["list", "object"] and parts[2] in LISTS:
+                objs = vault.list(parts[2], query.get("organizationId"))
+                return self._reply({"object": "list", "data": objs})
+            if parts[0] == "move":
+                res = vault.move(parts[1], parts[2], body or [])
+            elif parts[0] == "object" and parts[1] in _KINDS:
+                res = self._object(vault, parts, body, query)
+            else:
+                return self._reply(code=404, message="Not found.")
+        if res is None:
+            return self._reply(code=404, message="Not found.")
+        return self._reply(None if res is True else res)
+
+    def _object(self, vault, parts, body, query):
+        """Create, edit or delete an item, folder or org-collection"""
+        kind = parts[1]
+        if self.command == "POST" and not parts[2]:
+            return vault.create(kind, body or {}, query.get("organizationId"))
+        if self.command == "PUT" and parts[2]:
+            return vault.edit(kind, parts[2], body or {})
+        if self.command == "DELETE" and parts[2]:
+            return vault.delete(kind, parts[2]) or None
+        return None
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class Server:  # pylint: disable=too-few-public-methods
+    """State shared by the request handlers"""
+
+    def __init__(self, vault):
+        self.vault = vault
+        self.latency = float(os.environ.get("FAKEBW_LATENCY", "0"))
+
+
+def serve(hostname, vault):
+    """Answer bw serve requests until the client disconnects (fd+connected)
+    or the process is killed (fd+listening)
+
+    Args: hostname - fd+connected://<fd> or fd+listening://<fd>
+          vault - FakeVault
+
+    """
+    scheme, _, fd = hostname.partition("://")
+    sock = socket.socket(fileno=int(fd))
+    server = Server(vault)
+    if scheme == "fd+connected":
+        Handler(sock, "bwm", server)
+        return
+    while True:
+        conn, _ = sock.accept()
+        Thread(target=Handler, args=(conn, "bwm", server), daemon=True).start()
+
+
+def main():
+    """bw executable entry point"""
+    time.sleep(float(os.environ.get("FAKEBW_STARTUP", "0")))
+    sys.exit(cli(sys.argv[1:], sys.stdin, sys.stdout, sys.stderr))
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: set et ts=4 sw=4 :
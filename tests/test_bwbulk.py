@@ -0,0 +1,243 @@
+"""Tests for bulk operations on several entries."""
+
+from copy import deepcopy
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from bwm import bwbulk
+from bwm import bwm as bwm_main
+from bwm.bwedit import collection_update
+
+
+@pytest.fixture
+def vault(tmp_path, sample_login_entry, sample_card_entry, sample_folders):
+    """Loaded vault using a bw serve connection pool of 4"""
+    with patch("bwm.DATA_HOME", str(tmp_path)):
+        vault = bwm_main.Vault("https://a.example.com", "me@a.com", "", "")
+    vault.entries = [deepcopy(sample_login_entry), deepcopy(sample_card_entry)]
+    for num in range(3):
+        entry = deepcopy(sample_login_entry)
+        entry["id"] = f"login-{num}"
+        entry["name"] = f"Login {num}"
+        vault.entries.append(entry)
+    vault.folders = deepcopy(sample_folders)
+    vault.index.rebuild(vault.entries, vault.folders)
+    vault.bwcliserver = MagicMock(size=4)
+    vault.bwcliserver.is_ready.return_value = True
+    return vault
+
+
+class TestPlan:
+    """Tests for planning bulk changes."""
+
+    def test_folder(self, vault, sample_folders):
+        """Test entries already in the folder are skipped"""
+        vault.entries[2]["folderId"] = "folder-id-2"
+        changes = bwbulk.plan_folder(
+            vault.entries, sample_folders["folder-id-2"]
+        )
+        assert len(changes) == 4
+        assert all(i.item["folderId"] == "folder-id-2" for i in changes)
+        # Entries are not changed until saved
+        assert vault.entries[0]["folderId"] == "folder-id-1"
+
+    def test_collections(self, vault, sample_collections):
+        """Test the collection update of each entry"""
+        vault.entries[1]["collectionIds"] = ["coll-id-2"]
+        vault.entries[2]["collectionIds"] = ["coll-id-1"]
+        colls = {"coll-id-1": sample_collections["coll-id-1"]}
+        changes = bwbulk.plan_collections(vault.entries, colls)
+        updates = {i.entry["id"]: i.update_coll for i in changes}
+        assert updates == {
+            "test-id-123": "MOVE",
+            "card-id-456": "YES",
+            "login-1": "MOVE",
+            "login-2": "MOVE",
+        }
+        assert changes[0].item["organizationId"] == "org-id-1"
+
+    def test_remove_collections(self, vault):
+        """Test an empty selection moves entries to the personal vault"""
+        vault.entries[0]["collectionIds"] = ["coll-id-1"]
+        changes = bwbulk.plan_collections(vault.entries, {})
+        assert [(i.entry["id"], i.update_coll) for i in changes] == [
+            ("test-id-123", "REMOVE")
+        ]
+
+    def test_collection_update(self):
+        """Test the collection change kinds"""
+        assert collection_update([], []) is None
+        assert collection_update(["a"], ["a"]) is None
+        assert collection_update([], ["a"]) == "MOVE"
+        assert collection_update(["a"], ["b"]) == "YES"
+        assert collection_update(["a"], []) == "REMOVE"
+
+
+class TestRunBulk:
+    """Tests for the bulk executor."""
+
+    def test_concurrent(self, vault, sample_folders):
+        """Test changes run concurrently over the connection pool"""
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def edit(entry):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            return entry
+
+        vault.bwcliserver.edit_entry.side_effect = edit
+        changes = bwbulk.plan_folder(
+            vault.entries, sample_folders["folder-id-2"]
+        )
+        progress = []
+        result = bwbulk.run_bulk(
+            changes, vault, lambda *args: progress.append(args)
+        )
+        assert len(result.done) == 5
+        assert not result.failed
+        assert peak[0] > 1
+        assert progress[-1] == (5, 5, 0)
+
+    def test_failures(self, vault):
+        """Test failed changes are collected without stopping the others"""
+
+        def delete(entry):
+            if entry["id"] == "login-0":
+                return False
+            if entry["id"] == "login-1":
+                raise OSError("gone")
+            return entry
+
+        vault.bwcliserver.delete_entry.side_effect = delete
+        result = bwbulk.run_bulk(bwbulk.plan_delete(vault.entries), vault)
+        assert len(result.done) == 3
+        assert sorted((i.entry["id"], j) for i, j in result.failed) == [
+            ("login-0", "Check logs"),
+            ("login-1", "gone"),
+        ]
+
+    def test_cli_serial(self, vault, sample_folders):
+        """Test the CLI is never run concurrently"""
+        vault.bwcliserver = None
+        active, peak = [0], [0]
+
+        def edit(entry, *_args, **_kwargs):
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            active[0] -= 1
+            return entry
+
+        changes = bwbulk.plan_folder(
+            vault.entries, sample_folders["folder-id-2"]
+        )
+        with patch("bwm.bwedit.bwcli.edit_entry", side_effect=edit):
+            result = bwbulk.run_bulk(changes, vault)
+        assert len(result.done) == 5
+        assert peak[0] == 1
+
+
+class TestBulkEdit:
+    """Tests for the bulk edit menu."""
+
+    @patch("bwm.bwbulk.notify")
+    @patch("bwm.bwbulk.dmenu_err")
+    @patch("bwm.bwbulk.dmenu_select")
+    def test_progress(self, mock_select, mock_err, mock_notify, vault):
+        """Test progress and the summary are shown to the user"""
+        mock_select.side_effect = [
+            "\n".join(f"{i}(l)" for i in range(5)),
+            "Delete entries",
+            "Yes - confirm delete",
+        ]
+
+        def delete(entry):
+            return False if entry["id"] == "login-0" else entry
+
+        vault.bwcliserver.delete_entry.side_effect = delete
+        with patch("bwm.bwbulk.PROGRESS_STEP", 2):
+            result = bwbulk.bulk_edit(vault.entries, vault.folders, {}, vault)
+        assert len(result.done) == 4
+        messages = [i[0][0] for i in mock_notify.call_args_list]
+        assert messages[0] == "Bulk edit: changing 5 entries"
+        # The failed count depends on the order the changes complete
+        assert [i.split(",")[0] for i in messages[1:]] == [
+            "Bulk edit: 2/5 done",
+            "Bulk edit: 4/5 done",
+        ]
+        assert mock_err.call_args[0][0].startswith(
+            "Bulk edit: 4 of 5 entries changed, 1 failed:\nLogin 0: "
+        )
+
+    @patch("bwm.bwbulk.notify")
+    @patch("bwm.bwbulk.dmenu_err")
+    @patch("bwm.bwbulk.dmenu_select")
+    def test_summary(self, mock_select, mock_err, mock_notify, vault):
+        """Test the summary of a bulk edit without failures"""
+        mock_select.side_effect = [
+            "0(l)",
+            "Delete entries",
+            "Yes - confirm delete",
+        ]
+        vault.bwcliserver.delete_entry.side_effect = lambda entry: entry
+        bwbulk.bulk_edit(vault.entries, vault.folders, {}, vault)
+        mock_err.assert_not_called()
+        assert mock_notify.call_args[0][0] == (
+            "Bulk edit: 1 of 1 entries changed, 0 failed"
+        )
+
+
+class TestUpdateVault:
+    """Tests for applying the results to the loaded vault."""
+
+    def test_update(self, vault, sample_folders):
+        """Test saved entries are replaced and deleted ones removed"""
+        entries = vault.entries
+        moved = bwbulk.plan_folder(entries[:2], sample_folders["folder-id-3"])
+        result = bwbulk.BulkResult(
+            done=[(i, i.item) for i in moved]
+            + [(i, i.entry) for i in bwbulk.plan_delete(entries[2:3])],
+            failed=[(bwbulk.plan_delete(entries[3:4])[0], "Check logs")],
+        )
+        assert bwbulk.update_vault(vault, result) == 3
+        # Updated in place
+        assert vault.entries is entries
+        assert [i["id"] for i in vault.entries] == [
+            "test-id-123",
+            "card-id-456",
+            "login-1",
+            "login-2",
+        ]
+        assert vault.entries[0]["folderId"] == "folder-id-3"
+        assert [i["id"] for i in vault.index.find("login 0")] == []
+        assert [i["id"] for i in vault.index.find("folder:work/projects")] == [
+            "test-id-123",
+            "card-id-456",
+        ]
+
+
+class TestSelectEntries:
+    """Tests for multi-selecting entries."""
+
+    @patch("bwm.bwbulk.dmenu_select")
+    def test_multi_select(self, mock_select, vault):
+        """Test each selected line is parsed"""
+        mock_select.return_value = "2(l) - a\n0(l) - b\nFoo\n2(l) - a\n9(l)"
+        selected = bwbulk.select_entries(vault.entries, vault.folders)
+        assert [i["id"] for i in selected] == ["login-0", "test-id-123"]
+
+    @patch("bwm.bwbulk.dmenu_select", return_value="")
+    def test_none(self, _mock_select, vault):
+        """Test an empty selection"""
+        assert bwbulk.select_entries(vault.entries, vault.folders) == []
+
+
+# vim: set et ts=4 sw=4 :
@@ -2,12 +2,13 @@
 
 import json
 from unittest.mock import patch, MagicMock
-from subprocess import CompletedProcess
+from subprocess import CompletedProcess, TimeoutExpired
 
 import pytest
 
 from bwm.bwcli import (
     Item,
+    timeout,
     status,
     login,
     unlock,
@@ -140,6 +141,16 @@ class TestLogin:
         assert session == b"session-key-12345"
         assert error is None
 
+    @patch("bwm.bwcli.run")
+    def test_login_env(self, mock_run):
+        """Test the vault environment is passed to bw."""
+        mock_run.return_value = CompletedProcess(
+            args=[], returncode=0, stdout=b"session-key-12345", stderr=b""
+        )
+        env = {"BITWARDENCLI_APPDATA_DIR": "/tmp/vault"}
+        login("email@example.com", "password123", env=env)
+        assert mock_run.call_args[1]["env"] is env
+
     @patch("bwm.bwcli.run")
     def test_login_failure(self, mock_run):
         """Test failed login returns False and error."""
@@ -404,3 +415,41 @@ class TestGetOrgs:
         )
         result = get_orgs(b"session-key")
         assert result == {}
+
+
+class TestTimeouts:
+    """Tests for bw command time budgets."""
+
+    @patch("bwm.bwcli.run")
+    def test_budget(self, mock_run):
+        """Test each command gets the budget for its operation"""
+        mock_run.return_value = CompletedProcess(
+            args=[], returncode=0, stdout=b"{}"
+        )
+        with patch.dict("bwm.TIMEOUTS", {"sync": 300.0, "list": 5.0}):
+            sync(b"session-key")
+            assert mock_run.call_args[1]["timeout"] == 300.0
+            get_folders(b"session-key")
+            assert mock_run.call_args[1]["timeout"] == 5.0
+
+    def test_no_limit(self):
+        """Test 0 disables the limit and unknown operations use default"""
+        with patch.dict("bwm.TIMEOUTS", {"unlock": 0, "default": 7.0}):
+            assert timeout("unlock") is None
+            assert timeout("other") == 7.0
+
+    @patch("bwm.bwcli.run")
+    def test_unlock_timeout(self, mock_run):
+        """Test a hung unlock returns the timeout as the error"""
+        mock_run.side_effect = TimeoutExpired(["bw"], 60)
+        with patch.dict("bwm.TIMEOUTS", {"unlock": 60.0}):
+            assert unlock("password") == (
+                False,
+                b"bw unlock timed out after 60.0s",
+            )
+
+    @patch("bwm.bwcli.run")
+    def test_list_timeout(self, mock_run):
+        """Test a hung list command returns False"""
+        mock_run.side_effect = TimeoutExpired(["bw"], 60)
+        assert get_orgs(b"session-key") is False
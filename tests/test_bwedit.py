@@ -5,7 +5,13 @@ from unittest.mock import patch, MagicMock
 
 import pytest
 
-from bwm.bwedit import gen_passwd, get_password_chars, obj_name
+from bwm.bwedit import (
+    gen_passwd,
+    get_password_chars,
+    obj_name,
+    read_backend,
+    serve_ready,
+)
 
 
 class TestGenPasswd:
@@ -238,3 +244,34 @@ class TestPasswordStrength:
         assert password is not False
         assert len(password) == 1
         assert password in "abc"
+
+
+class TestReadBackend:
+    """Tests for falling back from bw serve to the CLI."""
+
+    def test_no_server(self):
+        """Test the CLI is used without bw serve"""
+        vault = MagicMock(bwcliserver=None)
+        assert serve_ready(vault) is False
+        assert read_backend(vault, lambda s: "serve", lambda: "cli") == "cli"
+
+    def test_server_ready(self):
+        """Test bw serve is used, including for errors it returns"""
+        vault = MagicMock()
+        vault.bwcliserver.is_ready.return_value = True
+        assert read_backend(vault, lambda s: False, lambda: "cli") is False
+
+    def test_server_restarting(self):
+        """Test the CLI is used while bw serve restarts"""
+        vault = MagicMock()
+        vault.bwcliserver.is_ready.return_value = False
+        serve = MagicMock()
+        assert read_backend(vault, serve, lambda: "cli") == "cli"
+        serve.assert_not_called()
+
+    def test_server_timed_out(self):
+        """Test a request is retried with the CLI if bw serve stops
+        responding during it"""
+        vault = MagicMock()
+        vault.bwcliserver.is_ready.side_effect = [True, False]
+        assert read_backend(vault, lambda s: False, lambda: "cli") == "cli"
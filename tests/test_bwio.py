@@ -0,0 +1,233 @@
+"""Tests for streaming import and export."""
+
+from copy import deepcopy
+import io
+import json
+import os
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from bwm import bwio
+from bwm import bwm as bwm_main
+
+
+@pytest.fixture
+def vault(tmp_path, sample_login_entry, sample_card_entry, sample_folders):
+    """Loaded vault using a bw serve connection pool of 2"""
+    with patch("bwm.DATA_HOME", str(tmp_path)):
+        vault = bwm_main.Vault("https://a.example.com", "me@a.com", "", "")
+        vault.entries = [
+            deepcopy(sample_login_entry),
+            deepcopy(sample_card_entry),
+        ]
+        vault.folders = deepcopy(sample_folders)
+        vault.bwcliserver = MagicMock(size=2)
+        vault.bwcliserver.is_ready.return_value = True
+        created = []
+
+        def add_entry(item):
+            created.append(item)
+            return dict(item, id=f"new-{len(created)}")
+
+        def add_folder(name):
+            return {"id": f"folder-{name}", "name": name}
+
+        vault.bwcliserver.add_entry.side_effect = add_entry
+        vault.bwcliserver.add_folder.side_effect = add_folder
+        vault.created = created
+        yield vault
+
+
+def export_file(tmp_path, count):
+    """Write a JSON export with count logins, half of them in a folder"""
+    path = tmp_path / "export.json"
+    items = [
+        {
+            "id": f"old-{i}",
+            "folderId": "f1" if i % 2 else None,
+            "type": 1,
+            "name": f"Login {i}",
+            "revisionDate": "2024-01-01T00:00:00.000Z",
+            "login": {"username": f"user{i}", "password": "pw", "uris": []},
+        }
+        for i in range(count)
+    ]
+    data = {
+        "encrypted": False,
+        "folders": [{"id": "f1", "name": "Imported"}],
+        "items": items,
+    }
+    path.write_text(json.dumps(data, indent=2))
+    return path
+
+
+class TestExport:
+    """Tests for exporting the vault."""
+
+    def test_json(self, vault, tmp_path):
+        """Test a JSON export can be read back"""
+        path = tmp_path / "out.json"
+        res = bwio.export_items(vault.entries, vault.folders, str(path))
+        assert res.done == 2
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        data = json.loads(path.read_text())
+        assert {i["name"] for i in data["folders"]} == {
+            "Personal",
+            "Work",
+            "Work/Projects",
+        }
+        assert [i["name"] for i in data["items"]] == ["Test Login", "Test Card"]
+        # The empty autotype field bwm adds isn't exported
+        assert data["items"][1]["fields"] == []
+        with open(path, encoding="utf-8") as fin:
+            items = list(bwio.read_items(fin, "json"))
+        assert [(i, j["name"]) for i, j in items] == [
+            ("Personal", "Test Login"),
+            ("Personal", "Test Card"),
+        ]
+
+    def test_csv(self, vault, tmp_path):
+        """Test CSV exports logins and notes only"""
+        path = tmp_path / "out.csv"
+        res = bwio.export_items(vault.entries, vault.folders, str(path))
+        assert (res.done, res.skipped) == (1, 1)
+        with open(path, encoding="utf-8", newline="") as fin:
+            items = list(bwio.read_items(fin, "csv"))
+        folder, item = items[0]
+        assert folder == "Personal"
+        assert item["login"]["username"] == "testuser"
+        assert item["login"]["uris"][0]["uri"] == "https://example.com"
+        assert item["fields"] == [
+            {
+                "name": "autotype",
+                "value": "{USERNAME}{TAB}{PASSWORD}{ENTER}",
+                "type": 0,
+            }
+        ]
+
+
+class TestIterJSON:
+    """Tests for the streaming JSON parser."""
+
+    @pytest.mark.parametrize("chunk", [1, 3, 7, 65536])
+    def test_chunks(self, chunk):
+        """Test values split across chunks"""
+        data = {
+            "encrypted": False,
+            "count": 12345,
+            "folders": [],
+            "items": [{"name": 'a"}, b', "n": 1.5}, {"x": [1, 2]}, 123456],
+        }
+        res = list(bwio.iter_json(io.StringIO(json.dumps(data)), chunk))
+        assert res == [
+            ("encrypted", False),
+            ("count", 12345),
+            ("items", {"name": 'a"}, b', "n": 1.5}),
+            ("items", {"x": [1, 2]}),
+            ("items", 123456),
+        ]
+
+    def test_encrypted(self):
+        """Test encrypted exports are refused"""
+        fin = io.StringIO('{"encrypted": true, "items": []}')
+        with pytest.raises(ValueError):
+            list(bwio.read_items(fin, "json"))
+
+    def test_malformed(self):
+        """Test truncated files raise ValueError"""
+        fin = io.StringIO('{"items": [{"name": "a"}, {"na')
+        with pytest.raises(ValueError):
+            list(bwio.iter_json(fin))
+
+
+class TestImport:
+    """Tests for importing an export file."""
+
+    def test_import(self, vault, tmp_path):
+        """Test items are created with their folders"""
+        path = export_file(tmp_path, 5)
+        with patch("bwm.DATA_HOME", str(tmp_path)):
+            res = bwio.import_items(vault, str(path))
+        assert (res.done, res.skipped, res.failed) == (5, 0, [])
+        assert vault.bwcliserver.add_folder.call_count == 1
+        assert "folder-Imported" in vault.folders
+        items = sorted(vault.created, key=lambda i: i["name"])
+        assert [i["folderId"] for i in items] == [
+            None,
+            "folder-Imported",
+            None,
+            "folder-Imported",
+            None,
+        ]
+        assert "id" not in items[0]
+        assert "revisionDate" not in items[0]
+        assert not list(tmp_path.glob("import-*.json"))
+
+    def test_resume(self, vault, tmp_path):
+        """Test a second run only creates the items that failed"""
+        path = export_file(tmp_path, 250)
+        add_entry = vault.bwcliserver.add_entry.side_effect
+
+        def flaky(item):
+            if item["name"] in ("Login 3", "Login 200"):
+                return False
+            return add_entry(item)
+
+        vault.bwcliserver.add_entry.side_effect = flaky
+        with patch("bwm.DATA_HOME", str(tmp_path)):
+            res = bwio.import_items(vault, str(path))
+            assert res.done == 248
+            assert sorted(res.failed) == [(3, "Login 3"), (200, "Login 200")]
+            assert len(list(tmp_path.glob("import-*.json"))) == 1
+            vault.created.clear()
+            vault.bwcliserver.add_entry.side_effect = add_entry
+            res = bwio.import_items(vault, str(path))
+        assert (res.done, res.skipped, res.failed) == (2, 248, [])
+        assert sorted(i["name"] for i in vault.created) == [
+            "Login 200",
+            "Login 3",
+        ]
+        assert not list(tmp_path.glob("import-*.json"))
+
+    def test_changed_file(self, vault, tmp_path):
+        """Test a checkpoint for a different version of the file is ignored"""
+        path = export_file(tmp_path, 3)
+        with patch("bwm.DATA_HOME", str(tmp_path)):
+            checkpoint = bwio.Checkpoint(vault, str(path))
+            checkpoint.mark(0)
+            checkpoint.save()
+            assert 0 in bwio.Checkpoint(vault, str(path))
+            export_file(tmp_path, 4)
+            assert 0 not in bwio.Checkpoint(vault, str(path))
+
+    def test_bounded(self, vault, tmp_path):
+        """Test requests in flight are limited to the pool size"""
+        path = export_file(tmp_path, 40)
+        add_entry = vault.bwcliserver.add_entry.side_effect
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def slow(item):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.005)
+            with lock:
+                active[0] -= 1
+            return add_entry(item)
+
+        vault.bwcliserver.add_entry.side_effect = slow
+        progress = []
+        with patch("bwm.DATA_HOME", str(tmp_path)):
+            res = bwio.import_items(
+                vault, str(path), lambda i: progress.append(i.done)
+            )
+        assert res.done == 40
+        assert peak[0] == 2
+        assert progress[-1] == 40
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,575 @@
+"""Tests for vault setup in the main module."""
+
+from concurrent.futures import Future
+import configparser
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from bwm import bwm as bwm_main
+
+
+@pytest.fixture
+def data_home(tmp_path):
+    """Use a temporary data directory for vault CLI data"""
+    with patch("bwm.DATA_HOME", str(tmp_path)):
+        yield tmp_path
+
+
+def make_vault(url, passw="pw"):
+    """Vault without bw serve"""
+    vault = bwm_main.Vault(url, "me@example.com", passw, "")
+    vault.use_serve = False
+    return vault
+
+
+class TestVaultEnv:
+    """Tests for per vault environments."""
+
+    def test_vault_env(self, data_home):
+        """Test each vault gets its own data directory"""
+        vault_a = make_vault("https://a.example.com")
+        vault_b = make_vault("https://b.example.com:8443")
+        assert vault_a.env["BITWARDENCLI_APPDATA_DIR"] == str(
+            data_home / "a.example.com"
+        )
+        assert vault_b.env["BITWARDENCLI_APPDATA_DIR"] == str(
+            data_home / "b.example.com:8443"
+        )
+        assert vault_a.env["PATH"] == bwm_main.environ["PATH"]
+
+    def test_set_vault_login(self, data_home):
+        """Test login uses the vault env and BW_CLIENTSECRET is only passed
+        to the login process"""
+        vault = make_vault("https://a.example.com")
+        with (
+            patch.dict(bwm_main.environ, {}),
+            patch.object(bwm_main, "bwcli") as bwcli,
+            patch.object(bwm_main, "get_passphrase", return_value="secret"),
+        ):
+            bwcli.status.return_value = {
+                "status": "unauthenticated",
+                "serverUrl": "https://a.example.com",
+            }
+            bwcli.login.return_value = (b"sess", None)
+            environ = dict(bwm_main.environ)
+            assert bwm_main.set_vault([vault]) == [vault]
+            assert bwm_main.environ == environ
+        assert (data_home / "a.example.com").is_dir()
+        assert bwcli.status.call_args[1]["env"] is vault.env
+        assert bwcli.sync.call_args[1]["env"] is vault.env
+        login_env = bwcli.login.call_args[1]["env"]
+        assert login_env["BW_CLIENTSECRET"] == "secret"
+        assert login_env["BITWARDENCLI_APPDATA_DIR"] == str(
+            data_home / "a.example.com"
+        )
+        assert "BW_CLIENTSECRET" not in vault.env
+        assert vault.session == b"sess"
+
+
+class TestPreloadVaults:
+    """Tests for concurrent vault preloading."""
+
+    @pytest.fixture
+    def bwcli(self):
+        """Mock bwcli with one locked, one unlocked and one logged out vault"""
+        statuses = {
+            "a.example.com": {"status": "locked"},
+            "b.example.com": {"status": "unlocked", "session": b"sess-b"},
+            "c.example.com": {"status": "unauthenticated"},
+        }
+
+        def status(env=None):
+            return statuses[env["BITWARDENCLI_APPDATA_DIR"].rsplit("/", 1)[1]]
+
+        with patch.object(bwm_main, "bwcli") as mock:
+            mock.status.side_effect = status
+            mock.unlock.return_value = (b"sess-a", None)
+            mock.get_entries.side_effect = lambda session, env=None: (
+                [{"id": session.decode()}],
+                {"f": {"id": "f", "name": "No Folder"}},
+                {},
+                {},
+            )
+            yield mock
+
+    def test_preload(self, data_home, bwcli):
+        """Test locked and unlocked vaults are loaded with their own env"""
+        vaults = [
+            make_vault(f"https://{i}.example.com") for i in ("a", "b", "c")
+        ]
+        loaded = bwm_main.preload_vaults(vaults)
+        assert loaded == vaults[:2]
+        assert vaults[0].entries == [{"id": "sess-a"}]
+        assert vaults[1].entries == [{"id": "sess-b"}]
+        assert not vaults[2].folders
+        assert len(vaults[0].index) == 1
+        env = bwcli.unlock.call_args[1]["env"]
+        assert env["BITWARDENCLI_APPDATA_DIR"] == str(
+            data_home / "a.example.com"
+        )
+        for call in bwcli.get_entries.call_args_list:
+            assert call[1]["env"]["BITWARDENCLI_APPDATA_DIR"].endswith(
+                call[0][0].decode()[-1] + ".example.com"
+            )
+
+    def test_preload_asks_password(self, data_home, bwcli):
+        """Test a locked vault without a configured password is prompted for"""
+        vault = make_vault("https://a.example.com", passw="")
+        with patch.object(
+            bwm_main, "get_passphrase", return_value="typed"
+        ) as mock_pass:
+            assert bwm_main.preload_vaults([vault]) == [vault]
+        mock_pass.assert_called_once()
+        assert bwcli.unlock.call_args[0][0] == "typed"
+
+    def test_preload_unlock_failure(self, data_home, bwcli):
+        """Test a failed unlock leaves the vault to be opened on demand"""
+        bwcli.unlock.return_value = (False, "Invalid master password.")
+        vault = make_vault("https://a.example.com")
+        assert bwm_main.preload_vaults([vault]) == []
+        assert vault.session == b""
+        assert vault.passw == ""
+
+    def test_preload_skips_loaded(self, data_home, bwcli):
+        """Test already loaded vaults are not reloaded"""
+        vault = make_vault("https://a.example.com")
+        vault.session = b"sess"
+        vault.folders = {"f": {}}
+        assert bwm_main.preload_vaults([vault]) == []
+        bwcli.status.assert_not_called()
+
+    def test_preload_serve(self, data_home, bwcli):
+        """Test bw serve is started with the vault environment"""
+        vault = make_vault("https://b.example.com")
+        vault.use_serve = True
+        with patch.object(bwm_main, "BWCLIServer") as mock_server:
+            server = mock_server.return_value
+            server.start.return_value = True
+            server.unlock.return_value = ("sess-b", "")
+            server.get_entries.return_value = ([], {}, {}, {})
+            assert bwm_main.preload_vaults([vault]) == [vault]
+        assert mock_server.call_args[1]["env"][
+            "BITWARDENCLI_APPDATA_DIR"
+        ] == str(data_home / "b.example.com")
+        server.start.assert_called_once_with(session=b"sess-b")
+        server.unlock.assert_called_once_with("pw")
+
+    def test_start_serve_retry(self, data_home):
+        """Test a failed bw serve start is retried with backoff"""
+        vault = make_vault("https://a.example.com")
+        vault.use_serve = True
+        vault.session = b"sess"
+        with (
+            patch.object(bwm_main, "BWCLIServer") as mock_server,
+            patch.object(bwm_main.time, "monotonic", return_value=1000.0),
+        ):
+            mock_server.return_value.start.return_value = False
+            assert bwm_main.start_serve(vault) is False
+            assert vault.serve_retry == 1000.0 + bwm_main.SERVE_RETRY_MIN
+            # Not retried before the backoff expires
+            assert bwm_main.start_serve(vault) is False
+            assert mock_server.call_count == 1
+            vault.serve_retry = 0.0
+            assert bwm_main.start_serve(vault) is False
+            assert vault.serve_retry == 1000.0 + bwm_main.SERVE_RETRY_MIN * 2
+            vault.serve_retry = 0.0
+            mock_server.return_value.start.return_value = True
+            mock_server.return_value.unlock.return_value = ("sess", "")
+            assert bwm_main.start_serve(vault) is True
+        assert vault.bwcliserver is mock_server.return_value
+        assert vault.serve_failures == 0
+        assert vault.use_serve is True
+
+    def test_start_serve_pool(self, data_home):
+        """Test serve_connections selects the connection pool"""
+        vault = make_vault("https://a.example.com")
+        vault.use_serve = True
+        vault.session = b"sess"
+        conf = configparser.ConfigParser()
+        conf.read_dict({"vault": {"serve_connections": "4"}})
+        with (
+            patch("bwm.CONF", conf),
+            patch.object(bwm_main, "BWServePool") as mock_pool,
+        ):
+            mock_pool.return_value.start.return_value = True
+            mock_pool.return_value.unlock.return_value = ("sess", "")
+            assert bwm_main.start_serve(vault) is True
+        mock_pool.assert_called_once_with(env=vault.env, size=4)
+        assert vault.bwcliserver is mock_pool.return_value
+
+    def test_preload_no_wait(self, data_home, bwcli):
+        """Test loading continues in the background"""
+        vaults = [make_vault(f"https://{i}.example.com") for i in ("a", "b")]
+        assert bwm_main.preload_vaults(vaults, wait=False) == []
+        assert [i.loading.result() for i in vaults] == [True, True]
+        assert vaults[1].entries == [{"id": "sess-b"}]
+        # Already loading vaults are skipped
+        assert bwm_main.preload_vaults(vaults) == []
+
+    def test_set_vault_preloaded(self, data_home, bwcli):
+        """Test switching to a preloaded vault doesn't unlock it again"""
+        vault = make_vault("https://a.example.com")
+        vault.session = b"sess"
+        vault.folders = {"f": {}}
+        assert bwm_main.set_vault([vault]) == [vault]
+        bwcli.status.assert_not_called()
+
+
+@pytest.fixture
+def merged_conf():
+    """Config with the merged view enabled"""
+    conf = configparser.ConfigParser()
+    conf.read_dict({"vault": {"merged_view": "True"}})
+    with patch("bwm.CONF", conf):
+        yield conf
+
+
+@pytest.fixture
+def merged_vaults(
+    data_home, sample_login_entry, sample_card_entry, sample_folders
+):
+    """Two loaded vaults"""
+    vaults = []
+    for url in ("https://a.example.com", "https://b.example.com"):
+        vault = make_vault(url)
+        vault.entries = [dict(sample_login_entry), dict(sample_card_entry)]
+        vault.folders = {k: dict(v) for k, v in sample_folders.items()}
+        vault.index.rebuild(vault.entries, vault.folders)
+        vaults.append(vault)
+    for vault in vaults:
+        vault.entries[1]["folderId"] = "folder-id-2"
+    vaults[1].entries[0]["name"] = "Other Login"
+    return vaults
+
+
+class TestMergedView:
+    """Tests for the cross vault main menu."""
+
+    def test_vault_tags(self):
+        """Test tags are the host, with the login for shared hosts"""
+        vaults = [
+            bwm_main.Vault("https://a.example.com", "me@a.com", "", ""),
+            bwm_main.Vault("https://vault.bitwarden.com", "x@y.com", "", ""),
+            bwm_main.Vault("https://vault.bitwarden.com", "z@y.com", "", ""),
+        ]
+        assert bwm_main.vault_tags(vaults) == [
+            "a.example.com",
+            "x@y.com@vault.bitwarden.com",
+            "z@y.com@vault.bitwarden.com",
+        ]
+
+    def test_vault_listing_cache(self, merged_conf, merged_vaults):
+        """Test rows are tagged, cached and rebuilt after changes"""
+        vault = merged_vaults[0]
+        listing = bwm_main.vault_listing(vault, "a")
+        rows = listing.split("\n")
+        assert rows[0].startswith("[a] 0(l) - ")
+        assert rows[1].startswith("[a] 1(c) - ")
+        assert bwm_main.vault_listing(vault, "a") is listing
+        new = dict(vault.entries[0], id="new-id", name="New")
+        vault.entries.append(new)
+        vault.index.add(new)
+        assert (
+            bwm_main.vault_listing(vault, "a")
+            .split("\n")[2]
+            .startswith("[a] 2(l) - ")
+        )
+
+    def test_menu_rows_cache(self, merged_vaults):
+        """Test encoded main menu rows are cached until the vault changes"""
+        vault = merged_vaults[0]
+        rows = bwm_main.menu_rows(vault, vault.entries)
+        assert rows.decode().split("\n")[1].startswith("1(c) - Work/")
+        assert bwm_main.menu_rows(vault, vault.entries) is rows
+        vault.folders["folder-id-2"]["name"] = "Job"
+        vault.folders_rev += 1
+        rows = bwm_main.menu_rows(vault, vault.entries)
+        assert rows.decode().split("\n")[1].startswith("1(c) - Job/")
+        vault.entries[0]["name"] = "Renamed"
+        vault.index.update(vault.entries[0], vault.entries[0])
+        assert b"Renamed" in bwm_main.menu_rows(vault, vault.entries)
+
+    def test_stream_menu_rows(self, merged_vaults):
+        """Test the most used entries are streamed first and rows cached"""
+        vault = merged_vaults[0]
+        vault.frecency.visit(vault.entries[1]["id"])
+        vault.frecency.visit("deleted-id")
+        chunks = list(bwm_main.stream_menu_rows(vault, vault.entries))
+        text = b"".join(bytes(j) for i in chunks for j in i).decode()
+        assert [i[:4] for i in text.split("\n")] == ["1(c)", "0(l)", ""]
+        assert vault.rows[1] == bwm_main.encode_rows(
+            vault.entries, vault.folders
+        )
+        # Cached rows are sliced
+        chunks = list(bwm_main.stream_menu_rows(vault, vault.entries))
+        assert isinstance(chunks[1][0], memoryview)
+
+    def test_vault_listing_hidden(self, merged_conf, merged_vaults):
+        """Test entries in hidden folders are left out but numbering is kept"""
+        vault = merged_vaults[0]
+        merged_conf.set("vault", "hide_folders", "Personal")
+        rows = bwm_main.vault_listing(vault, "a").split("\n")
+        assert len(rows) == 1
+        assert rows[0].startswith("[a] 1(c) - ")
+
+    def test_shown_entries(self, merged_conf, merged_vaults):
+        """Test hidden folders (with subfolders) and collections are resolved
+        to ids once and their entries left out"""
+        vault = merged_vaults[0]
+        vault.collections = {"coll-1": {"id": "coll-1", "name": "Shared"}}
+        assert bwm_main.shown_entries(vault) is vault.entries
+        merged_conf.set("vault", "hide_folders", "Work\nMissing")
+        vault.entries[1]["folderId"] = "folder-id-3"
+        assert bwm_main.hidden_ids(vault) == (
+            {"folder-id-2", "folder-id-3"},
+            set(),
+        )
+        shown = bwm_main.shown_entries(vault)
+        assert shown == [vault.entries[0]]
+        assert bwm_main.shown_entries(vault) is shown
+        merged_conf.set("vault", "hide_folders", "")
+        merged_conf.set("vault", "hide_collections", "Shared")
+        vault.entries[0]["collectionIds"] = ["coll-1"]
+        vault.index.update(vault.entries[0], vault.entries[0])
+        assert bwm_main.shown_entries(vault) == [vault.entries[1]]
+
+    def test_hidden_ids_cache(self, merged_conf, merged_vaults):
+        """Test hidden ids are cached without reading the folders until the
+        configured names or the folders change"""
+        vault = merged_vaults[0]
+        merged_conf.set("vault", "hide_folders", "Personal")
+        hidden = bwm_main.hidden_ids(vault)
+        assert hidden == ({"folder-id-1"}, set())
+        folders = vault.folders
+        vault.folders = MagicMock(wraps=folders)
+        assert bwm_main.hidden_ids(vault) == hidden
+        vault.folders.items.assert_not_called()
+        vault.folders = folders
+        vault.folders["folder-id-1"]["name"] = "Home"
+        with patch.object(bwm_main, "manage_folders"):
+            bwm_main.dmenu_folders(vault.folders, vault)
+        assert bwm_main.hidden_ids(vault) == (frozenset(), frozenset())
+        merged_conf.set("vault", "hide_folders", "Home")
+        assert bwm_main.hidden_ids(vault) == ({"folder-id-1"}, set())
+
+    def test_browse_hidden(self, merged_conf, merged_vaults):
+        """Test hidden folders and collections are left out of browsing"""
+        vault = merged_vaults[0]
+        vault.collections = {"coll-1": {"id": "coll-1", "name": "Shared"}}
+        vault.index.rebuild(vault.entries, vault.folders)
+        root = vault.index.tree.root()
+        subfolders, _ = bwm_main.browse_level(vault, root)
+        assert [(i.name, j) for i, j in subfolders] == [
+            ("Personal", 1),
+            ("Work", 1),
+        ]
+        merged_conf.set("vault", "hide_folders", "Work")
+        merged_conf.set("vault", "hide_collections", "Shared")
+        vault.entries[0]["collectionIds"] = ["coll-1"]
+        subfolders, entries = bwm_main.browse_level(vault, root)
+        assert [(i.name, j) for i, j in subfolders] == [("Personal", 0)]
+        assert entries == []
+        personal = root.children["Personal"]
+        with patch.object(
+            bwm_main, "view_folder", side_effect=[personal, None]
+        ) as mock_view:
+            assert bwm_main.dmenu_browse(vault) is None
+        assert [i[0][1:] for i in mock_view.call_args_list] == [
+            ([], vault.folders, [(personal, 0)]),
+            ([], vault.folders, []),
+        ]
+
+    def test_dmenu_run_hidden(self, merged_conf, merged_vaults):
+        """Test the selected row is the entry shown, not the one at the same
+        position in the vault"""
+        vault = merged_vaults[0]
+        merged_conf.set("vault", "hide_folders", "Personal")
+        rows = bwm_main.menu_rows(vault, bwm_main.shown_entries(vault))
+        assert len(rows.decode().split("\n")) == 1
+        with (
+            patch.object(
+                bwm_main, "view_all_entries", return_value=rows.decode()
+            ),
+            patch.object(bwm_main, "type_entry") as mock_type,
+        ):
+            res = bwm_main.dmenu_run(vault, merged_vaults[:1])
+        assert res == bwm_main.Run.STOP
+        assert mock_type.call_args[0][0] is vault.entries[1]
+
+    def test_merged_listings_stream(self, merged_conf, merged_vaults):
+        """Test a vault that is still loading is listed once it loads"""
+        cold = make_vault("https://c.example.com")
+        cold.loading = Future()
+        listings = bwm_main.merged_listings(
+            [cold, *merged_vaults], ["c", "a", "b"]
+        )
+        assert next(listings).startswith("[a] ")
+        assert next(listings).startswith("[b] ")
+        cold.entries = merged_vaults[0].entries
+        cold.folders = merged_vaults[0].folders
+        cold.loading.set_result(True)
+        assert next(listings).startswith("[c] ")
+        assert next(listings, None) is None
+
+    def test_merged_listings_failed_load(self, merged_conf, merged_vaults):
+        """Test a vault that failed to load is left out"""
+        cold = make_vault("https://c.example.com")
+        cold.loading = Future()
+        cold.loading.set_exception(RuntimeError("bw crashed"))
+        listings = list(
+            bwm_main.merged_listings([*merged_vaults, cold], ["a", "b", "c"])
+        )
+        assert len(listings) == 2
+
+    def test_dmenu_run_merged(self, merged_conf, merged_vaults):
+        """Test an entry from another vault is typed from the main menu"""
+        tags = bwm_main.vault_tags(merged_vaults)
+        row = bwm_main.vault_listing(merged_vaults[1], tags[1]).split("\n")[0]
+        with (
+            patch.object(
+                bwm_main, "view_merged_entries", return_value=row
+            ) as mock_view,
+            patch.object(bwm_main, "type_entry") as mock_type,
+        ):
+            res = bwm_main.dmenu_run(merged_vaults[0], merged_vaults)
+        assert res == bwm_main.Run.STOP
+        assert mock_view.call_args[0][2] == len(mock_view.call_args[0][0]) + 4
+        assert mock_type.call_args[0][0]["name"] == "Other Login"
+
+    def test_dmenu_run_single_vault(self, merged_conf, merged_vaults):
+        """Test the normal menu is used with only one vault"""
+        with (
+            patch.object(bwm_main, "view_merged_entries") as mock_merged,
+            patch.object(bwm_main, "view_all_entries", return_value=""),
+        ):
+            res = bwm_main.dmenu_run(merged_vaults[0], merged_vaults[:1])
+        assert res == bwm_main.Run.STOP
+        mock_merged.assert_not_called()
+
+
+class TestBrowse:
+    """Tests for browsing the vault by folder."""
+
+    def test_dmenu_browse(self, merged_vaults):
+        """Test folders are opened until an entry is selected and typed"""
+        vault = merged_vaults[0]
+        vault.index.rebuild(vault.entries, vault.folders)
+        root = vault.index.tree.root()
+        work = root.children["Work"]
+        with (
+            patch.object(
+                bwm_main,
+                "view_folder",
+                side_effect=[work, root, work, vault.entries[1]],
+            ) as mock_view,
+            patch.object(bwm_main, "type_entry") as mock_type,
+        ):
+            res = bwm_main.dmenu_browse(vault)
+        assert res is vault.entries[1]
+        assert mock_view.call_args_list[1][0][1] == [vault.entries[1]]
+        mock_type.assert_called_once_with(vault.entries[1], vault.autotype)
+        assert vault.frecency.top(1) == [vault.entries[1]["id"]]
+
+    def test_dmenu_browse_cancel(self, merged_vaults):
+        """Test nothing is typed when the launcher is closed"""
+        with (
+            patch.object(bwm_main, "view_folder", return_value=None),
+            patch.object(bwm_main, "type_entry") as mock_type,
+        ):
+            assert bwm_main.dmenu_browse(merged_vaults[0]) is None
+        mock_type.assert_not_called()
+
+
+class TestListen:
+    """Tests for the daemon loop."""
+
+    @pytest.fixture
+    def server(self):
+        """Server stand-in with real events"""
+        server = MagicMock()
+        for flag in (
+            "start_flag",
+            "args_flag",
+            "kill_flag",
+            "cache_time_expired",
+        ):
+            setattr(server, flag, threading.Event())
+        server.start_flag.set()
+        return server
+
+    @staticmethod
+    def listen(server, **kwargs):
+        """Run the loop of a DmenuRunner until it stops (or 5s)
+
+        Returns: True if the loop stopped
+
+        """
+        with patch("bwm.CLIPBOARD", False):
+            runner = bwm_main.DmenuRunner(server, **kwargs)
+            runner.vault = MagicMock()
+            runner.watchdog = MagicMock()
+            with patch.object(runner, "_set_timer"):
+                listen = threading.Thread(target=runner._listen, daemon=True)
+                listen.start()
+                listen.join(5)
+        server.kill_flag.set()
+        server.start_flag.set()
+        return not listen.is_alive()
+
+    def test_request_during_menu(self, server):
+        """Test a scripting request sent while the menu is open is answered
+        once the menu closes"""
+        server.get_args.return_value = {"command": "list", "request_id": "r1"}
+        # Stop the loop after the reply
+        server.send_reply.side_effect = (
+            lambda *_: server.cache_time_expired.set()
+        )
+
+        def menu(*_):
+            server.args_flag.set()
+            server.start_flag.set()
+
+        with (
+            patch.object(bwm_main, "dmenu_run", side_effect=menu) as mock_run,
+            patch.object(bwm_main, "handle_request", return_value={"ok": True}),
+        ):
+            assert self.listen(server), "request was not answered"
+        mock_run.assert_called_once()
+        server.send_reply.assert_called_once_with("r1", {"ok": True})
+
+    def test_cold_start_search(self, server):
+        """Test the search bwm was started with is run instead of the menu"""
+        with (
+            patch.object(bwm_main, "dmenu_run") as mock_run,
+            patch.object(
+                bwm_main,
+                "dmenu_search",
+                side_effect=lambda *_: server.cache_time_expired.set(),
+            ) as mock_search,
+        ):
+            assert self.listen(
+                server, vault="https://a.example.com", query="github", url=None
+            )
+        mock_run.assert_not_called()
+        assert mock_search.call_args[0][1:] == ("github", "")
+
+    @pytest.mark.parametrize(
+        "option, func",
+        [("export_file", "dmenu_export"), ("import_file", "dmenu_import")],
+    )
+    def test_cold_start_export_import(self, server, option, func):
+        """Test an export or import bwm was started with is run instead of
+        the menu"""
+        with (
+            patch.object(bwm_main, "dmenu_run") as mock_run,
+            patch.object(
+                bwm_main,
+                func,
+                side_effect=lambda *_: server.cache_time_expired.set(),
+            ) as mock_func,
+        ):
+            assert self.listen(server, **{option: "/tmp/vault.json"})
+        mock_run.assert_not_called()
+        assert mock_func.call_args[0][1] == "/tmp/vault.json"
@@ -0,0 +1,182 @@
+"""Tests for scripting requests answered from the loaded vault."""
+
+from copy import deepcopy
+import json
+from unittest.mock import patch
+
+import pytest
+
+from bwm import bwscript
+from bwm import bwm as bwm_main
+
+
+@pytest.fixture
+def vault(
+    tmp_path,
+    sample_login_entry,
+    sample_card_entry,
+    sample_identity_entry,
+    sample_folders,
+):
+    """Loaded vault without bw serve"""
+    with patch("bwm.DATA_HOME", str(tmp_path)):
+        vault = bwm_main.Vault("https://a.example.com", "me@a.com", "", "")
+    vault.entries = [
+        deepcopy(sample_login_entry),
+        deepcopy(sample_card_entry),
+        deepcopy(sample_identity_entry),
+    ]
+    twin = deepcopy(sample_login_entry)
+    twin["id"] = "twin-id"
+    twin["folderId"] = "folder-id-2"
+    vault.entries.append(twin)
+    vault.folders = deepcopy(sample_folders)
+    vault.index.rebuild(vault.entries, vault.folders)
+    return vault
+
+
+class TestFindEntry:
+    """Tests for finding the requested entry."""
+
+    def test_by_id(self, vault):
+        """Test lookup by id"""
+        assert bwscript.find_entry(vault, "twin-id")[0]["folderId"] == (
+            "folder-id-2"
+        )
+
+    def test_by_name(self, vault):
+        """Test lookup by case insensitive name"""
+        assert bwscript.find_entry(vault, "test card")[0]["id"] == (
+            "card-id-456"
+        )
+
+    def test_duplicate_name(self, vault):
+        """Test duplicate names are refused rather than guessed"""
+        entry, error = bwscript.find_entry(vault, "Test Login")
+        assert entry is None
+        assert error == "2 entries named Test Login, use the id"
+
+    def test_by_path(self, vault):
+        """Test folder/name lookup"""
+        assert bwscript.find_entry(vault, "work/test login")[0]["id"] == (
+            "twin-id"
+        )
+
+    def test_by_query(self, vault):
+        """Test a search query matching one entry"""
+        assert bwscript.find_entry(vault, "ident")[0]["id"] == (
+            "identity-id-789"
+        )
+
+    def test_not_found(self, vault):
+        """Test the error for unknown entries"""
+        assert bwscript.find_entry(vault, "nothing") == (
+            None,
+            "No entry found for nothing",
+        )
+
+
+class TestEntryField:
+    """Tests for reading one field of an entry."""
+
+    def test_fields(self, vault):
+        """Test login, card, identity and custom fields"""
+        login, card, ident, _ = vault.entries
+        folders = vault.folders
+        assert bwscript.entry_field(login, "password", folders) == (
+            "testpass123"
+        )
+        assert bwscript.entry_field(login, "uri", folders) == (
+            "https://example.com"
+        )
+        assert bwscript.entry_field(login, "folder", folders) == "Personal"
+        assert len(bwscript.entry_field(login, "totp", folders)) == 6
+        assert bwscript.entry_field(card, "Number", folders) == (
+            "4111111111111111"
+        )
+        assert bwscript.entry_field(ident, "Email", folders) == (
+            "john@example.com"
+        )
+        assert bwscript.entry_field(ident, "folder", folders) == ""
+        assert bwscript.entry_field(login, "autotype", folders) == (
+            "{USERNAME}{TAB}{PASSWORD}{ENTER}"
+        )
+        assert bwscript.entry_field(card, "password", folders) is None
+
+
+class TestHandleRequest:
+    """Tests for answering requests."""
+
+    def test_get(self, vault):
+        """Test get defaults to the password"""
+        reply = bwscript.handle_request(
+            vault, {"command": "get", "target": "test card", "field": "Brand"}
+        )
+        assert reply == {
+            "ok": True,
+            "result": {"id": "card-id-456", "field": "Brand", "value": "Visa"},
+        }
+        reply = bwscript.handle_request(
+            vault, {"command": "get", "target": "twin-id"}
+        )
+        assert reply["result"]["value"] == "testpass123"
+
+    def test_missing_field(self, vault):
+        """Test an error for fields the entry doesn't have"""
+        reply = bwscript.handle_request(
+            vault, {"command": "get", "target": "test card", "field": "x"}
+        )
+        assert reply == {"ok": False, "error": "Test Card has no x"}
+
+    def test_totp(self, vault):
+        """Test the code and seconds remaining"""
+        reply = bwscript.handle_request(
+            vault, {"command": "totp", "target": "twin-id"}
+        )
+        assert len(reply["result"]["code"]) == 6
+        assert 0 < reply["result"]["remaining"] <= 30
+        reply = bwscript.handle_request(
+            vault, {"command": "totp", "target": "test card"}
+        )
+        assert reply == {"ok": False, "error": "Test Card has no TOTP"}
+
+    def test_list(self, vault):
+        """Test list returns no secrets"""
+        reply = bwscript.handle_request(vault, {"command": "list"})
+        assert [i["path"] for i in reply["result"]] == [
+            "Personal/Test Login",
+            "Personal/Test Card",
+            "Test Identity",
+            "Work/Test Login",
+        ]
+        assert "testpass123" not in json.dumps(reply)
+        reply = bwscript.handle_request(
+            vault, {"command": "list", "search": "folder:work"}
+        )
+        assert [i["id"] for i in reply["result"]] == ["twin-id"]
+
+    def test_not_loaded(self):
+        """Test requests before the vault is loaded"""
+        assert bwscript.handle_request(None, {"command": "list"}) == {
+            "ok": False,
+            "error": "Vault is not loaded",
+        }
+
+
+class TestFormatReply:
+    """Tests for the client output."""
+
+    def test_text(self):
+        """Test plain text output"""
+        assert bwscript.format_reply("get", {"value": "pw"}) == "pw"
+        assert bwscript.format_reply("totp", {"code": "123456"}) == "123456"
+        rows = [{"id": "1", "path": "a/b", "username": None}]
+        assert bwscript.format_reply("list", rows) == "1\ta/b\t"
+
+    def test_json(self):
+        """Test JSON output"""
+        out = bwscript.format_reply("totp", {"code": "1", "remaining": 3}, True)
+        assert json.loads(out) == {"code": "1", "remaining": 3}
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,158 @@
+"""Tests for the vault search index."""
+
+import copy
+
+import pytest
+
+from bwm.bwsearch import VaultIndex, registrable_domain, uri_host
+
+
+class TestUriHost:
+    """Tests for host extraction from URIs."""
+
+    @pytest.mark.parametrize(
+        "uri,host",
+        [
+            ("https://Example.com/login", "example.com"),
+            ("https://example.com:8443/", "example.com"),
+            ("example.com/login", "example.com"),
+            ("androidapp://com.example", "com.example"),
+            ("", ""),
+            (None, ""),
+        ],
+    )
+    def test_uri_host(self, uri, host):
+        """Test host names are lower cased without port."""
+        assert uri_host(uri) == host
+
+
+class TestRegistrableDomain:
+    """Tests for registrable domain guessing."""
+
+    @pytest.mark.parametrize(
+        "host,domain",
+        [
+            ("example.com", "example.com"),
+            ("login.accounts.example.com", "example.com"),
+            ("www.bbc.co.uk", "bbc.co.uk"),
+            ("user.github.io", "user.github.io"),
+            ("localhost", "localhost"),
+            ("192.168.1.10", "192.168.1.10"),
+        ],
+    )
+    def test_registrable_domain(self, host, domain):
+        """Test eTLD+1 for common and multi-part suffixes."""
+        assert registrable_domain(host) == domain
+
+
+@pytest.fixture
+def vault_index(sample_login_entry, sample_card_entry, sample_folders):
+    """Index with a login, a second login in a sub folder and a card"""
+    work = copy.deepcopy(sample_login_entry)
+    work.update(
+        {
+            "id": "work-id",
+            "name": "GitHub Work",
+            "folderId": "folder-id-3",
+        }
+    )
+    work["login"]["username"] = "me@work.com"
+    work["login"]["uris"] = [{"uri": "https://github.com/login", "match": 0}]
+    work["fields"].append({"name": "team", "value": "Infra", "type": 0})
+    work["fields"].append({"name": "pin", "value": "4321", "type": 1})
+    index = VaultIndex()
+    index.rebuild([sample_login_entry, work, sample_card_entry], sample_folders)
+    return index
+
+
+class TestVaultIndex:
+    """Tests for index queries and incremental updates."""
+
+    def test_rebuild(self, vault_index):
+        """Test that all entries with ids are indexed."""
+        assert len(vault_index) == 3
+
+    def test_find_name_prefix(self, vault_index):
+        """Test bare terms match the start of name words."""
+        assert [i["id"] for i in vault_index.find("git")] == ["work-id"]
+        assert [i["id"] for i in vault_index.find("TEST")] == [
+            "test-id-123",
+            "card-id-456",
+        ]
+
+    def test_find_multiple_terms(self, vault_index):
+        """Test that all terms must match."""
+        assert [i["id"] for i in vault_index.find("test card")] == [
+            "card-id-456"
+        ]
+        assert vault_index.find("test github") == []
+
+    def test_find_username(self, vault_index):
+        """Test username and user: alias."""
+        assert [i["id"] for i in vault_index.find("user:me@")] == ["work-id"]
+        assert [i["id"] for i in vault_index.find("username:testuser")] == [
+            "test-id-123"
+        ]
+
+    def test_find_folder_subtree(self, vault_index):
+        """Test folder matches the folder and its sub folders."""
+        assert [i["id"] for i in vault_index.find("folder:work")] == ["work-id"]
+        assert [i["id"] for i in vault_index.find("folder:personal")] == [
+            "test-id-123",
+            "card-id-456",
+        ]
+
+    def test_find_host_and_domain(self, vault_index):
+        """Test host and domain terms accept URLs."""
+        assert [i["id"] for i in vault_index.find("url:github.com")] == [
+            "work-id"
+        ]
+        assert [
+            i["id"] for i in vault_index.find("domain:https://www.example.com")
+        ] == ["test-id-123"]
+
+    def test_find_custom_fields(self, vault_index):
+        """Test text fields are indexed but hidden fields are not."""
+        assert [i["id"] for i in vault_index.find("field:infra")] == ["work-id"]
+        assert vault_index.find("field:4321") == []
+
+    def test_find_url(self, vault_index):
+        """Test URL lookup by host, then registrable domain."""
+        assert [
+            i["id"] for i in vault_index.find_url("https://github.com/x/y")
+        ] == ["work-id"]
+        assert [
+            i["id"] for i in vault_index.find_url("https://login.example.com")
+        ] == ["test-id-123"]
+        assert vault_index.find_url("https://example.org") == []
+
+    def test_update(self, vault_index, sample_login_entry):
+        """Test that edits are reflected without rebuilding."""
+        new = copy.deepcopy(sample_login_entry)
+        new["name"] = "Renamed"
+        new["login"]["uris"] = [{"uri": "https://example.net", "match": None}]
+        vault_index.update(sample_login_entry, new)
+        assert vault_index.find("test login") == []
+        assert vault_index.find("renamed") == [new]
+        assert vault_index.find_url("https://example.com") == []
+        assert vault_index.find_url("https://example.net") == [new]
+        # Position in vault order is kept
+        assert [i["id"] for i in vault_index.find("folder:personal")] == [
+            "test-id-123",
+            "card-id-456",
+        ]
+
+    def test_add_and_remove(self, vault_index, sample_identity_entry):
+        """Test incremental add and remove."""
+        vault_index.add(sample_identity_entry)
+        assert vault_index.find("identity") == [sample_identity_entry]
+        vault_index.remove(sample_identity_entry)
+        assert vault_index.find("identity") == []
+        assert len(vault_index) == 3
+
+    def test_renamed_folder(self, vault_index, sample_folders):
+        """Test folder renames are found without reindexing."""
+        sample_folders["folder-id-3"]["name"] = "Archive"
+        assert [i["id"] for i in vault_index.find("folder:archive")] == [
+            "work-id"
+        ]
@@ -0,0 +1,185 @@
+"""Tests for the bw serve supervisor."""
+
+from io import BytesIO
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from bwm import bwserve
+from bwm.bwserve import BWCLIServer, PipeLog
+
+
+@pytest.fixture
+def server():
+    """Server that appears started, without a bw serve process"""
+    srv = BWCLIServer()
+    srv.process = MagicMock()
+    srv._serve_session = "sess"
+    srv._ready.set()
+    with patch.object(srv, "_crashed", side_effect=lambda p: None) as crashed:
+        srv.crashed = crashed
+        yield srv
+    srv.process = None
+
+
+class TestRequest:
+    """Tests for requests while bw serve crashes."""
+
+    def test_not_started(self):
+        """Test requests fail before start()"""
+        assert BWCLIServer().request("GET", "/status") == (
+            False,
+            "bw serve not initialized",
+        )
+
+    def test_replay_idempotent(self, server):
+        """Test an idempotent request is sent again after a crash"""
+        with patch.object(
+            server,
+            "_send",
+            side_effect=[ConnectionResetError("reset"), (True, {"ok": 1})],
+        ) as send:
+            assert server.request("GET", "/list/object/items") == (
+                True,
+                {"ok": 1},
+            )
+        assert send.call_count == 2
+        server.crashed.assert_called_once_with(server.process)
+
+    @pytest.mark.parametrize(
+        "method, url",
+        [
+            ("POST", "/object/item"),
+            ("POST", "/move/1/2"),
+            ("DELETE", "/object/item/1"),
+        ],
+    )
+    def test_no_replay(self, server, method, url):
+        """Test a request that may have been applied is not sent again"""
+        with patch.object(
+            server, "_send", side_effect=BrokenPipeError("pipe")
+        ) as send:
+            successful, data = server.request(method, url, {"name": "x"})
+        assert successful is False
+        assert "pipe" in data
+        assert send.call_count == 1
+
+    def test_replay_sync(self, server):
+        """Test POST /sync is replayed"""
+        with patch.object(
+            server, "_send", side_effect=[BrokenPipeError(), (True, {})]
+        ):
+            assert server.request("POST", "/sync") == (True, {})
+
+    def test_timeout(self, server):
+        """Test a request that times out isn't replayed and bw serve is
+        restarted"""
+        with (
+            patch.dict("bwm.TIMEOUTS", {"sync": 5.0}),
+            patch.object(server, "_send", side_effect=TimeoutError()) as send,
+        ):
+            assert server.request("POST", "/sync") == (
+                False,
+                "bw sync timed out after 5.0s",
+            )
+        assert send.call_args[0][4] == 5.0
+        assert send.call_count == 1
+        server.crashed.assert_called_once_with(server.process)
+        assert server.timeouts == 1
+
+    def test_unavailable(self, server):
+        """Test requests fail while bw serve can't be restarted"""
+        server._ready.clear()
+        with (
+            patch.object(bwserve, "RESTART_WAIT", 0.01),
+            patch.object(server, "_send") as send,
+        ):
+            assert server.request("GET", "/status")[0] is False
+        send.assert_not_called()
+
+
+class TestSupervise:
+    """Tests for restarting bw serve."""
+
+    def test_restart(self, caplog):
+        """Test a crashed bw serve is restarted with the same session"""
+        srv = BWCLIServer()
+        srv.process = MagicMock(returncode=1)
+        srv._stderr = PipeLog(BytesIO(b"Error: out of memory\n"), "stderr")
+        srv._serve_session = "sess"
+        srv._initialized = True
+        srv._started_at = 0.0
+        stopping = srv._stopping
+
+        def spawn(session):
+            assert session == "sess"
+            srv.process = MagicMock(pid=2)
+            srv.process.wait.side_effect = lambda timeout=None: stopping.wait()
+            stopping.set()
+            return True
+
+        with (
+            patch.object(bwserve, "RESTART_BACKOFF", (0,)),
+            patch.object(srv, "_spawn", side_effect=spawn),
+            patch.object(srv, "_close"),
+        ):
+            srv._supervise(stopping)
+        assert srv.restarts == 1
+        assert srv._ready.is_set()
+        assert "out of memory" in caplog.text
+
+    def test_stop_ends_supervisor(self):
+        """Test the supervisor doesn't restart bw serve after stop()"""
+        srv = BWCLIServer()
+        srv.process = MagicMock()
+        srv._stopping.set()
+        with patch.object(srv, "_spawn") as spawn:
+            srv._supervise(srv._stopping)
+        spawn.assert_not_called()
+
+
+class TestPipeLog:
+    """Tests for draining bw serve output."""
+
+    def test_drain(self):
+        """Test all output is read and the last lines are kept"""
+        data = b"".join(f"line {i}\n".encode() for i in range(10))
+        log = PipeLog(BytesIO(data), "stdout", maxlen=3)
+        assert log.tail(num=2) == "line 8 | line 9"
+        assert log.stats() == {
+            "lines": 10,
+            "bytes": len(data),
+            "dropped": 7,
+            "alive": False,
+        }
+
+    def test_long_line(self):
+        """Test output without newlines is read in chunks"""
+        with patch.object(bwserve, "PIPE_LOG_CHUNK", 4):
+            log = PipeLog(BytesIO(b"x" * 10), "stderr")
+            log.tail()
+        assert list(log.lines) == ["xxxx", "xxxx", "xx"]
+
+    def test_pipe_not_blocked(self):
+        """Test a chatty process isn't blocked by a full pipe buffer"""
+        read_fd, write_fd = os.pipe()
+        reader = os.fdopen(read_fd, "rb")
+        log = PipeLog(reader, "stdout", maxlen=10)
+        # Several times the size of the pipe buffer
+        with os.fdopen(write_fd, "wb") as writer:
+            for _ in range(4096):
+                writer.write(b"x" * 99 + b"\n")
+        log.tail()
+        assert log.stats()["lines"] == 4096
+        assert len(log.lines) == 10
+
+    def test_diagnostics(self):
+        """Test diagnostics before bw serve is started"""
+        diag = BWCLIServer().diagnostics()
+        assert diag["pid"] is None
+        assert diag["running"] is False
+        assert diag["stderr"] == {}
+
+
+# vim: set et ts=4 sw=4 :
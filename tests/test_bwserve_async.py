@@ -0,0 +1,187 @@
+"""Tests for the asyncio bw serve client."""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import pytest
+
+from bwm.bwserve_async import AsyncBWClient, BWServePool
+
+
+class FakeServe:
+    """Minimal bw serve API on a Unix socket"""
+
+    def __init__(self, delay=0.0, chunked=False):
+        self.delay = delay
+        self.chunked = chunked
+        self.connections = 0
+        self.active = 0
+        self.max_active = 0
+        self.requests = []
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while line := await reader.readline():
+                method, url, _ = line.decode().split(" ")
+                length = 0
+                while (header := await reader.readline()) != b"\r\n":
+                    key, _, value = header.decode().partition(":")
+                    if key.lower() == "content-length":
+                        length = int(value)
+                body = await reader.readexactly(length) if length else b""
+                self.requests.append((method, url, body))
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                await asyncio.sleep(self.delay)
+                self.active -= 1
+                data = json.dumps(
+                    {"success": True, "data": {"url": url}}
+                ).encode()
+                if self.chunked:
+                    half = len(data) // 2
+                    payload = (
+                        f"{half:x}\r\n".encode()
+                        + data[:half]
+                        + f"\r\n{len(data) - half:x}\r\n".encode()
+                        + data[half:]
+                        + b"\r\n0\r\n\r\n"
+                    )
+                    head = b"Transfer-Encoding: chunked"
+                else:
+                    payload = data
+                    head = f"Content-Length: {len(data)}".encode()
+                writer.write(b"HTTP/1.1 200 OK\r\n" + head + b"\r\n\r\n")
+                writer.write(payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def run(fake, tmp_path, coro_fn):
+    """Run coro_fn(client) against a FakeServe"""
+    path = str(tmp_path / "serve.sock")
+
+    async def main():
+        server = await asyncio.start_unix_server(fake.handle, path)
+        async with server:
+            client = AsyncBWClient(path, size=2, timeout=1)
+            try:
+                return await coro_fn(client)
+            finally:
+                client.close()
+
+    return asyncio.run(main())
+
+
+class TestAsyncBWClient:
+    """Tests for AsyncBWClient."""
+
+    def test_request(self, tmp_path):
+        """Test a request and its body"""
+        fake = FakeServe()
+        res = run(
+            fake,
+            tmp_path,
+            lambda c: c.edit("item", "id1", {"name": "x"}, {"o": "1"}),
+        )
+        assert res == (True, {"url": "/object/item/id1?o=1"})
+        assert fake.requests == [
+            ("PUT", "/object/item/id1?o=1", b'{"name": "x"}')
+        ]
+
+    def test_pool(self, tmp_path):
+        """Test requests run concurrently up to the pool size and
+        connections are reused"""
+        fake = FakeServe(delay=0.05)
+
+        async def many(client):
+            return await asyncio.gather(
+                *(client.list("items") for _ in range(6))
+            )
+
+        res = run(fake, tmp_path, many)
+        assert all(i[0] for i in res)
+        assert fake.max_active == 2
+        assert fake.connections == 2
+
+    def test_chunked(self, tmp_path):
+        """Test chunked responses"""
+        res = run(FakeServe(chunked=True), tmp_path, lambda c: c.sync())
+        assert res == (True, {"url": "/sync"})
+
+    def test_timeout(self, tmp_path):
+        """Test a slow request times out and its connection is dropped"""
+        fake = FakeServe(delay=0.5)
+
+        async def slow(client):
+            with pytest.raises(asyncio.TimeoutError):
+                await client.request("GET", "/status", timeout=0.05)
+            return client._idle
+
+        assert run(fake, tmp_path, slow) == []
+
+    def test_cancel(self, tmp_path):
+        """Test a cancelled request releases its pool slot"""
+        fake = FakeServe(delay=0.5)
+
+        async def cancel(client):
+            task = asyncio.ensure_future(client.sync())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            fake.delay = 0
+            return await asyncio.gather(client.lock(), client.lock())
+
+        assert run(fake, tmp_path, cancel) == [
+            (True, {"url": "/lock"}),
+            (True, {"url": "/lock"}),
+        ]
+
+    def test_refused(self, tmp_path):
+        """Test a missing socket raises OSError"""
+        client = AsyncBWClient(str(tmp_path / "missing.sock"))
+        with pytest.raises(OSError):
+            asyncio.run(client.status())
+
+
+class TestBWServePool:
+    """Tests for the synchronous facade."""
+
+    def test_facade(self, tmp_path):
+        """Test BWCLIServer methods go through the pool"""
+        fake = FakeServe()
+        path = str(tmp_path / "serve.sock")
+        pool = BWServePool(size=2, timeout=1)
+        try:
+            ready = asyncio.run_coroutine_threadsafe(
+                asyncio.start_unix_server(fake.handle, path), pool._loop
+            ).result()
+            pool.client = AsyncBWClient(path, 2, 1)
+            pool._serve_session = "sess"
+            pool._ready.set()
+            assert pool.sync() is True
+            assert pool.add_folder("Work") == {"url": "/object/folder"}
+            with (
+                patch.object(pool, "_crashed") as crashed,
+                patch.dict("bwm.TIMEOUTS", {"serve": 0.2}),
+            ):
+                fake.delay = 2
+                assert pool.request("GET", "/status") == (
+                    False,
+                    "bw serve timed out after 0.2s",
+                )
+            crashed.assert_called_once()
+            assert pool.timeouts == 1
+            ready.close()
+        finally:
+            pool._serve_session = None
+            pool.stop()
+        assert pool._loop.is_closed()
+
+
+# vim: set et ts=4 sw=4 :
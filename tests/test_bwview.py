@@ -1,20 +1,31 @@
 """Tests for entry viewing module."""
 
+from subprocess import TimeoutExpired
 from unittest.mock import patch, MagicMock
 
 import pytest
 
 from bwm.bwview import (
+    encode_rows,
     obj_name,
+    stream_rows,
     view_all_entries,
     view_entry,
+    view_folder,
     make_url_entries,
     view_login,
     view_note,
     view_card,
     view_ident,
     view_notes,
+    view_totp_codes,
 )
+from bwm.foldertree import FolderTree
+
+
+def menu_input(mock_select):
+    """Return the launcher input passed to a mocked dmenu_select as text"""
+    return b"".join(mock_select.call_args[1]["inp"]).decode()
 
 
 class TestObjName:
@@ -95,8 +106,7 @@ class TestViewAllEntries:
 
         mock_select.assert_called_once()
         # Check the input contains expected format
-        call_kwargs = mock_select.call_args
-        assert "(l)" in call_kwargs[1]["inp"]
+        assert "(l)" in menu_input(mock_select)
 
     @patch("bwm.bwview.dmenu_select")
     def test_view_all_entries_card(
@@ -109,8 +119,7 @@ class TestViewAllEntries:
         result = view_all_entries([], entries, sample_folders)
 
         mock_select.assert_called_once()
-        call_kwargs = mock_select.call_args
-        assert "(c)" in call_kwargs[1]["inp"]
+        assert "(c)" in menu_input(mock_select)
 
     @patch("bwm.bwview.dmenu_select")
     def test_view_all_entries_identity(
@@ -123,8 +132,7 @@ class TestViewAllEntries:
         result = view_all_entries([], entries, sample_folders)
 
         mock_select.assert_called_once()
-        call_kwargs = mock_select.call_args
-        assert "(i)" in call_kwargs[1]["inp"]
+        assert "(i)" in menu_input(mock_select)
 
     @patch("bwm.bwview.dmenu_select")
     def test_view_all_entries_with_options(
@@ -138,9 +146,116 @@ class TestViewAllEntries:
         result = view_all_entries(options, entries, sample_folders)
 
         mock_select.assert_called_once()
-        call_kwargs = mock_select.call_args
         # Options should be at the top
-        assert call_kwargs[1]["inp"].startswith("View/Type")
+        assert menu_input(mock_select).startswith("View/Type")
+
+    @patch("bwm.bwview.dmenu_select")
+    def test_view_all_entries_large_vault(self, mock_select, synthetic_vault):
+        """Test every entry of a large generated vault is one numbered row"""
+        entries, folders, _, _ = synthetic_vault(items=5000, folders=200)
+        mock_select.return_value = ""
+
+        view_all_entries([], entries, folders)
+
+        rows = menu_input(mock_select).split("\n")
+        assert len(rows) == len(entries)
+        for num, (row, entry) in enumerate(zip(rows, entries)):
+            assert row.startswith(f"{num:>4}({'lnci'[entry['type'] - 1]}) - ")
+            assert entry["name"] in row
+
+
+class TestStreamRows:
+    """Tests for streaming the main menu rows."""
+
+    @staticmethod
+    def text(chunks):
+        """Launcher input written for the generated lists of buffers"""
+        return b"".join(bytes(j) for i in chunks for j in i).decode()
+
+    @pytest.mark.parametrize("cached", [False, True])
+    def test_first_rows(self, synthetic_vault, cached):
+        """Test the first entries are listed first and only once"""
+        entries, folders, _, _ = synthetic_vault(items=2500)
+        expected = encode_rows(entries, folders).decode().split("\n")
+        rows = encode_rows(entries, folders) if cached else None
+        with patch("bwm.bwview.STREAM_CHUNK", 1000):
+            chunks = list(stream_rows(entries, folders, [2499, 7, 1000], rows))
+        lines = self.text(chunks).split("\n")
+        assert lines[:3] == [expected[2499], expected[7], expected[1000]]
+        assert lines[-1] == ""
+        assert lines[3:-1] == [
+            j for i, j in enumerate(expected) if i not in (7, 1000, 2499)
+        ]
+        # The first rows come in their own chunk
+        assert len(chunks[0]) == 1
+
+    def test_fills_cache(self, synthetic_vault):
+        """Test the rows of all entries are collected while streaming"""
+        entries, folders, _, _ = synthetic_vault(items=2500)
+        parts = []
+        chunks = list(stream_rows(entries, folders, [3], parts=parts))
+        assert len(chunks) == 4
+        assert b"\n".join(parts) == encode_rows(entries, folders)
+
+    def test_unknown_type(self, sample_login_entry, sample_folders):
+        """Test entries of unknown types (no row) are left out"""
+        entries = [
+            sample_login_entry,
+            dict(sample_login_entry, type=5),
+            dict(sample_login_entry, name="Last"),
+        ]
+        rows = encode_rows(entries, sample_folders)
+        for cached in (None, rows):
+            lines = self.text(
+                stream_rows(entries, sample_folders, [2], cached)
+            ).split("\n")
+            assert [i[:4] for i in lines] == ["2(l)", "0(l)", ""]
+
+    def test_empty(self, sample_folders):
+        """Test a vault without entries"""
+        assert self.text(stream_rows([], sample_folders, [0], b"")) == ""
+        assert self.text(stream_rows([], sample_folders)) == ""
+
+
+class TestViewFolder:
+    """Tests for browsing one folder level."""
+
+    @pytest.fixture
+    def tree(self, sample_login_entry, sample_card_entry, sample_folders):
+        """Folder tree with an entry in Work and one in Work/Projects"""
+        tree = FolderTree()
+        tree.rebuild(
+            [
+                dict(sample_login_entry, folderId="folder-id-2"),
+                dict(sample_card_entry, folderId="folder-id-3"),
+            ],
+            sample_folders,
+        )
+        return tree
+
+    def test_root(self, tree, sample_folders):
+        """Test the root lists the folders with their counts"""
+        root = tree.root()
+        with patch("bwm.bwview.dmenu_select", return_value="Work/ (2)") as sel:
+            res = view_folder(root, tree.entries(root), sample_folders)
+        assert res is root.children["Work"]
+        assert sel.call_args[0][1] == "Folders"
+        assert sel.call_args[1]["inp"] == "Personal/ (0)\nWork/ (2)"
+
+    def test_subfolder(self, tree, sample_folders):
+        """Test a folder lists its parent, subfolders and own entries"""
+        work = tree.root().children["Work"]
+        entries = tree.entries(work)
+        with patch("bwm.bwview.dmenu_select", return_value="../") as sel:
+            assert view_folder(work, entries, sample_folders) is work.parent
+        rows = sel.call_args[1]["inp"].split("\n")
+        assert rows[:2] == ["../", "Projects/ (1)"]
+        assert rows[2].startswith("0(l) - Work/Test Login - ")
+        assert sel.call_args[0][1] == "Work"
+        with patch("bwm.bwview.dmenu_select", return_value=rows[2]):
+            assert view_folder(work, entries, sample_folders) is entries[0]
+        with patch("bwm.bwview.dmenu_select", return_value=""):
+            assert view_folder(work, entries, sample_folders) is None
 
 
 class TestViewEntry:
@@ -346,3 +461,52 @@ class TestViewNotes:
         mock_select.assert_called_once()
         call_args = mock_select.call_args
         assert call_args[1]["inp"] == notes
+
+
+class TestViewTotpCodes:
+    """Tests for the TOTP codes view."""
+
+    @patch("bwm.bwview.gen_otp")
+    @patch("bwm.bwview.dmenu_select")
+    def test_lists_only_totp_entries(
+        self,
+        mock_select,
+        mock_otp,
+        sample_login_entry,
+        sample_card_entry,
+        sample_folders,
+    ):
+        """Test that only entries with TOTP are listed and selection types
+        a freshly generated code."""
+        mock_select.return_value = "1 - Personal/Test Login - 123456 (10s)"
+        mock_otp.return_value = "654321"
+        entries = [sample_card_entry, sample_login_entry]
+
+        result = view_totp_codes(entries, sample_folders)
+
+        inp = mock_select.call_args[1]["inp"]
+        assert len(inp.splitlines()) == 1
+        assert inp.startswith("1 - Personal/Test Login - ")
+        assert result == "654321"
+        mock_otp.assert_called_once_with(
+            sample_login_entry["login"]["totp"], "test-id-123"
+        )
+
+    @patch("bwm.bwview.dmenu_select")
+    def test_refreshes_on_rollover(
+        self, mock_select, sample_login_entry, sample_folders
+    ):
+        """Test that the menu is reopened when the codes expire."""
+        mock_select.side_effect = [TimeoutExpired("dmenu", 1), ""]
+
+        result = view_totp_codes([sample_login_entry], sample_folders)
+
+        assert mock_select.call_count == 2
+        assert 0 < mock_select.call_args[1]["timeout"] <= 30
+        assert result == ""
+
+    @patch("bwm.bwview.dmenu_err")
+    def test_no_totp_entries(self, mock_err, sample_card_entry, sample_folders):
+        """Test error when no entries have TOTP configured."""
+        assert view_totp_codes([sample_card_entry], sample_folders) == ""
+        mock_err.assert_called_once()
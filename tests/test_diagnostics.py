@@ -0,0 +1,94 @@
+"""Tests for the memory and secret residency report."""
+
+import json
+import tracemalloc
+from unittest.mock import MagicMock
+
+import pytest
+
+from bwm import diagnostics
+from bwm.bwscript import format_reply
+from bwm.bwview import entry_rows
+
+
+@pytest.fixture
+def vault(synthetic_vault):
+    """Vault with 500 generated entries"""
+    entries, folders, collections, orgs = synthetic_vault(items=500)
+    return MagicMock(
+        url="https://a.example.com",
+        entries=entries,
+        folders=folders,
+        collections=collections,
+        orgs=orgs,
+        bwcliserver=None,
+    )
+
+
+class TestMemory:
+    """Tests for memory by module."""
+
+    def test_not_tracing(self):
+        """Test there is no memory report without tracemalloc"""
+        assert not tracemalloc.is_tracing()
+        assert diagnostics.memory() is None
+
+    def test_by_module(self, vault):
+        """Test allocations are attributed to the bwm module making them"""
+        tracemalloc.start(diagnostics.FRAMES)
+        try:
+            rows = entry_rows(enumerate(vault.entries), vault.folders, 3)
+            res = diagnostics.memory()
+        finally:
+            tracemalloc.stop()
+        assert len(rows) == 500
+        assert res["subsystems"]["bwview"]["bytes"] > 500 * 50
+        assert res["traced_bytes"] <= res["peak_bytes"]
+
+
+class TestSecrets:
+    """Tests for counting copies of secrets."""
+
+    def test_entry_secrets(self, sample_login_entry, sample_card_entry):
+        """Test the secrets of an entry by kind"""
+        assert dict(diagnostics.entry_secrets(sample_card_entry)) == {
+            "passwords": None,
+            "totp keys": None,
+            "card numbers": "4111111111111111",
+            "card codes": "123",
+            "identity numbers": None,
+        }
+        kinds = [
+            i for i, j in diagnostics.entry_secrets(sample_login_entry) if j
+        ]
+        assert kinds == ["passwords", "totp keys"]
+
+    def test_copies(self, vault):
+        """Test copies of secrets and buffers holding them are counted"""
+        before = diagnostics.secret_copies([vault])
+        passwords = before["passwords"]
+        assert passwords["copies"] >= passwords["secrets"] > 300
+        password = next(
+            i["login"]["password"] for i in vault.entries if i["login"]
+        )
+        # A new string object with the same value and a bw output like buffer
+        held = ["".join(list(password)), json.dumps(vault.entries).encode()]
+        after = diagnostics.secret_copies([vault])
+        assert after["passwords"]["copies"] == passwords["copies"] + 1
+        assert after["blobs"] == before["blobs"] + 1
+        assert after["blob_bytes"] >= before["blob_bytes"] + len(held[1])
+
+    def test_report(self, vault):
+        """Test the report is printed as JSON without secrets"""
+        res = diagnostics.report([vault])
+        assert res["memory"] is None
+        assert res["vaults"][0]["entries"] == 500
+        out = format_reply("diagnostics", res)
+        assert json.loads(out) == res
+        assert vault.entries[0]["id"] not in out
+        assert not any(
+            i["login"]["password"] in out for i in vault.entries if i["login"]
+        )
+
+
+# vim: set et ts=4 sw=4 :
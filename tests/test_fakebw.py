@@ -0,0 +1,133 @@
+"""Tests for the bw CLI and bw serve stand-in used by the benchmarks."""
+
+import json
+from threading import Thread
+import time
+
+import pytest
+
+from bwm import bwcli
+from bwm.bwserve import BWCLIServer
+from bwm.bwserve_async import BWServePool
+from tests import fakebw, vaultgen
+
+
+@pytest.fixture
+def vault_file(tmp_path):
+    """Generated vault of 50 items saved to a file"""
+    path = tmp_path / "vault.json"
+    path.write_text(json.dumps(vaultgen.generate(items=50, seed=1)))
+    return path
+
+
+class TestVaultgen:
+    """Tests for the synthetic vault generator."""
+
+    def test_deterministic(self):
+        """Test the same seed gives the same vault"""
+        assert vaultgen.generate(seed=3) == vaultgen.generate(seed=3)
+        assert vaultgen.generate(seed=3) != vaultgen.generate(seed=4)
+
+    def test_references(self):
+        """Test items only reference existing folders and collections"""
+        vault = vaultgen.generate(items=500, orgs=2)
+        folders = {i["id"] for i in vault["folders"]}
+        colls = {i["id"]: i for i in vault["collections"]}
+        assert len(vault["items"]) == 500
+        assert len(colls) == 10
+        for item in vault["items"]:
+            assert item["folderId"] in folders
+            for coll in item["collectionIds"]:
+                assert colls[coll]["organizationId"] == item["organizationId"]
+        logins = [i["login"] for i in vault["items"] if i["type"] == 1]
+        assert any(i["totp"] for i in logins)
+        assert any(i["uris"] for i in logins)
+
+    def test_variety(self):
+        """Test all item types, nested folders, custom fields, many URIs,
+        long notes and non-ASCII names are generated
+
+        """
+        vault = vaultgen.generate(items=2000, folders=100)
+        items = vault["items"]
+        assert {i["type"] for i in items} == {1, 2, 3, 4}
+        for item in items:
+            part = {1: "login", 2: "secureNote", 3: "card", 4: "identity"}
+            assert item[part[item["type"]]]
+        depths = {i["name"].count("/") for i in vault["folders"]}
+        assert depths == {0, 1, 2}
+        assert {j["type"] for i in items for j in i["fields"]} == {0, 1, 2, 3}
+        assert max(len(i["login"]["uris"]) for i in items if i["login"]) >= 10
+        assert max(len(i["notes"] or "") for i in items) > 10000
+        assert any(not i["name"].isascii() for i in items)
+        assert all("\n" not in i["name"] for i in items)
+        assert vaultgen.loaded(vault)[1][None]["name"] == "No Folder"
+
+
+class TestCLI:
+    """Tests for bwm.bwcli running the stand-in."""
+
+    def test_get_entries(self):
+        """Test the generated vault is listed"""
+        env = fakebw.environ(items=20)
+        items, folders, collections, orgs = bwcli.get_entries(b"s", env=env)
+        assert len(items) == 20
+        assert folders[None]["name"] == "No Folder"
+        assert len(collections) == 5
+        assert len(orgs) == 1
+        assert bwcli.status(b"s", env=env)["status"] == "unlocked"
+
+    def test_changes_saved(self, vault_file):
+        """Test changes are saved to the vault file"""
+        env = fakebw.environ(vault_file)
+        item = bwcli.add_entry(
+            {"type": 1, "name": "New", "folderId": None}, b"s", env=env
+        )
+        assert item["name"] == "New"
+        item["name"] = "Renamed"
+        assert bwcli.edit_entry(item, b"s", env=env)["name"] == "Renamed"
+        names = [i["name"] for i in json.loads(vault_file.read_text())["items"]]
+        assert names.count("Renamed") == 1
+        assert bwcli.delete_entry(item, b"s", env=env)
+        assert len(json.loads(vault_file.read_text())["items"]) == 50
+
+    def test_latency(self):
+        """Test the artificial latency of each command"""
+        env = fakebw.environ(items=1, latency=0.3)
+        start = time.monotonic()
+        assert bwcli.sync(b"s", env=env)
+        assert time.monotonic() - start >= 0.3
+
+
+@pytest.mark.parametrize("server_class", [BWCLIServer, BWServePool])
+def test_serve(server_class, vault_file):
+    """Test bw serve requests over the socket passed to the stand-in"""
+    server = server_class(env=fakebw.environ(vault_file))
+    try:
+        assert server.start(session=fakebw.SESSION)
+        items, folders, _, orgs = server.get_entries()
+        assert len(items) == 50
+        assert len(folders) == 11
+        assert len(orgs) == 1
+        item = server.add_entry({"type": 2, "name": "Note", "folderId": None})
+        item["name"] = "Edited"
+        assert server.edit_entry(item)["name"] == "Edited"
+        assert server.delete_entry(item)
+        assert server.delete_entry(item) is False
+        assert server.sync()
+        # Requests from several threads
+        res = []
+        threads = [
+            Thread(target=lambda: res.append(server.get_folders()))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert res == [folders] * 4
+    finally:
+        server.stop()
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,89 @@
+"""Tests for the folder tree."""
+
+import pytest
+
+from bwm.foldertree import FolderTree
+
+
+def entry(eid, folder_id):
+    """Minimal entry"""
+    return {"id": eid, "name": eid, "folderId": folder_id}
+
+
+@pytest.fixture
+def tree(sample_folders):
+    """Tree with entries in nested folders"""
+    folders = {k: dict(v) for k, v in sample_folders.items()}
+    folders["folder-id-4"] = {"id": "folder-id-4", "name": "Home/Media/TV"}
+    res = FolderTree()
+    res.rebuild(
+        [
+            entry("a", None),
+            entry("b", "folder-id-1"),
+            entry("c", "folder-id-2"),
+            entry("d", "folder-id-3"),
+            entry("e", "folder-id-3"),
+            entry("f", "folder-id-4"),
+        ],
+        folders,
+    )
+    return res
+
+
+def test_build(tree):
+    """Test nodes are built from the folder paths with subtree counts"""
+    root = tree.root()
+    assert [i.name for i in root.subfolders()] == ["Home", "Personal", "Work"]
+    assert root.count == 6
+    work = root.children["Work"]
+    assert work.count == 3
+    assert [i["id"] for i in tree.entries(work)] == ["c"]
+    projects = work.children["Projects"]
+    assert projects.path == "Work/Projects"
+    assert projects.parent is work
+    assert [i["id"] for i in tree.entries(projects)] == ["d", "e"]
+    # Intermediate paths without a folder of their own
+    media = root.children["Home"].children["Media"]
+    assert media.folders == []
+    assert tree.entries(media) == []
+    assert media.count == 1
+    assert [i["id"] for i in tree.entries(root)] == ["a"]
+
+
+def test_incremental(tree):
+    """Test counts are updated as entries are added, moved and removed"""
+    root = tree.root()
+    tree.add(entry("g", "folder-id-3"))
+    assert root.children["Work"].count == 4
+    assert root.count == 7
+    # Moved to another folder
+    tree.add(entry("g", "folder-id-1"))
+    assert root.children["Work"].count == 3
+    assert root.children["Personal"].count == 2
+    tree.remove(entry("g", "unknown"))
+    assert root.children["Personal"].count == 1
+    assert len(tree) == 6
+    assert tree.root() is root
+
+
+def test_renamed_folder(tree):
+    """Test the nodes are rebuilt when folders change"""
+    root = tree.root()
+    tree.folders["folder-id-3"]["name"] = "Personal/Projects"
+    new = tree.root()
+    assert new is not root
+    assert new.children["Work"].count == 1
+    assert new.children["Personal"].count == 3
+    assert "Projects" in new.children["Personal"].children
+
+
+def test_unknown_folder(tree):
+    """Test entries of folders that aren't in the folders dict are in the
+    root"""
+    tree.add(entry("g", "deleted-folder"))
+    root = tree.root()
+    assert root.count == 7
+    assert sorted(i["id"] for i in tree.entries(root)) == ["a", "g"]
+
+
+# vim: set et ts=4 sw=4 :
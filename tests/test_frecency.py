@@ -0,0 +1,66 @@
+"""Tests for the frecency of typed entries."""
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+from bwm import frecency
+from bwm.frecency import DAY, Frecency
+
+NOW = 1_700_000_000
+
+
+@pytest.fixture
+def data_home(tmp_path):
+    """Temporary DATA_HOME"""
+    with patch("bwm.DATA_HOME", str(tmp_path / "bwm")):
+        yield tmp_path / "bwm"
+
+
+def test_weight():
+    """Test older visits weigh less"""
+    assert frecency.weight(0) == 100
+    assert frecency.weight(10 * DAY) == 70
+    assert frecency.weight(60 * DAY) == 30
+    assert frecency.weight(400 * DAY) == frecency.OLD_WEIGHT
+
+
+def test_top(data_home):
+    """Test entries are ranked by frequency and recency"""
+    frec = Frecency("https://a.example.com", "me@a.com")
+    assert frec.top(5) == []
+    for _ in range(3):
+        frec.visit("old", NOW - 100 * DAY)
+    frec.visit("recent", NOW - DAY)
+    for _ in range(3):
+        frec.visit("often", NOW - 20 * DAY)
+    assert frec.score("never", NOW) == 0
+    assert frec.top(5, NOW) == ["often", "recent", "old"]
+    assert frec.top(1, NOW) == ["often"]
+
+
+def test_saved(data_home):
+    """Test visits are saved per vault and only ids are stored"""
+    frec = Frecency("https://a.example.com", "me@a.com")
+    for num in range(frecency.MAX_VISITS + 5):
+        frec.visit("id-1", NOW + num)
+    assert json.loads(open(frec.path, encoding="utf-8").read()) == {
+        "id-1": [NOW + 5 + i for i in range(frecency.MAX_VISITS)]
+    }
+    assert Frecency("https://a.example.com", "me@a.com").top(1) == ["id-1"]
+    assert Frecency("https://b.example.com", "me@a.com").top(1) == []
+
+
+def test_corrupt_file(data_home):
+    """Test an unreadable file is ignored"""
+    frec = Frecency("https://a.example.com", "me@a.com")
+    data_home.mkdir()
+    with open(frec.path, "w", encoding="utf-8") as out:
+        out.write("not json")
+    assert frec.top(5) == []
+    frec.visit("id-1")
+    assert Frecency("https://a.example.com", "me@a.com").top(5) == ["id-1"]
+
+
+# vim: set et ts=4 sw=4 :
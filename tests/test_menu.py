@@ -502,3 +502,183 @@ class TestObscureColorConfig:
         result = dmenu_pass("dmenu")
         # Default color is #222222
         assert result == ["-nb", "#222222", "-nf", "#222222"]
+
+
+class TestDmenuStream:
+    """Tests for streaming input to the launcher."""
+
+    @patch("bwm.menu.dmenu_cmd")
+    @patch("bwm.menu.bwm")
+    def test_dmenu_stream_all_input(self, mock_bwm, mock_cmd):
+        """Test all chunks are written before the launcher reads EOF."""
+        mock_bwm.ENC = "utf-8"
+        mock_bwm.ENV = None
+        mock_cmd.return_value = ["tail", "-n", "1"]
+
+        from bwm.menu import dmenu_stream
+
+        result = dmenu_stream(5, "Test", iter(["a\nb", "c"]))
+        assert result == "c"
+
+    @patch("bwm.menu.dmenu_cmd")
+    @patch("bwm.menu.bwm")
+    def test_dmenu_stream_early_selection(self, mock_bwm, mock_cmd):
+        """Test a selection is returned while input is still pending."""
+        import threading
+
+        mock_bwm.ENC = "utf-8"
+        mock_bwm.ENV = None
+        mock_cmd.return_value = ["head", "-n", "1"]
+        pending = threading.Event()
+
+        def chunks():
+            yield "first"
+            pending.wait(5)
+            yield "late"
+
+        from bwm.menu import dmenu_stream
+
+        result = dmenu_stream(5, "Test", chunks())
+        pending.set()
+        assert result == "first"
+
+
+class TestNotify:
+    """Tests for desktop notifications."""
+
+    @patch("bwm.menu.run")
+    def test_notify(self, mock_run):
+        """Test notifications with the same tag replace each other"""
+        from bwm.menu import notify
+
+        notify("1/2 done", tag="bulk")
+        assert mock_run.call_args[0][0] == [
+            "notify-send",
+            "-a",
+            "bwm",
+            "-h",
+            "string:x-canonical-private-synchronous:bulk",
+            "bwm",
+            "1/2 done",
+        ]
+
+    @patch("bwm.menu.run", side_effect=FileNotFoundError)
+    def test_not_installed(self, _mock_run, caplog):
+        """Test the message is only logged without notify-send"""
+        import logging
+
+        from bwm.menu import notify
+
+        with caplog.at_level(logging.INFO):
+            notify("done")
+        assert "done" in caplog.text
+
+
+class TestDmenuSelectChunks:
+    """Tests for writing encoded chunks straight to the launcher."""
+
+    def test_write_chunks_partial(self):
+        """Test chunks are written in order after partial writes."""
+        import os
+
+        from bwm.menu import write_chunks
+
+        out = []
+
+        def writev(_fd, views):
+            # Write at most 3 bytes per call
+            data = b"".join(bytes(i) for i in views)[:3]
+            out.append(data)
+            return len(data)
+
+        with patch("bwm.menu.os.writev", side_effect=writev):
+            write_chunks(1, [b"abcd", b"", b"ef", b"ghij"])
+        assert b"".join(out) == b"abcdefghij"
+        assert len(out) == 4
+        read_fd, write_fd = os.pipe()
+        write_chunks(write_fd, [b"a\n", bytearray(b"b")])
+        os.close(write_fd)
+        assert os.read(read_fd, 10) == b"a\nb"
+        os.close(read_fd)
+
+    @patch("bwm.menu.dmenu_cmd")
+    @patch("bwm.menu.bwm")
+    def test_dmenu_select_chunks(self, mock_bwm, mock_cmd):
+        """Test all chunks are written and the selection decoded."""
+        mock_bwm.ENC = "utf-8"
+        mock_bwm.ENV = None
+        mock_cmd.return_value = ["tail", "-n", "1"]
+
+        from bwm.menu import dmenu_select
+
+        result = dmenu_select(5, "Test", ["a\n".encode(), "b\nZürich".encode()])
+        assert result == "Zürich"
+
+    @patch("bwm.menu.dmenu_cmd")
+    @patch("bwm.menu.bwm")
+    def test_dmenu_select_chunks_early_exit(self, mock_bwm, mock_cmd):
+        """Test a launcher exiting before reading all input."""
+        mock_bwm.ENC = "utf-8"
+        mock_bwm.ENV = None
+        mock_cmd.return_value = ["head", "-n", "1"]
+
+        from bwm.menu import dmenu_select
+
+        rows = b"\n".join(b"row %d" % i for i in range(200000))
+        assert dmenu_select(5, "Test", [rows]) == "row 0"
+
+    @patch("bwm.menu.dmenu_cmd")
+    @patch("bwm.menu.bwm")
+    def test_dmenu_select_chunks_timeout(self, mock_bwm, mock_cmd):
+        """Test the launcher is killed after the timeout."""
+        from subprocess import TimeoutExpired
+
+        mock_bwm.ENC = "utf-8"
+        mock_bwm.ENV = None
+        mock_cmd.return_value = ["sleep", "10"]
+
+        from bwm.menu import dmenu_select
+
+        with pytest.raises(TimeoutExpired):
+            dmenu_select(5, "Test", [b"a"], timeout=0.2)
+
+    @patch("bwm.menu.dmenu_cmd")
+    @patch("bwm.menu.bwm")
+    def test_dmenu_select_chunks_timeout_writing(self, mock_bwm, mock_cmd):
+        """Test the timeout covers a launcher that stops reading its input."""
+        import time
+        from subprocess import TimeoutExpired
+
+        mock_bwm.ENC = "utf-8"
+        mock_bwm.ENV = None
+        mock_cmd.return_value = ["sleep", "10"]
+
+        from bwm.menu import dmenu_select
+
+        start = time.monotonic()
+        with pytest.raises(TimeoutExpired):
+            # More than the pipe buffer, so writing blocks
+            dmenu_select(5, "Test", [b"x" * 10000000], timeout=0.2)
+        assert time.monotonic() - start < 5
+
+    @patch("bwm.menu.dmenu_cmd")
+    @patch("bwm.menu.bwm")
+    def test_dmenu_select_stream(self, mock_bwm, mock_cmd):
+        """Test each list of chunks is written as soon as it is generated."""
+        mock_bwm.ENC = "utf-8"
+        mock_bwm.ENV = None
+        mock_cmd.return_value = ["head", "-n", "1"]
+        generated = []
+
+        def chunks():
+            generated.append(1)
+            yield [b"first\n"]
+            for num in range(1000):
+                generated.append(1)
+                yield [b"x" * 100000, b"\n"]
+
+        from bwm.menu import dmenu_select
+
+        assert dmenu_select(5, "Test", chunks()) == "first"
+        # The launcher exited before all input was generated
+        assert len(generated) < 1000
@@ -0,0 +1,147 @@
+"""Tests for the daemon counters and latency histograms."""
+
+from copy import deepcopy
+import json
+from subprocess import TimeoutExpired
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from bwm import bwcli, bwtype, metrics, totp
+from bwm import bwm as bwm_main
+from bwm.bwedit import serve_ready
+from bwm.bwscript import format_reply
+
+
+@pytest.fixture(autouse=True)
+def clean():
+    """Start each test with no metrics"""
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+class TestHistogram:
+    """Tests for latency histograms."""
+
+    def test_percentiles(self):
+        """Test percentiles are the upper bound of their bucket"""
+        hist = metrics.Histogram()
+        for ms in [0.5] * 90 + [40] * 9 + [45000]:
+            hist.observe(ms)
+        res = hist.stats()
+        assert res["count"] == 100
+        assert (res["p50_ms"], res["p95_ms"]) == (1, 50)
+        assert hist.percentile(100) == 45000
+        assert res["max_ms"] == 45000
+        assert res["buckets"] == {"<=1": 90, "<=50": 9, ">30000": 1}
+
+    def test_empty(self):
+        """Test a histogram without latencies"""
+        res = metrics.Histogram().stats()
+        assert (res["count"], res["mean_ms"], res["p95_ms"]) == (0, 0, 0.0)
+
+    def test_timed(self):
+        """Test blocks that raise are timed and counted as errors"""
+        with metrics.timed("op"):
+            pass
+        with pytest.raises(OSError):
+            with metrics.timed("op"):
+                raise OSError
+        res = metrics.stats()
+        assert res["latency"]["op"]["count"] == 2
+        assert res["counters"] == {"op errors": 1}
+
+
+class TestStats:
+    """Tests for the --stats reply."""
+
+    def test_stats(self, sample_login_entry, sample_folders):
+        """Test counters, cache hit rates and vault sizes"""
+        vault = MagicMock(
+            url="https://a.example.com",
+            entries=[deepcopy(sample_login_entry)],
+            folders=deepcopy(sample_folders),
+            collections={},
+            orgs={},
+            bwcliserver=None,
+        )
+        metrics.incr("reloads")
+        for hit in (True, True, True, False):
+            metrics.cache("listing", hit)
+        metrics.observe("bw sync", 0.2)
+        res = metrics.stats([vault])
+        assert res["counters"]["reloads"] == 1
+        assert res["cache_hit_rates"] == {"listing": 0.75}
+        assert res["latency"]["bw sync"]["p50_ms"] == 250
+        assert res["vaults"][0]["entries"] == 1
+        assert res["vaults"][0]["bytes"] > 1000
+        assert res["max_rss_bytes"] > 0
+        # Printed as JSON
+        assert json.loads(format_reply("stats", res)) == res
+
+    def test_deep_size(self):
+        """Test shared objects are only counted once"""
+        item = {"name": "x" * 1000}
+        assert metrics.deep_size([item, item]) < 2 * metrics.deep_size(item)
+
+
+class TestCounters:
+    """Tests for the events counted by the other modules."""
+
+    def test_cli_fallback(self):
+        """Test using the CLI while bw serve isn't ready is counted"""
+        vault = MagicMock(bwcliserver=None)
+        assert serve_ready(vault) is False
+        vault.bwcliserver = MagicMock()
+        vault.bwcliserver.is_ready.return_value = False
+        assert serve_ready(vault) is False
+        vault.bwcliserver.is_ready.return_value = True
+        assert serve_ready(vault) is True
+        assert metrics.COUNTERS == {"cli fallbacks": 1}
+
+    @patch("bwm.bwcli.run")
+    def test_bw_latency(self, mock_run):
+        """Test bw commands are timed by subcommand and timeouts counted"""
+        mock_run.side_effect = TimeoutExpired(["bw"], 60)
+        assert bwcli.get_orgs(b"session-key") is False
+        assert metrics.COUNTERS["bw timeouts"] == 1
+        assert list(metrics.HISTOGRAMS) == ["bw list organizations"]
+
+    def test_totp_cache(self):
+        """Test parsed TOTP keys are counted as cache hits"""
+        url = "JBSWY3DPEHPK3PXP"
+        with patch.dict("bwm.totp.OTP_CACHE", clear=True):
+            totp.get_otp_key(url, "id-1")
+            totp.get_otp_key(url, "id-1")
+        assert metrics.stats()["cache_hit_rates"] == {"totp key": 0.5}
+
+    @patch("bwm.bwtype.dmenu_err")
+    def test_type_errors(
+        self, mock_err, sample_login_entry, sample_identity_entry
+    ):
+        """Test typing failures are counted, but not entries that aren't
+        typed by design"""
+        disabled = deepcopy(sample_login_entry)
+        disabled["fields"] = [{"name": "autotype", "value": "False"}]
+        with patch("bwm.CLIPBOARD", False):
+            bwtype.type_entry(sample_identity_entry)
+            bwtype.type_entry(disabled)
+        assert mock_err.call_count == 2
+        assert "type errors" not in metrics.COUNTERS
+        list(bwtype.tokenize_autotype("{USERNAME"))
+        assert metrics.COUNTERS["type errors"] == 1
+
+    def test_reload(self, tmp_path):
+        """Test reloads and failed reloads are counted"""
+        with patch("bwm.DATA_HOME", str(tmp_path)):
+            vault = bwm_main.Vault("https://a.example.com", "me@a.com", "", "")
+        with patch(
+            "bwm.bwm.bwcli.get_entries", side_effect=[([], {}, {}, {}), False]
+        ):
+            assert bwm_main.load_entries(vault) is True
+            assert bwm_main.load_entries(vault) is False
+        assert metrics.COUNTERS == {"reloads": 1, "reload errors": 1}
+
+
+# vim: set et ts=4 sw=4 :
@@ -2,6 +2,7 @@
 
 import multiprocessing
 import socket
+import threading
 from unittest.mock import patch, MagicMock, mock_open
 import os
 import tempfile
@@ -140,22 +141,23 @@ class TestGetAuth:
 class TestClient:
     """Tests for client connection."""
 
-    @patch("bwm.__main__.BaseManager")
+    @patch("bwm.__main__.Manager")
     def test_client_registers_methods(self, mock_manager_class):
         """Test that client registers required methods."""
         mock_manager = MagicMock()
         mock_manager_class.return_value = mock_manager
 
-        from bwm.__main__ import client
+        from bwm.__main__ import client, value_proxy
 
         client(12345, b"authkey")
 
         mock_manager.register.assert_any_call("set_event")
         mock_manager.register.assert_any_call("get_pipe")
         mock_manager.register.assert_any_call("read_args_from_pipe")
+        mock_manager.register.assert_any_call("request", proxytype=value_proxy)
         mock_manager.connect.assert_called_once()
 
-    @patch("bwm.__main__.BaseManager")
+    @patch("bwm.__main__.Manager")
     def test_client_uses_correct_address(self, mock_manager_class):
         """Test that client uses correct port and authkey."""
         mock_manager = MagicMock()
@@ -212,3 +214,69 @@ class TestServer:
         server = Server()
 
         assert server._get_pipe() is server._child_conn
+
+    @patch("bwm.__main__.get_auth")
+    def test_get_reply_order(self, mock_get_auth):
+        """Test replies reach the client that sent the request"""
+        mock_get_auth.return_value = (12345, b"authkey")
+
+        from bwm.__main__ import Server
+
+        server = Server()
+        server.send_reply("a", {"ok": True, "result": 1})
+        server.send_reply("b", {"ok": True, "result": 2})
+        assert server.get_reply("b", timeout=1)["result"] == 2
+        assert server.get_reply("a", timeout=1)["result"] == 1
+
+    @patch("bwm.__main__.get_auth")
+    def test_get_reply_timeout(self, mock_get_auth):
+        """Test a client gives up when the daemon doesn't answer"""
+        mock_get_auth.return_value = (12345, b"authkey")
+
+        from bwm.__main__ import Server
+
+        server = Server()
+        reply = server.get_reply("a", timeout=0.05)
+        assert reply == {"ok": False, "error": "No reply from bwm"}
+
+
+class TestScriptRequest:
+    """Tests for scripting requests over the manager connection."""
+
+    def test_round_trip(self, capsys):
+        """Test a request is answered by the daemon side of the pipe"""
+        from bwm.__main__ import Server, find_free_port, script_request
+
+        port = find_free_port()
+        with patch("bwm.__main__.get_auth", return_value=(port, b"key")):
+            server = Server()
+        mgr = server.server()
+        requests = []
+
+        def daemon():
+            server.args_flag.wait(5)
+            args = server.get_args()
+            requests.append(args)
+            server.send_reply(
+                args["request_id"], {"ok": True, "result": {"value": "pw"}}
+            )
+
+        thread = threading.Thread(target=daemon, daemon=True)
+        thread.start()
+        try:
+            status = script_request(
+                port, b"key", {"command": "get", "target": "x"}
+            )
+        finally:
+            thread.join(5)
+            mgr.shutdown()
+        assert status == 0
+        assert capsys.readouterr().out == "pw\n"
+        assert requests[0]["target"] == "x"
+
+    def test_not_running(self, capsys):
+        """Test the error when no daemon is listening"""
+        from bwm.__main__ import find_free_port, script_request
+
+        assert script_request(find_free_port(), b"key", {}) == 1
+        assert capsys.readouterr().err == "bwm is not running\n"
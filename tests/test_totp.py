@@ -1,11 +1,22 @@
 """Tests for TOTP generation module."""
 
+import base64
 import time
 from unittest.mock import patch
 
 import pytest
 
-from bwm.totp import hotp, totp, gen_otp
+from bwm import totp as totp_mod
+from bwm.totp import (
+    OTPKey,
+    hotp,
+    totp,
+    gen_otp,
+    gen_otps,
+    get_otp_key,
+    otp_now,
+    parse_otp,
+)
 
 
 class TestHOTP:
@@ -110,16 +121,16 @@ class TestGenOTP:
         assert result == ""
 
     def test_gen_otp_missing_period(self):
-        """Test that missing period returns empty string."""
-        otp_url = "otpauth://totp/Test:user@example.com?secret=JBSWY3DPEHPK3PXP&digits=6&issuer=Test"
-        result = gen_otp(otp_url)
-        assert result == ""
+        """Test that missing period defaults to 30 seconds."""
+        otp_url = "otpauth://totp/Test:user@example.com?secret=JBSWY3DPEHPK3PXP&digits=8&issuer=Test"
+        assert parse_otp(otp_url).period == 30
+        assert len(gen_otp(otp_url)) == 8
 
     def test_gen_otp_missing_digits(self):
-        """Test that missing digits returns empty string."""
-        otp_url = "otpauth://totp/Test:user@example.com?secret=JBSWY3DPEHPK3PXP&period=30&issuer=Test"
-        result = gen_otp(otp_url)
-        assert result == ""
+        """Test that missing digits defaults to 6."""
+        otp_url = "otpauth://totp/Test:user@example.com?secret=JBSWY3DPEHPK3PXP&period=60&issuer=Test"
+        assert parse_otp(otp_url).digits == 6
+        assert len(gen_otp(otp_url)) == 6
 
     def test_gen_otp_steam_encoder(self):
         """Test OTP generation with steam encoder."""
@@ -143,3 +154,219 @@ class TestGenOTP:
         result = gen_otp(otp_url)
         assert len(result) == 6
         assert result.isdigit()
+
+
+class TestOTPCache:
+    """Tests for the parsed TOTP key cache."""
+
+    URL = "otpauth://totp/Test:user@example.com?secret=JBSWY3DPEHPK3PXP&period=30&digits=6&issuer=Test"
+
+    def setup_method(self):
+        totp_mod.OTP_CACHE.clear()
+
+    def test_parse_otp(self):
+        """Test the secret is decoded and parameters are converted."""
+        key = parse_otp(self.URL)
+        assert key.key == b"Hello!\xde\xad\xbe\xef"
+        assert key.period == 30
+        assert key.digits == 6
+        assert key.digest == "sha1"
+        assert key.steam is False
+
+    def test_parse_otp_secret_only(self):
+        """Test that an otpauth URL with only a secret uses the defaults."""
+        key = parse_otp("otpauth://totp/x?secret=JBSWY3DPEHPK3PXP")
+        assert (key.period, key.digits, key.digest) == (30, 6, "sha1")
+
+    def test_parse_otp_missing_secret(self):
+        """Test that an incomplete URL is not parsed."""
+        assert parse_otp("otpauth://totp/Test?period=30&digits=6") is None
+
+    def test_cached_by_item_id(self):
+        """Test that the URL is parsed only once per item."""
+        with patch("bwm.totp.parse_otp", wraps=parse_otp) as mock_parse:
+            gen_otp(self.URL, "item-1")
+            gen_otp(self.URL, "item-1")
+        assert mock_parse.call_count == 1
+        assert "item-1" in totp_mod.OTP_CACHE
+
+    def test_no_item_id_not_cached(self):
+        """Test that URLs without an item id bypass the cache."""
+        gen_otp(self.URL)
+        assert totp_mod.OTP_CACHE == {}
+
+    def test_changed_url_reparsed(self):
+        """Test that an edited TOTP URL replaces the cached key."""
+        get_otp_key(self.URL, "item-1")
+        key = get_otp_key(self.URL.replace("digits=6", "digits=8"), "item-1")
+        assert key.digits == 8
+        assert totp_mod.OTP_CACHE["item-1"][1].digits == 8
+
+    def test_invalidate(self):
+        """Test that invalidate drops only the given item."""
+        get_otp_key(self.URL, "item-1")
+        get_otp_key(self.URL, "item-2")
+        totp_mod.invalidate("item-1")
+        assert "item-1" not in totp_mod.OTP_CACHE
+        assert "item-2" in totp_mod.OTP_CACHE
+
+    def test_gen_otps_matches_gen_otp(self, sample_login_entry):
+        """Test that batch generation matches single generation."""
+        entries = [
+            sample_login_entry,
+            {"id": "no-totp", "login": {"totp": ""}},
+            {"id": "note", "login": None},
+        ]
+        codes = gen_otps(entries, now=1000)
+        assert list(codes) == ["test-id-123"]
+        code, remaining = codes["test-id-123"]
+        with patch("time.time", return_value=1000):
+            assert code == gen_otp(sample_login_entry["login"]["totp"])
+        assert remaining == 20
+
+
+RFC6238_SEEDS = {
+    "sha1": b"12345678901234567890",
+    "sha256": b"12345678901234567890123456789012",
+    "sha512": b"1234567890123456789012345678901234567890123456789012345678901234",
+}
+
+# RFC 6238 Appendix B: (time, {algorithm: 8 digit TOTP})
+RFC6238_VECTORS = [
+    (59, {"sha1": "94287082", "sha256": "46119246", "sha512": "90693936"}),
+    (
+        1111111109,
+        {"sha1": "07081804", "sha256": "68084774", "sha512": "25091201"},
+    ),
+    (
+        1111111111,
+        {"sha1": "14050471", "sha256": "67062674", "sha512": "99943326"},
+    ),
+    (
+        1234567890,
+        {"sha1": "89005924", "sha256": "91819424", "sha512": "93441116"},
+    ),
+    (
+        2000000000,
+        {"sha1": "69279037", "sha256": "90698825", "sha512": "38618901"},
+    ),
+    (
+        20000000000,
+        {"sha1": "65353130", "sha256": "77737706", "sha512": "47863826"},
+    ),
+]
+
+
+class TestRFCVectors:
+    """Tests against the published RFC test vectors."""
+
+    @pytest.mark.parametrize(
+        "counter,expected",
+        list(
+            enumerate(
+                [
+                    "755224",
+                    "287082",
+                    "359152",
+                    "969429",
+                    "338314",
+                    "254676",
+                    "287922",
+                    "162583",
+                    "399871",
+                    "520489",
+                ]
+            )
+        ),
+    )
+    def test_rfc4226_hotp(self, counter, expected):
+        """Test RFC 4226 Appendix D HOTP values."""
+        secret = base64.b32encode(RFC6238_SEEDS["sha1"]).decode()
+        assert hotp(secret, counter) == expected
+
+    @pytest.mark.parametrize("algorithm", ["sha1", "sha256", "sha512"])
+    @pytest.mark.parametrize("now,expected", RFC6238_VECTORS)
+    def test_rfc6238_totp(self, algorithm, now, expected):
+        """Test RFC 6238 Appendix B TOTP values via the otpauth URL."""
+        secret = base64.b32encode(RFC6238_SEEDS[algorithm]).decode()
+        otp_url = (
+            f"otpauth://totp/Test?secret={secret}&period=30&digits=8"
+            f"&algorithm={algorithm.upper()}"
+        )
+        key = parse_otp(otp_url)
+        assert key.digest == algorithm
+        assert otp_now(key, now) == expected[algorithm]
+
+
+class TestParseOTP:
+    """Tests for TOTP URL validation."""
+
+    SECRET = "JBSWY3DPEHPK3PXP"
+
+    @pytest.mark.parametrize(
+        "algorithm,digest",
+        [
+            ("SHA1", "sha1"),
+            ("SHA256", "sha256"),
+            ("sha512", "sha512"),
+            ("SHA-256", "sha256"),
+        ],
+    )
+    def test_algorithm(self, algorithm, digest):
+        """Test algorithm names are normalized."""
+        key = parse_otp(
+            f"otpauth://totp/T?secret={self.SECRET}&period=30&digits=6"
+            f"&algorithm={algorithm}"
+        )
+        assert key.digest == digest
+
+    def test_unsupported_algorithm(self):
+        """Test that an unknown algorithm is rejected, not replaced by SHA1."""
+        otp_url = (
+            f"otpauth://totp/T?secret={self.SECRET}&period=30&digits=6"
+            "&algorithm=MD5"
+        )
+        assert parse_otp(otp_url) is None
+        assert gen_otp(otp_url) == ""
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "secret=JBSWY3DP!!&period=30&digits=6",
+            "secret=JBSWY3DPEHPK3PXP&period=0&digits=6",
+            "secret=JBSWY3DPEHPK3PXP&period=abc&digits=6",
+            "secret=JBSWY3DPEHPK3PXP&period=30&digits=11",
+            "secret=JBSWY3DPEHPK3PXP&period=30&digits=0",
+        ],
+    )
+    def test_invalid_values(self, query):
+        """Test that invalid secrets, periods and digits are rejected."""
+        assert parse_otp(f"otpauth://totp/T?{query}") is None
+
+    def test_arbitrary_digits_and_period(self):
+        """Test non-default digits and period."""
+        key = parse_otp(
+            f"otpauth://totp/T?secret={self.SECRET}&period=45&digits=10"
+        )
+        assert (key.period, key.digits) == (45, 10)
+        assert len(otp_now(key, 0)) == 10
+        assert otp_now(key, 44) == otp_now(key, 0)
+        assert otp_now(key, 45) != otp_now(key, 0)
+
+    def test_bare_secret(self):
+        """Test a bare base32 secret uses RFC 6238 defaults."""
+        key = parse_otp("jbsw y3dp ehpk 3pxp")
+        assert key == OTPKey(base64.b32decode(self.SECRET), 30, 6, "sha1")
+
+    def test_steam_url(self):
+        """Test steam:// secrets match the otpauth steam encoder."""
+        steam = parse_otp(f"steam://{self.SECRET}")
+        otpauth = parse_otp(
+            f"otpauth://totp/T?secret={self.SECRET}&period=30&digits=5"
+            "&encoder=steam"
+        )
+        assert steam == otpauth
+        assert steam.steam is True
+        code = otp_now(steam, 0)
+        assert len(code) == 5
+        assert all(i in "23456789BCDFGHJKMNPQRTVWXY" for i in code)
@@ -0,0 +1,155 @@
+"""Tests for the timing spans."""
+
+import json
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from bwm import bwcli, bwserve, trace
+from bwm import bwm as bwm_main
+
+
+@pytest.fixture
+def enabled(tmp_path):
+    """Enable tracing to a file in tmp_path with an empty ring buffer"""
+    path = tmp_path / "trace.jsonl"
+    with (
+        patch("bwm.trace.ENABLED", True),
+        patch("bwm.trace.TRACE_FILE", str(path)),
+        patch.object(trace, "RECORDS", trace.RECORDS.__class__(maxlen=3)),
+    ):
+        trace.new_trace("t1")
+        yield path
+    trace._LOCAL.__dict__.clear()  # pylint: disable=protected-access
+
+
+class TestSpan:
+    """Tests for recording spans."""
+
+    def test_disabled(self):
+        """Test nothing is recorded when tracing is disabled"""
+        with patch("bwm.trace.ENABLED", False):
+            assert trace.new_trace() is None
+            assert trace.span("bw") is trace.span("serve")
+            with trace.span("bw", command="list"):
+                pass
+
+    def test_nested(self, enabled):
+        """Test spans are written to the buffer and file with their parent"""
+        with trace.span("hotkey"):
+            with trace.span("serve", endpoint="/list/object/items"):
+                pass
+        recs = trace.records("t1")
+        assert [(i["span"], i["parent"]) for i in recs] == [
+            ("serve", "hotkey"),
+            ("hotkey", None),
+        ]
+        assert recs[0]["endpoint"] == "/list/object/items"
+        assert recs[1]["ms"] >= recs[0]["ms"]
+        lines = enabled.read_text().splitlines()
+        assert [json.loads(i) for i in lines] == recs
+
+    def test_error(self, enabled):
+        """Test an exception is recorded and not swallowed"""
+        with pytest.raises(OSError):
+            with trace.span("bw"):
+                raise OSError("gone")
+        assert trace.records()[-1]["error"] == "OSError"
+
+    def test_ring(self, enabled):
+        """Test the buffer keeps the newest spans"""
+        for num in range(5):
+            with trace.span("bw", num=num):
+                pass
+        assert [i["num"] for i in trace.records()] == [2, 3, 4]
+        assert len(enabled.read_text().splitlines()) == 5
+
+    def test_threads(self, enabled):
+        """Test each thread has its own trace id and parent"""
+
+        def worker():
+            trace.new_trace("t2")
+            with trace.span("serve"):
+                pass
+
+        with trace.span("hotkey"):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            thread.join()
+        assert [
+            (i["trace"], i["span"], i["parent"]) for i in trace.records()
+        ] == [
+            ("t2", "serve", None),
+            ("t1", "hotkey", None),
+        ]
+
+    def test_traced(self, enabled):
+        """Test the decorator records each call"""
+
+        @trace.traced("type")
+        def func(val):
+            return val * 2
+
+        assert func(2) == 4
+        assert trace.records()[-1]["span"] == "type"
+
+    def test_unwritable(self, enabled, tmp_path):
+        """Test a trace file that can't be written doesn't break the span"""
+        with patch("bwm.trace.TRACE_FILE", str(tmp_path / "no" / "file")):
+            with trace.span("bw"):
+                pass
+        assert len(trace.records()) == 1
+
+
+class TestAttributes:
+    """Tests for the span attributes of bw commands and requests."""
+
+    def test_subcommand(self):
+        """Test session keys and passwords are never part of the command"""
+        assert (
+            bwcli.subcommand(
+                [
+                    "bw",
+                    "--session",
+                    "secret",
+                    "list",
+                    "items",
+                    "--nointeraction",
+                ]
+            )
+            == "list items"
+        )
+        assert bwcli.subcommand(["bw", "unlock", "--raw", "pa55word"]) == (
+            "unlock"
+        )
+        assert bwcli.subcommand(["bw", "create", "item", b"ZW5jb2RlZA"]) == (
+            "create item"
+        )
+
+    def test_endpoint(self):
+        """Test ids are removed from endpoints"""
+        url = "/object/item/0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0?x=1"
+        assert bwserve.endpoint(url) == "/object/item/{id}"
+        assert bwserve.endpoint("/list/object/items") == "/list/object/items"
+
+    def test_activation(self, enabled):
+        """Test the daemon records a hotkey press under the client trace"""
+        runner = bwm_main.DmenuRunner(MagicMock())
+        runner._begin_activation(  # pylint: disable=protected-access
+            {"trace_id": "client-1", "command": "totp"}
+        )
+        with trace.span("serve"):
+            pass
+        runner._end_activation()  # pylint: disable=protected-access
+        runner._end_activation()  # pylint: disable=protected-access
+        assert [
+            (i["trace"], i["span"], i["parent"]) for i in trace.records()
+        ] == [
+            ("client-1", "serve", "hotkey"),
+            ("client-1", "hotkey", None),
+        ]
+        assert trace.records()[-1]["command"] == "totp"
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,199 @@
+"""Tests for URI match types."""
+
+import random
+
+import pytest
+
+from bwm import urimatch
+from bwm.urimatch import (
+    DOMAIN,
+    EXACT,
+    HOST,
+    NEVER,
+    REGEX,
+    STARTS_WITH,
+    UriMatcher,
+    host_port,
+    uri_matches,
+)
+
+
+def login(item_id, *uris):
+    """Minimal login entry with (uri, match) pairs"""
+    return {
+        "id": item_id,
+        "login": {"uris": [{"uri": u, "match": m} for u, m in uris]},
+    }
+
+
+class TestHostPort:
+    """Tests for host and port extraction."""
+
+    @pytest.mark.parametrize(
+        "uri,expected",
+        [
+            ("https://Example.com/x", "example.com"),
+            ("https://example.com:8443/x", "example.com:8443"),
+            ("https://user:pw@example.com:8443/x", "example.com:8443"),
+            ("example.com:80", "example.com:80"),
+            ("https://example.com:bad/", ""),
+            ("", ""),
+        ],
+    )
+    def test_host_port(self, uri, expected):
+        """Test host with optional port"""
+        assert host_port(uri) == expected
+
+
+class TestUriMatches:
+    """Tests for single URI checks."""
+
+    URL = "https://login.example.com:8443/path?q=1"
+
+    @pytest.mark.parametrize(
+        "uri,match,expected",
+        [
+            ("https://example.com", None, True),
+            ("https://www.example.com", DOMAIN, True),
+            ("https://example.org", DOMAIN, False),
+            ("https://login.example.com:8443", HOST, True),
+            ("https://login.example.com", HOST, False),
+            ("https://login.example.com:8443/pa", STARTS_WITH, True),
+            ("https://login.example.com:8443/other", STARTS_WITH, False),
+            ("https://login.example.com:8443/path?q=1", EXACT, True),
+            ("https://login.example.com:8443/path", EXACT, False),
+            (r"LOGIN\.example\.com:\d+", REGEX, True),
+            (r"^http://", REGEX, False),
+            ("[invalid", REGEX, False),
+            ("https://login.example.com:8443/path?q=1", NEVER, False),
+        ],
+    )
+    def test_uri_matches(self, uri, match, expected):
+        """Test each match type"""
+        assert uri_matches(self.URL, uri, match) is expected
+
+    def test_default(self):
+        """Test the default match type is used when match is None"""
+        assert uri_matches("https://a.example.com", "https://example.com")
+        assert not uri_matches(
+            "https://a.example.com", "https://example.com", default=HOST
+        )
+
+
+class TestUriMatcher:
+    """Tests for vault wide URL matching."""
+
+    @pytest.fixture
+    def matcher(self):
+        """Matcher with one entry per match type"""
+        matcher = UriMatcher()
+        matcher.rebuild(
+            [
+                login("domain", ("https://example.com", None)),
+                login("host", ("https://login.example.com", HOST)),
+                login("starts", ("https://login.example.com/app", STARTS_WITH)),
+                login("exact", ("https://login.example.com/app/1", EXACT)),
+                login("regex", (r"example\.com/app/\d", REGEX)),
+                login("never", ("https://login.example.com/app/1", NEVER)),
+                login("partial", ("https://login.exa", STARTS_WITH)),
+                login("other", ("https://other.org", DOMAIN)),
+                {"id": "card", "login": None},
+            ]
+        )
+        return matcher
+
+    def test_match_ranks(self, matcher):
+        """Test all match types and their ranking"""
+        found = matcher.match("https://login.example.com/app/1")
+        assert sorted(found, key=found.get) == [
+            "exact",
+            "starts",
+            "partial",
+            "regex",
+            "host",
+            "domain",
+        ]
+
+    def test_match_subdomain(self, matcher):
+        """Test only domain rules match a different sub domain"""
+        assert matcher.match("https://www.example.com/app/1") == {
+            "domain": urimatch.RANKS[DOMAIN],
+            "regex": urimatch.RANKS[REGEX],
+        }
+
+    def test_no_match(self, matcher):
+        """Test unknown hosts and empty URLs"""
+        assert matcher.match("https://example.net") == {}
+        assert matcher.match("") == {}
+
+    def test_best_rank_per_entry(self):
+        """Test an entry with several matching URIs gets its best rank"""
+        matcher = UriMatcher()
+        matcher.add(
+            login(
+                "a",
+                ("https://example.com", DOMAIN),
+                ("https://example.com/", STARTS_WITH),
+            )
+        )
+        assert matcher.match("https://example.com/x") == {
+            "a": urimatch.RANKS[STARTS_WITH]
+        }
+
+    def test_add_remove(self, matcher):
+        """Test incremental updates"""
+        matcher.remove({"id": "domain"})
+        matcher.remove({"id": "regex"})
+        assert matcher.match("https://www.example.com/app/1") == {}
+        matcher.add(login("new", ("https://www.example.com", HOST)))
+        assert list(matcher.match("https://www.example.com/app/1")) == ["new"]
+        # Re-adding replaces the URIs of an entry
+        matcher.add(login("new", ("https://www.example.org", HOST)))
+        assert matcher.match("https://www.example.com/app/1") == {}
+
+    def test_default_match(self):
+        """Test the matcher default applies to URIs without a match type"""
+        matcher = UriMatcher(default=HOST)
+        matcher.add(login("a", ("https://example.com", None)))
+        assert matcher.match("https://www.example.com") == {}
+        assert list(matcher.match("https://example.com/x")) == ["a"]
+
+    def test_agrees_with_uri_matches(self):
+        """Test the trie finds exactly what checking every URI finds"""
+        rnd = random.Random(7)
+        hosts = [
+            "example.com",
+            "www.example.com",
+            "a.b.example.com",
+            "example.co.uk",
+            "shop.example.co.uk",
+            "example.org",
+            "10.0.0.1",
+            "localhost",
+        ]
+        entries = []
+        for num in range(200):
+            uris = []
+            for _ in range(rnd.randint(0, 4)):
+                host = rnd.choice(hosts)
+                port = rnd.choice(["", ":8080"])
+                path = rnd.choice(["", "/", "/login", "/login?x=1"])
+                match = rnd.choice([None, *range(6)])
+                uri = f"https://{host}{port}{path}"
+                if match == REGEX:
+                    uri = rnd.choice([r"example\.(com|org)/login", "[bad"])
+                uris.append((uri, match))
+            entries.append(login(str(num), *uris))
+        matcher = UriMatcher()
+        matcher.rebuild(entries)
+        for host in hosts:
+            for url in (f"https://{host}/login?x=1", f"https://{host}:8080/"):
+                expected = {
+                    i["id"]
+                    for i in entries
+                    if any(
+                        uri_matches(url, j["uri"], j["match"])
+                        for j in i["login"]["uris"]
+                    )
+                }
+                assert set(matcher.match(url)) == expected
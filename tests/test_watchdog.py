@@ -0,0 +1,85 @@
+"""Tests for the daemon watchdog."""
+
+import os
+import subprocess
+import sys
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from bwm.watchdog import Watchdog, child_processes, kill_stuck
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="uses /proc"
+)
+
+
+class TestWatchdog:
+    """Tests for Watchdog."""
+
+    def test_fires_once(self, caplog):
+        """Test a block that overruns is reported once"""
+        callback = MagicMock()
+        watchdog = Watchdog(0.05, callback, interval=0.01)
+        try:
+            with watchdog.watch("slow"):
+                time.sleep(0.2)
+        finally:
+            watchdog.stop()
+        callback.assert_called_once_with("slow")
+        assert watchdog.fired == 1
+        assert "'slow' still running" in caplog.text
+        assert "test_fires_once" in caplog.text
+
+    def test_within_budget(self):
+        """Test a block that finishes in time isn't reported"""
+        callback = MagicMock()
+        watchdog = Watchdog(0.5, callback, interval=0.01)
+        try:
+            watchdog.begin("fast")
+            time.sleep(0.05)
+            watchdog.end()
+            time.sleep(0.6)
+        finally:
+            watchdog.stop()
+        callback.assert_not_called()
+
+    def test_disabled(self):
+        """Test a 0 timeout disables the watchdog"""
+        watchdog = Watchdog(0, MagicMock())
+        with watchdog.watch("any"):
+            pass
+        assert watchdog.fired == 0
+
+
+class TestKillStuck:
+    """Tests for killing stuck child processes."""
+
+    def test_child_processes(self):
+        """Test children of this process are found"""
+        with subprocess.Popen(["sleep", "10"]) as proc:
+            try:
+                assert child_processes()[proc.pid] == "sleep"
+                assert proc.pid not in child_processes(os.getppid())
+            finally:
+                proc.kill()
+
+    def test_kill(self):
+        """Test the launcher is killed and kept processes are not"""
+        with (
+            subprocess.Popen(["sleep", "10"]) as stuck,
+            subprocess.Popen(["sleep", "10"]) as kept,
+        ):
+            try:
+                assert kill_stuck("/usr/bin/sleep", keep={kept.pid}) == [
+                    stuck.pid
+                ]
+                assert stuck.wait(timeout=5) != 0
+                assert kept.poll() is None
+            finally:
+                kept.kill()
+                stuck.kill()
+
+
+# vim: set et ts=4 sw=4 :
@@ -0,0 +1,309 @@
+"""Generate synthetic Bitwarden vaults for tests and benchmarks
+
+The output matches the JSON of `bw list items|folders|collections|
+organizations` and is the same for the same arguments and seed. Vaults have
+all four item types, nested folders, organization collections, custom fields,
+logins with many URIs, long notes and non-ASCII names:
+
+    python -m tests.vaultgen --items 10000 --seed 1 > vault.json
+
+"""
+
+import argparse
+import base64
+import json
+import random
+import sys
+import uuid
+
+WORDS = (
+    "mail bank shop cloud forum news git wiki chat photo music video game "
+    "travel tax health school work home admin vpn router printer nas"
+).split()
+UNICODE_WORDS = (
+    "Zürich",
+    "Ñandú",
+    "café",
+    "日本語",
+    "Ελληνικά",
+    "Русский",
+    "العربية",
+    "한국어",
+    "🔑",
+)
+TLDS = ("com", "org", "net", "io", "de", "co.uk")
+# Item types (login, secure note, card, identity) and their shares
+TYPES = (1, 2, 3, 4)
+TYPE_WEIGHTS = (0.75, 0.1, 0.08, 0.07)
+CARD_BRANDS = ("Visa", "Mastercard", "Amex", "Discover", None)
+TOTP_SETTINGS = (
+    "period=30&digits=6",
+    "period=30&digits=8&algorithm=SHA256",
+    "period=60&digits=6&algorithm=SHA512",
+)
+
+
+def _uuid(rnd):
+    """Random uuid string from rnd"""
+    return str(uuid.UUID(int=rnd.getrandbits(128), version=4))
+
+
+def _login(rnd, num):
+    """Login part of an item: username, password, URIs and maybe a TOTP"""
+    host = f"{rnd.choice(WORDS)}{num}.example.{rnd.choice(TLDS)}"
+    uris = [
+        {
+            "match": rnd.choice([None, None, None, 0, 1, 2, 3]),
+            "uri": f"https://{rnd.choice(['', 'www.', 'login.'])}{host}/"
+            + rnd.choice(["", "login", "account/settings"]),
+        }
+        for _ in range(
+            rnd.randint(10, 30)
+            if rnd.random() < 0.05
+            else rnd.choice([0, 1, 1, 1, 2, 3])
+        )
+    ]
+    totp = None
+    if rnd.random() < 0.2:
+        secret = base64.b32encode(rnd.randbytes(20)).decode().rstrip("=")
+        totp = f"otpauth://totp/Gen:user{num}?secret={secret}&" + rnd.choice(
+            TOTP_SETTINGS
+        )
+    return {
+        "uris": uris,
+        "username": f"user{num}@{host}",
+        "password": "".join(
+            rnd.choice("abcdefghijkmnopqrstuvwxyzABCDEFGH0123456789!@#$%")
+            for _ in range(20)
+        ),
+        "totp": totp,
+        "passwordRevisionDate": None,
+    }
+
+
+def _card(rnd, num):
+    """Card part of an item"""
+    return {
+        "cardholderName": f"Holder {num}",
+        "brand": rnd.choice(CARD_BRANDS),
+        "number": "".join(rnd.choice("0123456789") for _ in range(16)),
+        "expMonth": str(rnd.randint(1, 12)),
+        "expYear": str(rnd.randint(2024, 2034)),
+        "code": f"{rnd.randint(0, 999):03}",
+    }
+
+
+def _identity(rnd, num):
+    """Identity part of an item, with some fields left empty"""
+    first = rnd.choice(["Ann", "Bob", "Chloé", "Dmitri", "Emeka", "Fumiko"])
+    identity = {
+        "title": rnd.choice(["Mr", "Ms", "Mx", "Dr", None]),
+        "firstName": first,
+        "middleName": None,
+        "lastName": f"Person{num}",
+        "address1": f"{num} Main St",
+        "address2": None,
+        "address3": None,
+        "city": rnd.choice(["Springfield", "Zürich", "東京"]),
+        "state": None,
+        "postalCode": f"{rnd.randint(10000, 99999)}",
+        "country": rnd.choice(["US", "CH", "JP"]),
+        "company": None,
+        "email": f"{first.lower()}{num}@example.com",
+        "phone": f"555-{rnd.randint(0, 9999):04}",
+        "ssn": None,
+        "username": f"{first.lower()}{num}",
+        "passportNumber": None,
+        "licenseNumber": None,
+    }
+    for key in ("middleName", "address2", "company", "ssn", "licenseNumber"):
+        if rnd.random() < 0.3:
+            identity[key] = f"{key} {num}"
+    return identity
+
+
+def _fields(rnd, item_type):
+    """Custom fields: text, hidden, boolean and (for logins) linked ones, and
+    sometimes an autotype sequence
+
+    """
+    fields = []
+    if rnd.random() < 0.3:
+        for num in range(rnd.randint(1, 5)):
+            field_type = rnd.choice(
+                [0, 1, 2, 3] if item_type == 1 else [0, 1, 2]
+            )
+            value = {
+                0: f"value {num}",
+                1: f"hidden-{rnd.getrandbits(32):08x}",
+                2: rnd.choice(["true", "false"]),
+                3: None,
+            }[field_type]
+            fields.append(
+                {
+                    "name": f"{rnd.choice(WORDS)} {num}",
+                    "value": value,
+                    "type": field_type,
+                    "linkedId": (
+                        rnd.choice([100, 101]) if field_type == 3 else None
+                    ),
+                }
+            )
+    if item_type == 1 and rnd.random() < 0.05:
+        fields.append(
+            {
+                "name": "autotype",
+                "value": "{USERNAME}{TAB}{PASSWORD}{TAB}{TOTP}{ENTER}",
+                "type": 0,
+                "linkedId": None,
+            }
+        )
+    return fields
+
+
+def _notes(rnd, num):
+    """None, a short note or (rarely) a long multi-line note"""
+    pick = rnd.random()
+    if pick < 0.6:
+        return None
+    if pick < 0.97:
+        return f"Note {num}"
+    words = WORDS + list(UNICODE_WORDS)
+    return "\n".join(
+        " ".join(rnd.choice(words) for _ in range(12))
+        for _ in range(rnd.randint(50, 300))
+    )
+
+
+def _name(rnd, num):
+    """Item or folder name, sometimes with non-ASCII words"""
+    words = UNICODE_WORDS if rnd.random() < 0.1 else WORDS
+    return f"{rnd.choice(words).title()} {num}"
+
+
+def generate(items=100, folders=10, orgs=1, collections=5, seed=0, depth=3):
+    """Return a synthetic vault
+
+    Logins (with URIs and some TOTPs), secure notes, cards and identities are
+    spread over the folders; some are shared with the collections of the
+    organizations.
+
+    Args: items - number of items
+          folders - number of folders (besides 'No Folder'). Folders are
+                    nested by name ('Parent/Child') up to depth levels.
+          orgs - number of organizations
+          collections - number of collections per organization
+          seed - random seed
+          depth - maximum folder nesting
+    Returns: dict {items: list, folders: list, collections: list,
+             organizations: list} of bw CLI JSON objects
+
+    """
+    rnd = random.Random(seed)
+    folder_list = [{"object": "folder", "id": None, "name": "No Folder"}]
+    for num in range(folders):
+        name = _name(rnd, num)
+        parents = [
+            i["name"]
+            for i in folder_list[-10:]
+            if i["id"] and i["name"].count("/") < depth - 1
+        ]
+        if parents and rnd.random() < 0.5:
+            name = f"{rnd.choice(parents)}/{name}"
+        folder_list.append({"object": "folder", "id": _uuid(rnd), "name": name})
+    org_list = [
+        {
+            "object": "organization",
+            "id": _uuid(rnd),
+            "name": f"Org {num}",
+            "status": 2,
+            "type": 2,
+            "enabled": True,
+        }
+        for num in range(orgs)
+    ]
+    coll_list = [
+        {
+            "object": "collection",
+            "id": _uuid(rnd),
+            "organizationId": org["id"],
+            "name": f"Collection {num}",
+            "externalId": None,
+        }
+        for org in org_list
+        for num in range(collections)
+    ]
+    item_list = []
+    for num in range(items):
+        item_type = rnd.choices(TYPES, TYPE_WEIGHTS)[0]
+        colls = []
+        if coll_list and rnd.random() < 0.1:
+            org = rnd.choice(org_list)["id"]
+            own = [i for i in coll_list if i["organizationId"] == org]
+            colls = rnd.sample(own, min(len(own), rnd.randint(1, 2)))
+        item_list.append(
+            {
+                "object": "item",
+                "id": _uuid(rnd),
+                "organizationId": colls[0]["organizationId"] if colls else None,
+                "folderId": rnd.choice(folder_list)["id"],
+                "type": item_type,
+                "reprompt": 0,
+                "name": _name(rnd, num),
+                "notes": _notes(rnd, num),
+                "favorite": rnd.random() < 0.05,
+                "fields": _fields(rnd, item_type),
+                "login": _login(rnd, num) if item_type == 1 else None,
+                "secureNote": {"type": 0} if item_type == 2 else None,
+                "card": _card(rnd, num) if item_type == 3 else None,
+                "identity": _identity(rnd, num) if item_type == 4 else None,
+                "collectionIds": sorted(i["id"] for i in colls),
+                "revisionDate": "2024-01-01T00:00:00.000Z",
+                "creationDate": "2024-01-01T00:00:00.000Z",
+                "deletedDate": None,
+            }
+        )
+    return {
+        "items": item_list,
+        "folders": folder_list,
+        "collections": coll_list,
+        "organizations": org_list,
+    }
+
+
+def loaded(vault):
+    """Return a generated vault as bwm keeps it in memory
+
+    Args: vault - dict from generate()
+    Returns: items (list of Items), folders, collections, orgs (dicts by id),
+             like bwm.bwcli.get_entries
+
+    """
+    # Imported here so tests/bin/bw runs without bwm installed
+    from bwm.bwcli import Item  # pylint: disable=import-outside-toplevel
+
+    return (
+        [Item(i) for i in vault["items"]],
+        {i["id"]: i for i in vault["folders"]},
+        {i["id"]: i for i in vault["collections"]},
+        {i["id"]: i for i in vault["organizations"]},
+    )
+
+
+def main():
+    """Write a generated vault to stdout as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--folders", type=int, default=10)
+    parser.add_argument("--orgs", type=int, default=1)
+    parser.add_argument("--collections", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--depth", type=int, default=3)
+    args = parser.parse_args()
+    json.dump(generate(**vars(args)), sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
+
+# vim: set et ts=4 sw=4 :